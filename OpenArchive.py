@@ -0,0 +1,276 @@
+import argparse
+import itertools
+import json
+import os
+import struct
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+from brainflow.board_shim import BoardShim
+
+from OpenMontage import board_montage
+
+# Usage:
+#   Convert a directory    python OpenArchive.py convert data --out data/archive --board-id 2
+#   Verify archives        python OpenArchive.py verify data/archive
+#   Show metadata          python OpenArchive.py info data/archive/test.obz
+#
+# Converts the DataFilter.write_file csv files of rec_data_into_file into a compressed
+# columnar binary format, one file per worker of a process pool. Each csv is streamed in
+# chunks of --chunk samples, so memory per worker stays bounded whatever the file size.
+#
+# File layout (.obz):
+#   MAGIC | chunk 0: column 0 .. column rows-1 | chunk 1 ... | footer json | footer size | MAGIC
+#
+# Every column of a chunk is the float64 samples of one board row, byte-shuffled (all
+# first bytes, then all second bytes...) and zlib compressed; the footer holds board id,
+# sampling rate, channel map and the offset, size and crc32 of every column chunk. The
+# crc32 is taken from the parsed csv values before compression and checked again on the
+# decoded file before it replaces the output.
+
+MAGIC = b'OBCIARC1'
+EXTENSION = '.obz'
+VERSION = 1
+DEFAULT_CHUNK = 16384
+
+
+def _shuffle(column):
+    # float64 -> bytes grouped by significance: exponents and high mantissa bytes of
+    # neighbouring samples are alike and compress well together
+    return np.ascontiguousarray(column.view(np.uint8).reshape(-1, 8).T).tobytes()
+
+
+def _unshuffle(raw, num_samples):
+    return np.ascontiguousarray(np.frombuffer(raw, dtype=np.uint8).reshape(8, num_samples).T).view(np.float64)[:, 0]
+
+
+def channel_map(board_id, num_rows):
+    # BoardShim description of the board plus the electrode of every EEG row
+    try:
+        descr = BoardShim.get_board_descr(board_id)
+    except Exception:
+        descr = {}
+    montage = board_montage(board_id)
+    descr['electrodes'] = dict((str(row), name) for row, name in zip(montage.eeg_channels, montage.names))
+    descr['num_rows'] = num_rows
+    return descr
+
+
+def read_csv_chunks(csv_path, chunk_samples):
+    # DataFilter.write_file: one line per sample, tab separated board rows
+    with open(csv_path) as f:
+        while True:
+            lines = list(itertools.islice(f, chunk_samples))
+            if not lines:
+                break
+            yield np.loadtxt(lines, delimiter='\t', ndmin=2)
+
+
+class ArchiveWriter():
+    def __init__(self, path, board_id, sampling_rate, level=6):
+        self.path = path
+        self.level = level
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self.footer = {
+            'version': VERSION,
+            'board_id': int(board_id),
+            'sampling_rate': int(sampling_rate),
+            'num_rows': None,
+            'num_samples': 0,
+            'dtype': 'float64',
+            'codec': 'shuffle8+zlib',
+            'channels': None,
+            'chunks': [],
+        }
+
+    def append(self, samples):
+        # samples: (samples, rows) as parsed from the csv
+        if self.footer['num_rows'] is None:
+            self.footer['num_rows'] = samples.shape[1]
+            self.footer['channels'] = channel_map(self.footer['board_id'], samples.shape[1])
+        columns = list()
+        for row in range(samples.shape[1]):
+            column = np.ascontiguousarray(samples[:, row], dtype=np.float64)
+            packed = zlib.compress(_shuffle(column), self.level)
+            columns.append([self.file.tell(), len(packed), zlib.crc32(column.tobytes())])
+            self.file.write(packed)
+        self.footer['chunks'].append({'samples': int(samples.shape[0]), 'columns': columns})
+        self.footer['num_samples'] += int(samples.shape[0])
+
+    def close(self, source=None):
+        if source is not None:
+            self.footer['source'] = source
+        footer = json.dumps(self.footer).encode('utf-8')
+        self.file.write(footer)
+        self.file.write(struct.pack('<Q', len(footer)))
+        self.file.write(MAGIC)
+        self.file.close()
+
+
+class Archive():
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError('%s is not an archive' % path)
+            f.seek(-len(MAGIC) - 8, os.SEEK_END)
+            size = struct.unpack('<Q', f.read(8))[0]
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError('%s is truncated' % path)
+            f.seek(-len(MAGIC) - 8 - size, os.SEEK_END)
+            self.footer = json.loads(f.read(size).decode('utf-8'))
+        self.board_id = self.footer['board_id']
+        self.sampling_rate = self.footer['sampling_rate']
+        self.num_rows = self.footer['num_rows'] or 0
+        self.num_samples = self.footer['num_samples']
+        self.channels = self.footer['channels'] or {}
+
+    def _column_chunks(self, f, row, check=False):
+        for chunk in self.footer['chunks']:
+            offset, size, crc = chunk['columns'][row]
+            f.seek(offset)
+            try:
+                column = _unshuffle(zlib.decompress(f.read(size)), chunk['samples'])
+            except (zlib.error, ValueError):
+                raise ValueError('%s: corrupt chunk in row %d at byte %d' % (self.path, row, offset))
+            if check and zlib.crc32(column.tobytes()) != crc:
+                raise ValueError('%s: checksum mismatch in row %d at byte %d' % (self.path, row, offset))
+            yield column
+
+    def channel(self, row):
+        # Only the chunks of that board row are read and decompressed
+        with open(self.path, 'rb') as f:
+            chunks = list(self._column_chunks(f, row))
+        return np.concatenate(chunks) if chunks else np.zeros(0)
+
+    def data(self):
+        # (rows, samples), like DataFilter.read_file
+        data = np.empty((self.num_rows, self.num_samples))
+        for row in range(self.num_rows):
+            data[row] = self.channel(row)
+        return data
+
+    def verify(self):
+        # Decodes every column chunk and compares its crc32 with the one of the csv values
+        with open(self.path, 'rb') as f:
+            for row in range(self.num_rows):
+                for _ in self._column_chunks(f, row, check=True):
+                    pass
+        return True
+
+
+def convert_file(csv_path, out_path, board_id, chunk_samples=DEFAULT_CHUNK, level=6):
+    # Runs in a pool worker: csv -> archive, verified before it replaces out_path
+    start = time.perf_counter()
+    tmp = out_path + '.tmp'
+    writer = ArchiveWriter(tmp, board_id, BoardShim.get_sampling_rate(board_id), level)
+    try:
+        for samples in read_csv_chunks(csv_path, chunk_samples):
+            writer.append(samples)
+        writer.close({'file': os.path.basename(csv_path), 'bytes': os.path.getsize(csv_path)})
+        convert_s = time.perf_counter() - start
+        Archive(tmp).verify()
+    except BaseException:
+        writer.file.close()
+        os.remove(tmp)
+        raise
+    os.replace(tmp, out_path)
+    return {
+        'file': csv_path,
+        'samples': writer.footer['num_samples'],
+        'csv_bytes': os.path.getsize(csv_path),
+        'archive_bytes': os.path.getsize(out_path),
+        'convert_s': convert_s,
+        'total_s': time.perf_counter() - start,
+    }
+
+
+def find_csv(paths):
+    files = list()
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith('.csv'))
+        else:
+            files.append(path)
+    return files
+
+
+def convert(files, out_dir, board_id, workers, chunk_samples=DEFAULT_CHUNK, level=6):
+    os.makedirs(out_dir, exist_ok=True)
+    results = list()
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = dict((pool.submit(convert_file, path,
+                                    os.path.join(out_dir, os.path.splitext(os.path.basename(path))[0] + EXTENSION),
+                                    board_id, chunk_samples, level), path)
+                       for path in files)
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                print("Failed", futures[future], e)
+                continue
+            print('%-40s %10d samples %8.1f MB -> %7.1f MB (x%.1f) %7.1f MB/s' % (
+                os.path.basename(result['file']), result['samples'], result['csv_bytes'] / 1e6,
+                result['archive_bytes'] / 1e6, result['csv_bytes'] / max(result['archive_bytes'], 1),
+                result['csv_bytes'] / 1e6 / max(result['total_s'], 1e-9)))
+            results.append(result)
+    return results, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('convert', help='convert DataFilter.write_file csv files')
+    p.add_argument('paths', type=str, nargs='+', help='csv files or directories of csv files')
+    p.add_argument('--out', type=str, help='output directory', required=False, default='data/archive')
+    p.add_argument('--board-id', type=int, help='board of the recordings', required=False, default=2)
+    p.add_argument('--workers', type=int, help='process pool size, default all cores', required=False,
+                   default=os.cpu_count())
+    p.add_argument('--chunk', type=int, help='samples per chunk', required=False, default=DEFAULT_CHUNK)
+    p.add_argument('--level', type=int, help='zlib level 1-9', required=False, default=6)
+
+    p = sub.add_parser('verify', help='check the checksums of archives')
+    p.add_argument('paths', type=str, nargs='+', help='archives or directories of archives')
+
+    p = sub.add_parser('info', help='print the metadata of an archive')
+    p.add_argument('path', type=str)
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        files = find_csv(args.paths)
+        print("Files: %d, workers: %d" % (len(files), args.workers))
+        results, seconds = convert(files, args.out, args.board_id, args.workers, args.chunk, args.level)
+        csv_bytes = sum(r['csv_bytes'] for r in results)
+        archive_bytes = sum(r['archive_bytes'] for r in results)
+        print("Converted %d/%d files, %.1f MB -> %.1f MB (x%.1f) in %.1f s: %.1f MB/s, %.0f samples/s" % (
+            len(results), len(files), csv_bytes / 1e6, archive_bytes / 1e6, csv_bytes / max(archive_bytes, 1),
+            seconds, csv_bytes / 1e6 / max(seconds, 1e-9), sum(r['samples'] for r in results) / max(seconds, 1e-9)))
+    elif args.command == 'verify':
+        failed = 0
+        for path in args.paths:
+            names = sorted(os.path.join(path, n) for n in os.listdir(path) if n.endswith(EXTENSION)) \
+                if os.path.isdir(path) else [path]
+            for name in names:
+                try:
+                    Archive(name).verify()
+                    print("OK", name)
+                except ValueError as e:
+                    print("FAILED", e)
+                    failed += 1
+        if failed:
+            exit(1)
+    elif args.command == 'info':
+        archive = Archive(args.path)
+        footer = dict(archive.footer)
+        footer['chunks'] = len(footer['chunks'])
+        print(json.dumps(footer, indent=1))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,5 @@
 import argparse
 from contextlib import nullcontext
-import pyqtgraph as pg
-from pyqtgraph.Qt import QtGui, QtCore 
 import PySimpleGUI as sg
 import numpy as np
 
@@ -9,31 +7,35 @@ import brainflow
 from brainflow.board_shim import BoardShim, BrainFlowInputParams, LogLevels, BoardIds
 from brainflow.data_filter import DataFilter, DetrendOperations, FilterTypes
 
+from OpenSampleBus import BusBoard
+from OpenViewer import Viewer
+from OpenMontage import board_montage
+
 # Usage:
 #   TESTING          python OpenBCI.py
 #   OPENBCI DATA     python OpenBCI.py --board-id 2 --serial-port COM5
 #                       NOTE: COM5 depends on port available in your Device Manager
 
+VIEW = 'OpenBCI'
+
 class Graph():
-    def __init__(self, board_shim):
+    def __init__(self, board_shim, viewer=None):
         self.board_id = board_shim.get_board_id()
         self.board_shim = board_shim
         self.sampling_rate = BoardShim.get_sampling_rate(self.board_id)
         self.update_speed_ms = 50
         self.window_size = 4
         self.num_points = self.window_size * self.sampling_rate
+        # Only the C3 and C4 rows are fetched each tick
+        self.channels = board_montage(self.board_id).subset(['C3', 'C4'])
 
-        self.app = QtGui.QApplication([])
-        self.win = pg.GraphicsWindow(title='BrainFlow Plot',size=(800, 600))
-        self.win.setBackground('w')
+        # Plots are built once into this view of the viewer, Viewer.open shows them
+        self.viewer = viewer if viewer is not None else Viewer(size=(800, 600))
+        self.app = self.viewer.app
+        self.win = self.viewer.layout(VIEW)
 
         self._init_timeseries()
 
-        timer = QtCore.QTimer()
-        timer.timeout.connect(self.update)
-        timer.start(self.update_speed_ms)
-        QtGui.QApplication.instance().exec_()
-
 
     def _init_timeseries(self):
         self.plots = list()
@@ -93,11 +95,11 @@ class Graph():
         plotCharC3Filtered = 2
         plotCharC4Filtered = 3
 
-        # Channel Vars
-        channelC3 = 9
-        channelC4 = 11
+        # Channel Vars (rows of the fetched subset)
+        channelC3 = 0
+        channelC4 = 1
 
-        data = self.board_shim.get_current_board_data(self.num_points)
+        data = self.channels.fetch(self.board_shim, self.num_points)
 
         # Plot timeseries C3 Raw Data
         DataFilter.detrend(data[channelC3], DetrendOperations.CONSTANT.value)
@@ -145,7 +147,7 @@ def rec_data_into_file(data_rec):
     print("Data recorded")
 
 
-def stream_window(board):
+def stream_window(board, viewer):
     # https://arxiv.org/ftp/arxiv/papers/1312/1312.2877.pdf
     # Data Adquisition: C3 i C4
     # Preprocessing: 
@@ -153,7 +155,8 @@ def stream_window(board):
     #   b. Frequency filtering 
     #       b1. Butterworth.Remove Direct Current: Band pass filter from 0.5 Hz to 90 Hz
     #       b2. Noise Reduction: Notch filter 50 Hz & 60 Hz
-    Graph(board)
+    # Same window and plots on every click, only built the first time
+    viewer.open(VIEW, Graph, board)
     rec_data_into_file(board.get_board_data())
     
 
@@ -175,6 +178,8 @@ def main():
     parser.add_argument('--board-id', type=int, help='board id, check docs to get a list of supported boards',
                         required=False, default=BoardIds.SYNTHETIC_BOARD)
     parser.add_argument('--file', type=str, help='file', required=False, default='')
+    parser.add_argument('--bus', type=str, help='attach to the stream of OpenSampleBus.py instead of the board',
+                        required=False, default='')
     args = parser.parse_args()
 
     params = BrainFlowInputParams()
@@ -192,12 +197,18 @@ def main():
     sampling_rate = BoardShim.get_sampling_rate(board_id)
     sampling_power_of_two = DataFilter.get_nearest_power_of_two(sampling_rate)
     BoardShim.log_message(LogLevels.LEVEL_INFO.value, 'SamplingRate:' + str(sampling_rate))
-    board = BoardShim(board_id, params)
-    BoardShim.log_message(LogLevels.LEVEL_INFO.value, 'DataFilter:' + str(sampling_power_of_two))
-    board.prepare_session()
-    board.start_stream(sampling_power_of_two)
+    if args.bus:
+        # Shared stream published by OpenSampleBus.py, no second board session
+        board = BusBoard(args.bus)
+    else:
+        board = BoardShim(board_id, params)
+        BoardShim.log_message(LogLevels.LEVEL_INFO.value, 'DataFilter:' + str(sampling_power_of_two))
+        board.prepare_session()
+        board.start_stream(sampling_power_of_two)
     BoardShim.log_message(LogLevels.LEVEL_INFO.value, 'start sleeping in the main thread')
 
+    viewer = Viewer(size=(800, 600))
+
     layout = [ 
         [sg.Button('Stream Electrodes', size=(100,1), key="stream")]
      ]
@@ -207,7 +218,7 @@ def main():
         event, values = window.read()
     
         if event == "stream":
-            stream_window(board)
+            stream_window(board, viewer)
 
         if event == sg.WIN_CLOSED:
             if board.is_prepared():
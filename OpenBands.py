@@ -0,0 +1,157 @@
+import argparse
+import numpy as np
+
+from OpenClassifier import BANDS, LinearClassifier, electrode_rows
+
+# Usage:
+#   Train while calibrating:   python OpenCalibration.py --bands data/bands.npz --windows data/calibration_windows.npz
+#   Use in the control loop:   python OpenDroneUpDown.py --bands data/bands.npz
+#   Retrain from saved windows python OpenBands.py data/calibration_windows.npz data/bands.npz
+#
+# Band power detector for the control path. Instead of an FFT of the whole window every
+# tick, sliding DFT bins are kept for the frequencies of the configured bands (mu, low and
+# high beta) only, updated with the new samples of each tick like OpenCSP/OpenQuality:
+# O(bins) per new sample. The Hann window is applied in the frequency domain
+# (0.5 X[k] - 0.25 X[k-1] - 0.25 X[k+1]), so the neighbouring bins are kept as well.
+# The log band powers are the same as window_powers() of the whole window and feed a
+# LinearClassifier trained on the calibration windows. The full FFT is only for display.
+
+DETECTOR_ELECTRODES = ['C3', 'C4']
+
+
+def band_bins(sampling_rate, window, bands=BANDS):
+    # rfft bins of each band, as the frequency masks of OpenClassifier.band_powers
+    freqs = np.fft.rfftfreq(window, 1.0 / sampling_rate)
+    return [np.flatnonzero((freqs >= low) & (freqs <= high)) for low, high in bands]
+
+
+def window_powers(windows, sampling_rate, bands=BANDS):
+    # windows: (..., samples) -> log band power (..., bands) of the whole window with a
+    # periodic Hann window: what BandDetector keeps up to date sample by sample
+    num_samples = windows.shape[-1]
+    hann = 0.5 - 0.5 * np.cos(2 * np.pi * np.arange(num_samples) / num_samples)
+    power = np.abs(np.fft.rfft(windows * hann, axis=-1)) ** 2 / num_samples
+    out = np.empty(windows.shape[:-1] + (len(bands),))
+    for i, bins in enumerate(band_bins(sampling_rate, num_samples, bands)):
+        out[..., i] = np.log10(power[..., bins].mean(axis=-1) + 1e-12)
+    return out
+
+
+class BandDetector():
+    def __init__(self, rows, sampling_rate, window, bands=BANDS):
+        self.rows = list(rows)
+        self.sampling_rate = sampling_rate
+        self.window = int(window)
+        self.bands = [tuple(band) for band in bands]
+        self.classifier = LinearClassifier(rows, sampling_rate, self.bands)
+
+        # Raw bins needed: every band bin and its two neighbours (Hann in frequency domain)
+        per_band = band_bins(sampling_rate, self.window, self.bands)
+        hann_bins = np.concatenate(per_band)
+        self.bins = np.unique(np.concatenate((hann_bins - 1, hann_bins, hann_bins + 1)) % self.window)
+        position = dict((int(b), i) for i, b in enumerate(self.bins))
+        # hann: (band bins, raw bins), average: (bands, band bins)
+        self.hann = np.zeros((len(hann_bins), len(self.bins)))
+        for i, b in enumerate(hann_bins):
+            self.hann[i, position[int(b)]] += 0.5
+            self.hann[i, position[int(b - 1) % self.window]] -= 0.25
+            self.hann[i, position[int(b + 1) % self.window]] -= 0.25
+        self.average = np.zeros((len(per_band), len(hann_bins)))
+        start = 0
+        for i, bins in enumerate(per_band):
+            self.average[i, start:start + len(bins)] = 1.0 / len(bins)
+            start += len(bins)
+        # rotation[b, i] = exp(j 2 pi bin i / N), i = 0..N
+        self.rotation = np.exp(2j * np.pi * np.outer(self.bins, np.arange(self.window + 1)) / self.window)
+        self.reset()
+
+    def reset(self):
+        self.ring = np.zeros((len(self.rows), self.window))
+        self.pos = 0
+        self.count = 0
+        self.dft = np.zeros((len(self.rows), len(self.bins)), dtype=np.complex128)
+
+    @property
+    def ready(self):
+        return self.count == self.window
+
+    def push(self, block):
+        # block: (len(rows), new samples) of raw EEG. A constant electrode offset falls in
+        # bin 0 of the window and does not leak into the band bins.
+        if block.shape[-1] == 0:
+            return
+        block = np.asarray(block, dtype=np.float64)
+        if block.shape[-1] > self.window:
+            block = block[:, -self.window:]
+        k = block.shape[-1]
+        idx = (self.pos + np.arange(k)) % self.window
+        leaving = self.ring[:, idx]
+        # Sliding DFT, k steps at once: S <- S w^k + sum_i (x_i - x_i-N) w^(k - i)
+        self.dft = self.dft * self.rotation[:, k] + (block - leaving) @ self.rotation[:, k:0:-1].T
+        self.ring[:, idx] = block
+        self.count = min(self.count + k, self.window)
+        self.pos = (self.pos + k) % self.window
+        if self.pos < k:
+            # Once per window length, drop the drift of the recursion
+            ordered = np.roll(self.ring, -self.pos, axis=-1)
+            self.dft = ordered @ self.rotation[:, self.window:0:-1].T
+
+    def powers(self):
+        # (rows, bands) log band power of the last window
+        power = np.abs(self.dft @ self.hann.T) ** 2 / self.window
+        return np.log10(power @ self.average.T + 1e-12)
+
+    def features(self):
+        return self.powers().reshape(-1)
+
+    def predict(self):
+        # No movement until a whole window has been seen
+        return self.ready and bool(self.classifier.predict(self.features()))
+
+    def train(self, calm_windows, move_windows):
+        # *_windows: (windows, len(rows), window) raw EEG, label 0 = calm, 1 = move
+        x0 = window_powers(np.asarray(calm_windows, dtype=np.float64), self.sampling_rate, self.bands)
+        x1 = window_powers(np.asarray(move_windows, dtype=np.float64), self.sampling_rate, self.bands)
+        x0 = x0.reshape(len(x0), -1)
+        x1 = x1.reshape(len(x1), -1)
+        self.classifier.fit(x0, x1)
+        self.reset()
+        return self.classifier.score(x0, x1)
+
+    def save(self, path):
+        np.savez(path, rows=self.rows, sampling_rate=self.sampling_rate, window=self.window, bands=self.bands,
+                 weights=self.classifier.weights, bias=self.classifier.bias)
+
+    @classmethod
+    def load(cls, path):
+        f = np.load(path)
+        detector = cls(f['rows'].tolist(), int(f['sampling_rate']), int(f['window']), f['bands'].tolist())
+        detector.classifier.weights = f['weights']
+        detector.classifier.bias = float(f['bias'])
+        return detector
+
+
+def train_from_file(windows_path, model_path, electrodes=DETECTOR_ELECTRODES, board_id=2):
+    f = np.load(windows_path)
+    rows = f['rows'].tolist()
+    detector_rows = electrode_rows(board_id, electrodes)
+    idx = [rows.index(row) for row in detector_rows]
+    detector = BandDetector(detector_rows, int(f['sampling_rate']), f['calm'].shape[-1])
+    accuracy = detector.train(f['calm'][:, idx], f['move'][:, idx])
+    print("Band detector: %d bins, training accuracy: %.3f" % (len(detector.bins), accuracy))
+    detector.save(model_path)
+    return detector
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('windows', type=str, help='calibration windows saved by OpenCalibration.py')
+    parser.add_argument('model', type=str, help='output band detector file')
+    parser.add_argument('--electrodes', type=str, nargs='+', required=False, default=DETECTOR_ELECTRODES)
+    parser.add_argument('--board-id', type=int, help='board of the calibration', required=False, default=2)
+    args = parser.parse_args()
+    train_from_file(args.windows, args.model, args.electrodes, args.board_id)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import argparse
+import math
+import sys
+import numpy as np
+
+# Usage:
+#   python OpenDroneUpDown.py --board-id 2 --serial-port COM5 --adaptive
+#   python OpenDroneTakeoffLand.py --board-id 2 --serial-port COM5 --adaptive --baseline-z 2.5
+#   Step check              python OpenBaseline.py --shift 0.5
+#
+# Online baseline of the control feature instead of the fixed deviation limits
+# (108194 up/down, 30000 takeoff/land), which drift out of calibration as the electrode
+# impedance changes. An exponentially weighted mean and variance of the calm feature are
+# kept in O(1) per update, and movement is a z-score above z_limit. The feature is
+# log10(deviation): an impedance change scales the FFT, a log turns that into a shift
+# the baseline follows. While movement is detected the baseline is frozen, for at most
+# `hold` seconds so a lasting change of level is learnt as the new calm.
+
+
+class AdaptiveBaseline():
+    def __init__(self, halflife=30.0, z_limit=3.0, freeze=True, hold=10.0, warmup=5.0):
+        # halflife, hold and warmup are in seconds, converted to updates by start()
+        self.halflife = halflife
+        self.z_limit = z_limit
+        self.freeze = freeze
+        self.hold = hold
+        self.warmup = warmup
+        self.start(20.0)
+
+    def start(self, rate):
+        # rate: updates per second of the Graph (1000 / update_speed_ms)
+        self.alpha = 1.0 - 0.5 ** (1.0 / (self.halflife * rate))
+        self.hold_updates = int(self.hold * rate)
+        self.warmup_updates = max(int(self.warmup * rate), 2)
+        self.reset()
+
+    def reset(self):
+        self.mean = 0.0
+        self.var = 0.0
+        self.count = 0
+        self.frozen = 0
+        self.z = 0.0
+
+    @property
+    def ready(self):
+        return self.count >= self.warmup_updates
+
+    def update(self, deviation):
+        # One new value of the feature -> movement decision
+        x = math.log10(deviation + 1e-12)
+        if self.count == 0:
+            self.mean = x
+        std = math.sqrt(self.var)
+        self.z = (x - self.mean) / std if std > 0 else 0.0
+        movement = self.ready and self.z > self.z_limit
+
+        if movement and self.freeze and self.frozen < self.hold_updates:
+            self.frozen += 1
+            return movement
+        # The hold only ends when the movement does; past it the baseline keeps learning
+        # every update until a lasting change of level is no longer a movement
+        if not movement:
+            self.frozen = 0
+        # West's exponentially weighted mean and variance
+        diff = x - self.mean
+        incr = self.alpha * diff
+        self.mean += incr
+        self.var = (1.0 - self.alpha) * (self.var + diff * incr)
+        self.count += 1
+        return movement
+
+    def limit(self):
+        # Deviation at which movement is detected now, for display
+        return 10 ** (self.mean + self.z_limit * self.var ** 0.5)
+
+
+def step_check(baseline, rate=20.0, shift=0.5, calm_s=120.0, after_s=300.0, noise=0.05, seed=0):
+    # Calm log-normal deviations, then a lasting level change of shift decades. Returns the
+    # fraction of calm updates taken as movement and the seconds after the step of the
+    # last update still taken as movement (0 when none)
+    rng = np.random.default_rng(seed)
+    baseline.start(rate)
+    calm = [baseline.update(10 ** (5.0 + noise * rng.standard_normal())) for _ in range(int(calm_s * rate))]
+    warm = int(baseline.warmup_updates)
+    after = [baseline.update(10 ** (5.0 + shift + noise * rng.standard_normal())) for _ in range(int(after_s * rate))]
+    moving = np.flatnonzero(after)
+    settle = (moving[-1] + 1) / rate if len(moving) else 0.0
+    return float(np.mean(calm[warm:])), settle
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--shift', type=float, help='level change in decades', required=False, default=0.5)
+    parser.add_argument('--halflife', type=float, required=False, default=30.0)
+    parser.add_argument('--hold', type=float, required=False, default=10.0)
+    parser.add_argument('--half-lives', type=float, help='allowed settling after the hold', required=False,
+                        default=3.0)
+    args = parser.parse_args()
+
+    false_rate, settle = step_check(AdaptiveBaseline(args.halflife, hold=args.hold), shift=args.shift)
+    allowed = args.hold + args.half_lives * args.halflife
+    print("Calm updates taken as movement: %.1f%%" % (100 * false_rate))
+    print("Step of %.2f decades learnt after %.1f s (allowed %.1f s)" % (args.shift, settle, allowed))
+    sys.exit(0 if settle <= allowed else 1)
+
+
+if __name__ == "__main__":
+    main()
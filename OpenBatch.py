@@ -0,0 +1,177 @@
+import argparse
+import time
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from OpenClassifier import BANDS, band_powers, electrode_rows
+from OpenFilters import sosfilt
+from OpenMontage import board_montage
+from OpenPipeline import DEFAULT_PARAMS, filter_channel, filter_sos, fft_deviation, make_params, tick_ends
+from OpenPrecision import synthetic_eeg
+from OpenSessionStore import DEFAULT_ROOT, SessionStore
+
+try:
+    from scipy import fft as _fft
+except ImportError:
+    _fft = np.fft
+
+# Usage:
+#   Features of a session     python OpenBatch.py session calib_01 --out data/calib_01_features.npz
+#   Compare with live path    python OpenBatch.py session calib_01 --check 200
+#   Speed on an hour of EEG   python OpenBatch.py benchmark --seconds 3600 --channels 16
+#
+# Batch version of the control path for offline analysis. Every tick of Graph.update
+# (the last window_size seconds, every update_speed_ms, on the sample grid of
+# OpenPipeline.tick_ends) is one window of a strided view over the recording: nothing is
+# copied until the windows of a batch are gathered to be filtered. Each batch goes through the filters of filter_channel
+# as one SOS cascade (OpenPipeline.filter_sos, zero initial state like DataFilter), one
+# FFT call and the reductions, so the loop runs over batches and not windows.
+#
+# Per window and channel: the FFT deviation of the drone scripts (std of |FFT| of the
+# filtered window, from the half spectrum) and the log band powers of the raw window
+# (LinearClassifier features). Deviations match the live path (replay, BrainFlow
+# DataFilter) to about 1e-7 relative, the difference of the filter coefficients.
+
+DEFAULT_BATCH = 256
+
+
+def sliding_windows(data, num_points):
+    # data: (channels, samples) -> (channels, starts, num_points) view of every window, no copy
+    return sliding_window_view(data, num_points, axis=-1)
+
+
+def filter_windows(windows, sampling_rate, params=DEFAULT_PARAMS):
+    # (..., samples) -> filtered copy: detrend, band pass and notches of filter_channel
+    dtype = np.dtype(params['dtype'])
+    x = np.array(windows, dtype=dtype)
+    x -= x.mean(axis=-1, keepdims=True)
+    sos = filter_sos(sampling_rate, params['bandpass'], params['notches'], params['notch_width'], dtype)
+    return sosfilt(sos, x, np.zeros((len(sos),) + x.shape[:-1] + (2,), dtype=dtype))
+
+
+def fft_deviations(filtered):
+    # (..., samples) -> std of |FFT| over the full spectrum, as fft_deviation, from rfft:
+    # the bins between 0 and Nyquist appear twice in the full spectrum
+    num_samples = filtered.shape[-1]
+    magnitude = np.abs(_fft.rfft(filtered, axis=-1))
+    weight = np.full(magnitude.shape[-1], 2.0)
+    weight[0] = 1.0
+    if num_samples % 2 == 0:
+        weight[-1] = 1.0
+    mean = magnitude @ weight / num_samples
+    square = (magnitude * magnitude) @ weight / num_samples
+    return np.sqrt(np.maximum(square - mean * mean, 0.0))
+
+
+def batch_features(data, sampling_rate, params=DEFAULT_PARAMS, bands=BANDS, batch=DEFAULT_BATCH):
+    # data: (channels, samples) -> ends (windows,), deviation (windows, channels) and band
+    # powers (windows, channels, bands) of every tick of the recording
+    data = np.ascontiguousarray(data)
+    num_points = int(params['window_size'] * sampling_rate)
+    ends = tick_ends(data.shape[-1], sampling_rate, params)
+    deviation = np.empty((len(ends), data.shape[0]))
+    powers = np.empty((len(ends), data.shape[0], len(bands)))
+    if len(ends) == 0:
+        return ends, deviation, powers
+    windows = sliding_windows(data, num_points)
+    for start in range(0, len(ends), batch):
+        # Only the windows of this batch are gathered from the view
+        block = windows[:, ends[start:start + batch] - num_points].transpose(1, 0, 2)
+        deviation[start:start + len(block)] = fft_deviations(filter_windows(block, sampling_rate, params))
+        powers[start:start + len(block)] = band_powers(block, sampling_rate, bands)
+    return ends, deviation, powers
+
+
+def live_deviation(data, sampling_rate, end, params=DEFAULT_PARAMS):
+    # One window through the live path (filter_channel + fft_deviation), per channel
+    num_points = int(params['window_size'] * sampling_rate)
+    out = np.empty(data.shape[0])
+    for channel in range(data.shape[0]):
+        window = np.array(data[channel, end - num_points:end], dtype=params['dtype'])
+        filter_channel(window, sampling_rate, params['bandpass'], params['notches'], params['notch_width'])
+        out[channel] = fft_deviation(window)[0]
+    return out
+
+
+def live_ticks(num_samples, sampling_rate, params=DEFAULT_PARAMS):
+    # Tick ends of a live Graph, stepped one update at a time like OpenRegression
+    # advances its board, independently of tick_ends
+    num_points = int(params['window_size'] * sampling_rate)
+    step = params['update_speed_ms'] * sampling_rate / 1000.0
+    ends = list()
+    position = num_points
+    tick = 0
+    while position <= num_samples:
+        ends.append(position)
+        position += int(round((tick + 1) * step)) - int(round(tick * step))
+        tick += 1
+    return np.array(ends, dtype=int)
+
+
+def check(data, sampling_rate, ends, deviation, count, params=DEFAULT_PARAMS):
+    # Whether the windows end on the live ticks, and the largest relative difference with
+    # the live path over count windows spread over the recording
+    live = live_ticks(data.shape[-1], sampling_rate, params)
+    on_ticks = len(live) == len(ends) and bool(np.array_equal(live, ends))
+    picks = np.unique(np.linspace(0, len(ends) - 1, min(count, len(ends))).astype(int))
+    worst = 0.0
+    for i in picks:
+        value = live_deviation(data, sampling_rate, ends[i], params)
+        worst = max(worst, float(np.max(np.abs(deviation[i] - value) / np.maximum(np.abs(value), 1e-12))))
+    return on_ticks, len(picks), worst
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('session', help='features of every tick of a recorded session')
+    p.add_argument('name', type=str)
+    p.add_argument('--root', type=str, help='session store directory', required=False, default=DEFAULT_ROOT)
+    p.add_argument('--electrodes', type=str, nargs='*', help='default every EEG channel', required=False, default=None)
+    p.add_argument('--check', type=int, help='compare that many windows with the live path', required=False,
+                   default=0)
+    p.add_argument('--out', type=str, help='save ends, deviation and band powers as npz', required=False, default='')
+
+    p = sub.add_parser('benchmark', help='time on synthetic EEG')
+    p.add_argument('--seconds', type=float, required=False, default=3600)
+    p.add_argument('--channels', type=int, required=False, default=16)
+    p.add_argument('--sampling-rate', type=int, required=False, default=125)
+    p.add_argument('--check', type=int, required=False, default=20)
+
+    for p in sub.choices.values():
+        p.add_argument('--window-size', type=float, required=False, default=DEFAULT_PARAMS['window_size'])
+        p.add_argument('--batch', type=int, help='windows per batch', required=False, default=DEFAULT_BATCH)
+        p.add_argument('--float32', action='store_true', help='single precision path')
+    args = parser.parse_args()
+    params = make_params(window_size=args.window_size, dtype='float32' if args.float32 else 'float64')
+
+    if args.command == 'session':
+        session = SessionStore(args.root).open(args.name)
+        sampling_rate = session.sampling_rate
+        if args.electrodes:
+            rows = electrode_rows(session.board_id, args.electrodes)
+        else:
+            rows = board_montage(session.board_id).eeg_channels
+        # Sample-major on disk, channel-major for the windows
+        data = np.ascontiguousarray(session.data[:, rows].T, dtype=np.float64)
+    else:
+        sampling_rate = args.sampling_rate
+        data = synthetic_eeg(sampling_rate, args.seconds, args.channels)
+
+    start = time.perf_counter()
+    ends, deviation, powers = batch_features(data, sampling_rate, params, batch=args.batch)
+    seconds = time.perf_counter() - start
+    print("%d channels, %.0f s of EEG, %d windows: %.2f s (%.0f windows/s)" % (
+        data.shape[0], data.shape[1] / float(sampling_rate), len(ends), seconds, len(ends) / max(seconds, 1e-9)))
+    if args.check:
+        on_ticks, checked, worst = check(data, sampling_rate, ends, deviation, args.check, params)
+        print("Windows on the live ticks: %s" % ('yes' if on_ticks else 'NO'))
+        print("Live path, %d windows: max relative difference of the deviation %.2g" % (checked, worst))
+    if args.command == 'session' and args.out:
+        np.savez(args.out, ends=ends, deviation=deviation, band_powers=powers, rows=rows,
+                 sampling_rate=sampling_rate)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+import argparse
+import time
+import numpy as np
+import pyqtgraph as pg
+from pyqtgraph.Qt import QtGui, QtCore
+
+from brainflow.board_shim import BoardShim
+
+import OpenBCI
+import OpenFFT
+import RealTimePlot
+from OpenMontage import board_montage
+from OpenPipeline import DEFAULT_PARAMS, fft_deviation, filter_channel, tick_ends
+from OpenSessionStore import DEFAULT_ROOT, SessionStore
+from OpenViewer import Viewer
+
+# Usage:
+#   python OpenBrowser.py flight_03
+#   python OpenBrowser.py flight_03 --view RealTimePlot --start 120 --speed 0.5
+#
+# Plays a recorded session of the SessionStore through the plot layouts of the live
+# scripts: C3/C4 raw and filtered (OpenBCI), C4 raw, filtered and FFT (OpenFFT) and the
+# 16-channel grid (RealTimePlot). Their Graph classes are used as they are, a
+# SessionBoard stands in for BoardShim and returns the window before the playback
+# position, read from the memory-mapped recording. Seek with the slider, change the
+# speed or pause; the position follows the wall clock times the speed.
+#
+# Below the plots, the deviation of C4 (OpenPipeline, as the drone scripts compute it)
+# and the decision against --deviation-limit are drawn for the ticks of the visible
+# window, with the markers of the session (takeoff, up, down, hold...). Each tick is
+# computed the first time it becomes visible and kept, nothing is computed ahead.
+
+VIEWS = {'OpenBCI': OpenBCI.Graph, 'OpenFFT': OpenFFT.Graph, 'RealTimePlot': RealTimePlot.Graph}
+SPEEDS = ['0.25', '0.5', '1', '2', '4', '8']
+# Deviation ticks kept before the cache starts over
+MAX_TICKS = 20000
+
+
+class SessionBoard():
+    # BoardShim stand-in over a recorded session: the samples before a playback position
+    # that moves with the wall clock times the speed while playing
+    def __init__(self, session):
+        self.session = session
+        self.data = session.data
+        self.num_samples = len(session.data)
+        self.sampling_rate = session.sampling_rate
+        # Single precision recordings keep timestamps relative to the first sample
+        self.timestamp_channel = BoardShim.get_timestamp_channel(session.board_id)
+        self.timestamp_offset = session.index.get('timestamp_offset', 0.0)
+        self.speed = 1.0
+        self.playing = False
+        self.anchor = 0
+        self.anchor_time = time.perf_counter()
+
+    @property
+    def position(self):
+        if not self.playing:
+            return self.anchor
+        elapsed = time.perf_counter() - self.anchor_time
+        position = self.anchor + int(elapsed * self.speed * self.sampling_rate)
+        if position >= self.num_samples:
+            self.seek(self.num_samples)
+            self.playing = False
+        return min(position, self.num_samples)
+
+    def seek(self, sample):
+        self.anchor = min(max(int(sample), 0), self.num_samples)
+        self.anchor_time = time.perf_counter()
+
+    def play(self, playing=True):
+        self.seek(self.position)
+        self.playing = playing
+
+    def set_speed(self, speed):
+        self.seek(self.position)
+        self.speed = speed
+
+    def get_board_id(self):
+        return self.session.board_id
+
+    def _window_end(self, num_samples):
+        # Before the first full window (start of the session, slider at the left) the first
+        # window is served: the Graphs filter what they get and fail on empty rows
+        return min(max(self.position, num_samples), self.num_samples)
+
+    def get_current_board_data(self, num_samples):
+        # (rows, samples) float64 copy, like BoardShim
+        end = self._window_end(num_samples)
+        window = np.array(self.data[max(end - num_samples, 0):end].T, dtype=np.float64, order='C')
+        window[self.timestamp_channel] += self.timestamp_offset
+        return window
+
+    def get_current_rows(self, index, num_samples):
+        # Copy of only some rows (OpenMontage.ChannelSubset)
+        end = self._window_end(num_samples)
+        return np.array(self.data[max(end - num_samples, 0):end, index].T, dtype=np.float64, order='C')
+
+    def get_board_data_count(self):
+        return self.position
+
+    def get_board_data(self):
+        return self.get_current_board_data(self.position)
+
+    def insert_marker(self, value):
+        pass
+
+    def is_prepared(self):
+        return True
+
+    def release_session(self):
+        pass
+
+
+class DecisionTrace():
+    # Deviation of the control channel per tick, as Graph.update of the drone scripts
+    # computes it, for the ticks ending in a range of samples only
+    def __init__(self, session, params=DEFAULT_PARAMS):
+        self.params = params
+        self.sampling_rate = session.sampling_rate
+        self.signal = session.channel(board_montage(session.board_id).row('C4'))
+        self.num_points = int(params['window_size'] * self.sampling_rate)
+        self.step = params['update_speed_ms'] * self.sampling_rate / 1000.0
+        self.deviations = dict()
+
+    def deviation(self, end):
+        if end not in self.deviations:
+            if len(self.deviations) >= MAX_TICKS:
+                self.deviations.clear()
+            window = np.array(self.signal[end - self.num_points:end], dtype=self.params['dtype'])
+            filter_channel(window, self.sampling_rate, self.params['bandpass'], self.params['notches'],
+                           self.params['notch_width'])
+            self.deviations[end] = fft_deviation(window)[0]
+        return self.deviations[end]
+
+    def trace(self, start, stop):
+        # Tick ends on the live grid, so the same ticks are found again after a seek
+        ends = tick_ends(stop, self.sampling_rate, self.params, start)
+        deviations = np.array([self.deviation(int(end)) for end in ends])
+        return ends, deviations, deviations > self.params['deviation_limit']
+
+
+class Browser():
+    def __init__(self, session, view='OpenBCI', params=DEFAULT_PARAMS):
+        self.session = session
+        self.board = SessionBoard(session)
+        self.trace = DecisionTrace(session, params)
+        self.sampling_rate = session.sampling_rate
+        self.limit = params['deviation_limit']
+
+        self.viewer = Viewer(title='Session %s' % session.name, size=(800, 600))
+        self.app = self.viewer.app
+        self.window = QtGui.QWidget()
+        self.window.setWindowTitle('Session %s' % session.name)
+        self.window.resize(1200, 900)
+        layout = QtGui.QVBoxLayout(self.window)
+
+        controls = QtGui.QHBoxLayout()
+        self.views = QtGui.QComboBox()
+        self.views.addItems(list(VIEWS))
+        self.views.setCurrentText(view)
+        self.views.currentTextChanged.connect(self.show_view)
+        self.play_button = QtGui.QPushButton('Play')
+        self.play_button.clicked.connect(self.toggle)
+        self.speeds = QtGui.QComboBox()
+        self.speeds.addItems([speed + 'x' for speed in SPEEDS])
+        self.speeds.setCurrentText('1x')
+        self.speeds.currentTextChanged.connect(lambda text: self.board.set_speed(float(text[:-1])))
+        self.slider = QtGui.QSlider(QtCore.Qt.Horizontal)
+        self.slider.setRange(0, max(self.board.num_samples, 1))
+        self.slider.valueChanged.connect(self.seek)
+        self.time_label = QtGui.QLabel()
+        for widget in (self.views, self.play_button, self.speeds):
+            controls.addWidget(widget)
+        controls.addWidget(self.slider, 1)
+        controls.addWidget(self.time_label)
+        layout.addLayout(controls)
+
+        # The viewer window becomes the upper part of the browser
+        layout.addWidget(self.viewer.win, 3)
+
+        self.overlay = pg.PlotWidget()
+        self.overlay.setBackground('w')
+        self.overlay.setMenuEnabled(False)
+        self.overlay.setLabel('left', 'C4 deviation')
+        self.overlay.setLabel('bottom', 's')
+        self.deviation_curve = self.overlay.plot(pen=pg.mkPen((20, 20, 120), width=2))
+        self.decision_curve = self.overlay.plot(pen=pg.mkPen((220, 80, 80, 120)), fillLevel=0, brush=(220, 80, 80, 60),
+                                                stepMode='center')
+        self.overlay.addItem(pg.InfiniteLine(self.limit, angle=0, pen=pg.mkPen((200, 0, 0), style=QtCore.Qt.DashLine)))
+        self.marker_lines = list()
+        layout.addWidget(self.overlay, 1)
+
+        self.timer = QtCore.QTimer()
+        self.timer.timeout.connect(self.update)
+        self.timer.start(100)
+        self.show_view(view)
+
+    def show_view(self, name):
+        self.viewer.graph(name, VIEWS[name], self.board)
+        self.viewer.show(name)
+
+    def toggle(self):
+        self.board.play(not self.board.playing)
+        self.play_button.setText('Pause' if self.board.playing else 'Play')
+
+    def seek(self, sample):
+        if sample != self.board.position:
+            self.board.seek(sample)
+            self.update()
+
+    def update(self):
+        position = self.board.position
+        if not self.board.playing:
+            self.play_button.setText('Play')
+        self.slider.blockSignals(True)
+        self.slider.setValue(position)
+        self.slider.blockSignals(False)
+        self.time_label.setText('%.1f / %.1f s' % (position / float(self.sampling_rate),
+                                                  self.board.num_samples / float(self.sampling_rate)))
+
+        # Ticks of the window the plots show, computed on demand
+        start = max(position - self.trace.num_points, 0)
+        ends, deviations, decisions = self.trace.trace(start, position)
+        seconds = ends / float(self.sampling_rate)
+        self.deviation_curve.setData(seconds, deviations)
+        if len(ends):
+            edges = np.append(seconds, seconds[-1] + self.trace.step / float(self.sampling_rate))
+            top = max(deviations.max(), self.limit) * 1.1
+            self.decision_curve.setData(edges, decisions * top)
+        else:
+            self.decision_curve.setData([], [])
+        self._markers(start, position)
+        self.overlay.setXRange(start / float(self.sampling_rate), max(position, 1) / float(self.sampling_rate),
+                               padding=0)
+
+    def _markers(self, start, stop):
+        for line in self.marker_lines:
+            self.overlay.removeItem(line)
+        self.marker_lines = list()
+        for marker in self.session.index['markers']:
+            if start <= marker['sample'] < stop:
+                line = pg.InfiniteLine(marker['sample'] / float(self.sampling_rate), angle=90, label=marker['label'],
+                                       pen=pg.mkPen((0, 150, 0)), labelOpts={'position': 0.9, 'color': (0, 120, 0)})
+                self.overlay.addItem(line)
+                self.marker_lines.append(line)
+
+    def show(self):
+        self.window.show()
+        self.app.exec_()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('session', type=str, help='session name in the store')
+    parser.add_argument('--root', type=str, help='session store directory', required=False, default=DEFAULT_ROOT)
+    parser.add_argument('--view', type=str, help='plot layout', choices=list(VIEWS), required=False,
+                        default='OpenBCI')
+    parser.add_argument('--start', type=float, help='seconds into the session', required=False, default=0)
+    parser.add_argument('--speed', type=str, help='playback speed', choices=SPEEDS, required=False, default='1')
+    parser.add_argument('--deviation-limit', type=float, help='limit of the decision trace', required=False,
+                        default=DEFAULT_PARAMS['deviation_limit'])
+    args = parser.parse_args()
+
+    session = SessionStore(args.root).open(args.session)
+    browser = Browser(session, args.view, dict(DEFAULT_PARAMS, deviation_limit=args.deviation_limit))
+    browser.speeds.setCurrentText(args.speed + 'x')
+    browser.seek(int(args.start * session.sampling_rate))
+    browser.show()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import argparse
+import numpy as np
+
+from OpenClassifier import LinearClassifier
+from OpenFilterCache import butter_design
+from OpenFilters import StreamingFilter, sosfilt, sosfilt_zi
+
+# Usage:
+#   Train while calibrating:   python OpenCalibration.py --csp data/csp.npz --windows data/calibration_windows.npz
+#   Use in the control loop:   python OpenDroneUpDown.py --csp data/csp.npz
+#   Retrain from saved windows python OpenCSP.py data/calibration_windows.npz data/csp.npz
+#
+# Common Spatial Patterns for C3/C4 motor imagery. Spatial filters are learned from the
+# calm/move windows of the 16 EEG channels; the live loop projects only the new samples
+# of each tick through the (filters x channels) matrix, band-pass filters the few
+# projected signals with running state and keeps a running variance over the window.
+# A tick therefore costs O(new samples x filters) instead of a pass over the whole window.
+
+# Sensorimotor rhythms (mu + beta)
+CSP_BAND = (8.0, 30.0)
+CSP_ORDER = 4
+
+
+def filter_windows(windows, sos, zi=None):
+    # windows: (windows, channels, samples), causal filter started at steady state like StreamingFilter
+    zi = sosfilt_zi(sos) if zi is None else zi
+    out = np.empty(windows.shape)
+    for i, window in enumerate(windows):
+        state = zi[:, np.newaxis, :] * window[:, 0][np.newaxis, :, np.newaxis]
+        out[i] = sosfilt(sos, window, state)
+    return out
+
+
+def class_covariance(windows):
+    # Trace-normalised spatial covariance averaged over windows, one einsum for all of them
+    x = windows - windows.mean(axis=-1, keepdims=True)
+    cov = np.einsum('wcs,wds->wcd', x, x)
+    cov /= np.trace(cov, axis1=1, axis2=2)[:, np.newaxis, np.newaxis]
+    return cov.mean(axis=0)
+
+
+def train_filters(calm_windows, move_windows, filters_per_class=2):
+    # Generalised eigenproblem C_move w = l (C_calm + C_move) w, solved by whitening the composite
+    c_calm = class_covariance(calm_windows)
+    c_move = class_covariance(move_windows)
+    values, vectors = np.linalg.eigh(c_calm + c_move)
+    whitening = vectors / np.sqrt(np.maximum(values, 1e-12))
+    values, rotation = np.linalg.eigh(whitening.T @ c_move @ whitening)
+    filters = (whitening @ rotation).T
+    # Eigenvalues ascending: first rows maximise calm variance, last rows maximise move variance
+    pick = list(range(filters_per_class)) + list(range(len(filters) - filters_per_class, len(filters)))
+    return filters[pick]
+
+
+def log_variance(projected):
+    # projected: (..., filters, samples) -> normalised log-variance (..., filters)
+    var = projected.var(axis=-1)
+    return np.log(var / var.sum(axis=-1, keepdims=True))
+
+
+class CSP():
+    def __init__(self, filters, rows, sampling_rate, window, band=CSP_BAND, order=CSP_ORDER, dtype=np.float64):
+        self.filters = np.asarray(filters, dtype=np.float64)
+        # Precision of the live path (projection, filter state and ring); training and the
+        # running sums stay in double
+        self.dtype = np.dtype(dtype)
+        self.rows = list(rows)
+        self.sampling_rate = sampling_rate
+        self.window = window
+        self.band = tuple(band)
+        self.order = order
+        # Same coefficients in calibration, live loop and replays (OpenFilterCache)
+        self.sos, self.zi = butter_design(order, band[0], band[1], sampling_rate)
+        # Linear classifier on the log-variance features, trained together with the filters
+        self.classifier = LinearClassifier(rows, sampling_rate)
+        self.reset()
+
+    def reset(self):
+        n = len(self.filters)
+        self.projection = self.filters.astype(self.dtype)
+        self.stream = StreamingFilter(self.sos, n, self.dtype, self.zi)
+        self.ring = np.zeros((n, self.window), dtype=self.dtype)
+        self.pos = 0
+        self.count = 0
+        self.sum = np.zeros(n)
+        self.sum_sq = np.zeros(n)
+
+    def push(self, block):
+        # block: (len(rows), new samples) of raw EEG; filtering is linear so it is applied
+        # after the spatial projection, on len(filters) signals only
+        if block.shape[-1] == 0:
+            return
+        y = self.stream.process(self.projection @ block.astype(self.dtype, copy=False))
+        if y.shape[-1] > self.window:
+            y = y[:, -self.window:]
+        k = y.shape[-1]
+        idx = (self.pos + np.arange(k)) % self.window
+        if self.count == self.window:
+            leaving = self.ring[:, idx]
+            self.sum -= leaving.sum(axis=-1, dtype=np.float64)
+            self.sum_sq -= (leaving * leaving).sum(axis=-1, dtype=np.float64)
+        self.ring[:, idx] = y
+        self.sum += y.sum(axis=-1, dtype=np.float64)
+        self.sum_sq += (y * y).sum(axis=-1, dtype=np.float64)
+        self.count = min(self.count + k, self.window)
+        self.pos = (self.pos + k) % self.window
+        if self.pos < k:
+            # Once per window length, drop accumulated floating point drift
+            valid = self.ring[:, :self.count]
+            self.sum = valid.sum(axis=-1, dtype=np.float64)
+            self.sum_sq = (valid * valid).sum(axis=-1, dtype=np.float64)
+
+    def features(self):
+        if self.count < 2:
+            return np.zeros(len(self.filters))
+        mean = self.sum / self.count
+        var = np.maximum(self.sum_sq / self.count - mean * mean, 1e-12)
+        return np.log(var / var.sum())
+
+    def train(self, calm_windows, move_windows, filters_per_class=2):
+        calm = filter_windows(np.asarray(calm_windows, dtype=np.float64), self.sos, self.zi)
+        move = filter_windows(np.asarray(move_windows, dtype=np.float64), self.sos, self.zi)
+        self.filters = train_filters(calm, move, filters_per_class)
+        x0 = log_variance(np.einsum('fc,wcs->wfs', self.filters, calm))
+        x1 = log_variance(np.einsum('fc,wcs->wfs', self.filters, move))
+        self.classifier.fit(x0, x1)
+        self.reset()
+        return self.classifier.score(x0, x1)
+
+    def predict(self):
+        return self.classifier.predict(self.features())
+
+    def save(self, path):
+        np.savez(path, filters=self.filters, rows=self.rows, sampling_rate=self.sampling_rate,
+                 window=self.window, band=self.band, order=self.order,
+                 weights=self.classifier.weights, bias=self.classifier.bias)
+
+    @classmethod
+    def load(cls, path, dtype=np.float64):
+        f = np.load(path)
+        csp = cls(f['filters'], f['rows'].tolist(), int(f['sampling_rate']), int(f['window']),
+                  f['band'].tolist(), int(f['order']), dtype)
+        csp.classifier.weights = f['weights']
+        csp.classifier.bias = float(f['bias'])
+        return csp
+
+
+def train_from_file(windows_path, model_path, window):
+    f = np.load(windows_path)
+    sampling_rate = int(f['sampling_rate'])
+    csp = CSP(np.eye(len(f['rows'])), f['rows'].tolist(), sampling_rate, window or f['calm'].shape[-1])
+    accuracy = csp.train(f['calm'], f['move'])
+    print("CSP filters: %d, training accuracy: %.3f" % (len(csp.filters), accuracy))
+    csp.save(model_path)
+    return csp
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('windows', type=str, help='calibration windows saved by OpenCalibration.py')
+    parser.add_argument('model', type=str, help='output CSP file')
+    parser.add_argument('--window', type=int, help='running variance length in samples, default window length',
+                        required=False, default=0)
+    args = parser.parse_args()
+    train_from_file(args.windows, args.model, args.window)
+
+
+if __name__ == "__main__":
+    main()
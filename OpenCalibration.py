@@ -5,13 +5,22 @@ from pyqtgraph.Qt import QtGui, QtCore
 import PySimpleGUI as sg
 import numpy as np
 from numpy import savetxt
-import statistics
 from djitellopy import tello
 from time import sleep
 
 import brainflow
 from brainflow.board_shim import BoardShim, BrainFlowInputParams, LogLevels, BoardIds
-from brainflow.data_filter import DataFilter, DetrendOperations, FilterTypes
+from brainflow.data_filter import DataFilter
+
+from OpenPipeline import detrend, filter_channel, fft_deviation
+from OpenClassifier import LinearClassifier, electrode_rows, window_features
+from OpenCSP import CSP
+from OpenBands import DETECTOR_ELECTRODES, BandDetector
+from OpenSessionStore import SessionRecorder, SessionStore
+from OpenSampleBus import BusBoard
+from OpenViewer import qt_app
+from OpenMontage import board_montage
+from OpenMarkers import Markers
 
 # Usage:
 #   TESTING          python OpenCalibration.py
@@ -19,20 +28,37 @@ from brainflow.data_filter import DataFilter, DetrendOperations, FilterTypes
 #                       NOTE: COM5 depends on port available in your Device Manager
 
 class Graph():
-    def __init__(self, board_shim):
+    def __init__(self, board_shim, writer=None, markers=None, dtype=np.float64):
         self.board_id = board_shim.get_board_id()
+        self.dtype = np.dtype(dtype)
         self.board_shim = board_shim
+        self.writer = writer
+        self.markers = markers
+        self.recorder = SessionRecorder(writer, self.board_id) if writer is not None else None
         self.sampling_rate = BoardShim.get_sampling_rate(self.board_id)
+        # Row of C4 in the montage of the board
+        self.channelC4 = board_montage(self.board_id).row('C4')
         self.update_speed_ms = 1000
         self.window_size = 4
         self.num_points = self.window_size * self.sampling_rate
 
-        self.arr_deviation = np.array([])
+        # Deviation of every tick of both phases, mean per phase at the end of each
+        self.arr_deviation = np.zeros(40)
         self.dev_calm = 0
         self.dev_move = 0
         self.second = 0
 
-        self.app = QtGui.QApplication([])
+        # Raw windows of every EEG channel for each phase (classifier and CSP training). A
+        # window is kept only when all of it was recorded after the cue of its phase.
+        self.eeg_channels = BoardShim.get_eeg_channels(self.board_id)
+        self.feature_rows = electrode_rows(self.board_id)
+        self.timestamp_channel = BoardShim.get_timestamp_channel(self.board_id)
+        self.calm_windows = list()
+        self.move_windows = list()
+        self.phase_start = np.inf
+        self.last_timestamp = 0.0
+
+        self.app = qt_app()
         self.win = pg.GraphicsWindow(title='BrainFlow Plot',size=(800, 600))
         self.win.setBackground('w')
 
@@ -101,55 +127,137 @@ class Graph():
         plotCharC4FFT = 2
 
         # Channel Vars
-        channelC4 = 11
+        channelC4 = self.channelC4
 
         data = self.board_shim.get_current_board_data(self.num_points)
+        timestamps = data[self.timestamp_channel]
+        if len(timestamps):
+            self.last_timestamp = float(timestamps[-1])
+        if self.second == 0:
+            # Samples up to now are from before the calibration started
+            self.phase_start = self.last_timestamp
+
+        # Phase markers into the stream and the event log
+        if self.markers is not None:
+            if self.second == 0:
+                self.markers.mark('calm')
+
+        # Record the new samples with the calibration phases as epochs. The first window
+        # holds data from before the calibration started, so "calm" begins after it.
+        if self.recorder is not None:
+            if self.second == 20:
+                self.writer.begin_epoch('move')
+            self.recorder.update(data)
+            if self.second == 0:
+                self.writer.begin_epoch('calm')
+        if self.dtype != np.float64:
+            # Single precision from here on (windows, filter, FFT), recorded above
+            data = data.astype(self.dtype)
+
+        # Keep a raw copy for the classifier before the C4 row is filtered in place. The
+        # first windows of each phase still hold data from before its cue and are skipped.
+        if len(timestamps) and timestamps[0] > self.phase_start:
+            if self.second < 20:
+                self.calm_windows.append(data[self.eeg_channels])
+            else:
+                self.move_windows.append(data[self.eeg_channels])
  
         ### Plot timeseries C4 Raw Data
-        DataFilter.detrend(data[channelC4], DetrendOperations.CONSTANT.value)
+        detrend(data[channelC4])
         self.curves[plotCharC4Raw].setData(data[channelC4].tolist())
 
         ### Plot timeseries C4 Filtered
-        DataFilter.detrend(data[channelC4], DetrendOperations.CONSTANT.value)
-        # Butterworth.Remove Direct Current: Band pass filter from 0.5 Hz to 90 Hz
-        DataFilter.perform_bandpass(data[channelC4], self.sampling_rate, 0.5, 90.0, 2,
-                                    FilterTypes.BUTTERWORTH.value, 0)
-        #   Noise Reduction: Notch filter 50 Hz & 60 Hz
-        DataFilter.perform_bandstop(data[channelC4], self.sampling_rate, 50.0, 4.0, 2,
-                                    FilterTypes.BUTTERWORTH.value, 0)
-        DataFilter.perform_bandstop(data[channelC4], self.sampling_rate, 60.0, 4.0, 2,
-                                    FilterTypes.BUTTERWORTH.value, 0)
+        # Detrend, band pass 0.5 Hz to 90 Hz and 50 Hz & 60 Hz notch (OpenPipeline)
+        filter_channel(data[channelC4], self.sampling_rate)
     
         self.curves[plotCharC4Filtered].setData(data[channelC4].tolist())
 
 
         ### Plot C4 FFT
-        YY = np.fft.fft(data[channelC4]) 
+        deviation, YY = fft_deviation(data[channelC4])
         self.curves[plotCharC4FFT].setData(abs(YY))
 
         ## Calculate standard deviation on FFT. A large standard deviation indicates that the data is spread out, 
         #  a small standard deviation indicates that the data is clustered closely around the mean.
         #  Right-Hand movement  ---> Large standard deviation from electrode C4
-        deviation = statistics.pstdev(abs(YY))
         
+        if self.second < len(self.arr_deviation):
+            self.arr_deviation[self.second] = deviation
         self.second = self.second + 1
-        self.arr_deviation = np.append(self.arr_deviation,deviation)
 
         if self.second == 20:
-            self.dev_calm = statistics.mean(self.arr_deviation)
-            self.arr_deviation = np.empty([])
+            self.dev_calm = float(self.arr_deviation[:20].mean())
             self.plots[3].setTitle("DA-LI BRANCA!!!")
+            # The move cue is shown now, not at the start of the next tick
+            if self.markers is not None:
+                self.markers.mark('move')
+            self.phase_start = self.last_timestamp
         
         if self.second == 40:
-            self.dev_move = statistics.mean(self.arr_deviation)
+            if self.markers is not None:
+                self.markers.mark('end')
+            self.dev_move = float(self.arr_deviation[20:40].mean())
             self.app.exit()
 
         self.app.processEvents()
 
-def stream_window(board):
-    g = Graph(board)
+def calibration_windows(g, windows_path=''):
+    # Windows are shorter than window_size while the buffer fills up, those are left out
+    calm = [w for w in g.calm_windows if w.shape[1] == g.num_points]
+    move = [w for w in g.move_windows if w.shape[1] == g.num_points]
+    if not calm or not move:
+        raise ValueError('calibration kept %d calm and %d move windows of %d samples, need both' %
+                         (len(calm), len(move), g.num_points))
+    calm = np.stack(calm)
+    move = np.stack(move)
+    if windows_path:
+        np.savez(windows_path, calm=calm, move=move, rows=g.eeg_channels,
+                 feature_rows=g.feature_rows, sampling_rate=g.sampling_rate)
+    return calm, move
+
+def train_classifier(g, calm, move, model_path):
+    idx = [g.eeg_channels.index(row) for row in g.feature_rows]
+    calm = calm[:, idx]
+    move = move[:, idx]
+    clf = LinearClassifier(g.feature_rows, g.sampling_rate).train(calm, move)
+    clf.save(model_path)
+    accuracy = clf.score(window_features(calm, g.sampling_rate), window_features(move, g.sampling_rate))
+    print("CLASSIFIER:", model_path, "TRAINING ACCURACY:", accuracy)
+
+def train_csp(g, calm, move, model_path):
+    csp = CSP(np.eye(len(g.eeg_channels)), g.eeg_channels, g.sampling_rate, g.num_points)
+    accuracy = csp.train(calm, move)
+    csp.save(model_path)
+    print("CSP:", model_path, "TRAINING ACCURACY:", accuracy)
+
+def train_bands(g, calm, move, model_path):
+    rows = electrode_rows(g.board_id, DETECTOR_ELECTRODES)
+    idx = [g.eeg_channels.index(row) for row in rows]
+    detector = BandDetector(rows, g.sampling_rate, calm.shape[-1])
+    accuracy = detector.train(calm[:, idx], move[:, idx])
+    detector.save(model_path)
+    print("BANDS:", model_path, "TRAINING ACCURACY:", accuracy)
+
+def stream_window(board, model_path='', csp_path='', session_name='', events_path='', dtype=np.float64,
+                  bands_path='', windows_path=''):
+    writer = None
+    if session_name:
+        writer = SessionStore().create(session_name, board.get_board_id(), dtype=np.dtype(dtype).name)
+    markers = Markers(board, events_path)
+    g = Graph(board, writer, markers, dtype)
+    markers.close()
+    if writer is not None:
+        writer.close()
     print("DEV CALM:", g.dev_calm)
     print("DEV MOVE:", g.dev_move)
+    if model_path or csp_path or bands_path or windows_path:
+        calm, move = calibration_windows(g, windows_path)
+    if model_path:
+        train_classifier(g, calm, move, model_path)
+    if csp_path:
+        train_csp(g, calm, move, csp_path)
+    if bands_path:
+        train_bands(g, calm, move, bands_path)
 
 def main():
     BoardShim.enable_dev_board_logger()
@@ -169,6 +277,21 @@ def main():
     parser.add_argument('--board-id', type=int, help='board id, check docs to get a list of supported boards',
                         required=False, default=BoardIds.SYNTHETIC_BOARD)
     parser.add_argument('--file', type=str, help='file', required=False, default='')
+    parser.add_argument('--bus', type=str, help='attach to the stream of OpenSampleBus.py instead of the board',
+                        required=False, default='')
+    parser.add_argument('--classifier', type=str, help='train a movement classifier and save it to this file',
+                        required=False, default='')
+    parser.add_argument('--csp', type=str, help='train CSP spatial filters and save them to this file',
+                        required=False, default='')
+    parser.add_argument('--bands', type=str, help='train the C3/C4 band power detector and save it to this file',
+                        required=False, default='')
+    parser.add_argument('--windows', type=str, help='save the calibration windows to this npz (retraining)',
+                        required=False, default='')
+    parser.add_argument('--record', type=str, help='record the calibration as a session with this name',
+                        required=False, default='')
+    parser.add_argument('--events', type=str, help='append calibration phase events to this csv, off by default',
+                        required=False, default='')
+    parser.add_argument('--float32', action='store_true', help='single precision processing (see OpenPrecision.py)')
     args = parser.parse_args()
 
     params = BrainFlowInputParams()
@@ -185,9 +308,13 @@ def main():
     board_id = args.board_id
     sampling_rate = BoardShim.get_sampling_rate(board_id)
     sampling_power_of_two = DataFilter.get_nearest_power_of_two(sampling_rate)
-    board = BoardShim(board_id, params)
-    board.prepare_session()
-    board.start_stream(sampling_power_of_two)
+    if args.bus:
+        # Shared stream published by OpenSampleBus.py, no second board session
+        board = BusBoard(args.bus)
+    else:
+        board = BoardShim(board_id, params)
+        board.prepare_session()
+        board.start_stream(sampling_power_of_two)
     BoardShim.log_message(LogLevels.LEVEL_INFO.value, 'start sleeping in the main thread')
 
     layout = [ 
@@ -199,7 +326,8 @@ def main():
         event, values = window.read()
     
         if event == "stream":
-            stream_window(board)
+            stream_window(board, args.classifier, args.csp, args.record, args.events,
+                          np.float32 if args.float32 else np.float64, args.bands, args.windows)
 
         if event == sg.WIN_CLOSED:
             if board.is_prepared():
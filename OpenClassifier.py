@@ -0,0 +1,162 @@
+import argparse
+import time
+import numpy as np
+
+from OpenMontage import board_montage
+
+try:
+    # Keeps float32 windows in single precision
+    from scipy import fft as _fft
+except ImportError:
+    _fft = np.fft
+
+# Usage:
+#   Train while calibrating:   python OpenCalibration.py --classifier data/classifier.npz --windows data/calibration_windows.npz
+#   Use in the control loop:   python OpenDroneUpDown.py --classifier data/classifier.npz
+#   Retrain from saved windows python OpenClassifier.py data/calibration_windows.npz data/classifier.npz
+#
+# Linear movement/relax classifier trained on the KEEP CALM / DA-LI BRANCA phases of
+# OpenCalibration.py. Features are log band powers (mu and beta) of C3, C4 and the
+# neighbouring electrodes; the model is a shrinkage LDA so a live decision is a single
+# dot product: w . features + b > 0  ->  movement. The shrinkage of the covariance is
+# the Ledoit-Wolf coefficient of the training features unless a fixed one is given.
+
+FEATURE_ELECTRODES = ['C3', 'C4', 'Cz', 'F3', 'F4', 'P3', 'P4']
+# Mu, low beta and high beta bands in Hz
+BANDS = [(8.0, 12.0), (13.0, 20.0), (20.0, 30.0)]
+
+
+def electrode_rows(board_id, names=FEATURE_ELECTRODES):
+    # Board rows of the electrodes in the montage of the board (OpenMontage)
+    return board_montage(board_id).rows(names)
+
+
+def band_powers(windows, sampling_rate, bands=BANDS):
+    # windows: (..., samples) -> log band power (..., bands), all windows in one FFT call,
+    # in the precision of windows
+    num_samples = windows.shape[-1]
+    x = windows - windows.mean(axis=-1, keepdims=True)
+    x = x * np.hanning(num_samples).astype(x.dtype)
+    power = np.abs(_fft.rfft(x, axis=-1)) ** 2 / num_samples
+    freqs = np.fft.rfftfreq(num_samples, 1.0 / sampling_rate)
+    out = np.empty(windows.shape[:-1] + (len(bands),), dtype=power.dtype)
+    for i, (low, high) in enumerate(bands):
+        mask = (freqs >= low) & (freqs <= high)
+        out[..., i] = np.log10(power[..., mask].mean(axis=-1) + 1e-12)
+    return out
+
+
+def window_features(windows, sampling_rate, bands=BANDS):
+    # windows: (windows, channels, samples) -> (windows, channels * bands)
+    powers = band_powers(windows, sampling_rate, bands)
+    return powers.reshape(powers.shape[0], -1)
+
+
+def ledoit_wolf_shrinkage(x):
+    # x: (samples, features) centered. Ledoit-Wolf coefficient of the shrinkage towards
+    # mu * identity, as sklearn.covariance.ledoit_wolf_shrinkage(x, assume_centered=True)
+    n, p = x.shape
+    x2 = x * x
+    variances = x2.sum(axis=0) / n
+    mu = variances.sum() / p
+    gram = np.sum((x.T @ x) ** 2) / n ** 2
+    beta = (np.sum(x2.T @ x2) / n - gram) / (p * n)
+    delta = (gram - 2.0 * mu * variances.sum() + p * mu * mu) / p
+    beta = min(beta, delta)
+    return 0.0 if beta == 0 else float(beta / delta)
+
+
+class LinearClassifier():
+    def __init__(self, rows, sampling_rate, bands=BANDS, shrinkage=None):
+        # shrinkage: fixed coefficient in 0..1, None for Ledoit-Wolf from the training data
+        self.rows = list(rows)
+        self.sampling_rate = sampling_rate
+        self.bands = [tuple(band) for band in bands]
+        self.shrinkage = shrinkage
+        self.coefficient = shrinkage
+        self.weights = None
+        self.bias = 0.0
+
+    def features(self, data):
+        # data: board data (rows, samples) as returned by get_current_board_data
+        return window_features(data[self.rows][np.newaxis], self.sampling_rate, self.bands)[0]
+
+    def train(self, calm_windows, move_windows):
+        # *_windows: (windows, len(rows), samples) raw EEG, label 0 = calm, 1 = move
+        x0 = window_features(np.asarray(calm_windows, dtype=np.float64), self.sampling_rate, self.bands)
+        x1 = window_features(np.asarray(move_windows, dtype=np.float64), self.sampling_rate, self.bands)
+        return self.fit(x0, x1)
+
+    def fit(self, x0, x1):
+        mean0 = x0.mean(axis=0)
+        mean1 = x1.mean(axis=0)
+        centered = np.concatenate((x0 - mean0, x1 - mean1))
+        cov = centered.T @ centered / max(len(centered) - 2, 1)
+        # Shrinkage towards a scaled identity, calibration sets are small
+        self.coefficient = ledoit_wolf_shrinkage(centered) if self.shrinkage is None else self.shrinkage
+        target = np.trace(cov) / cov.shape[0]
+        cov = (1.0 - self.coefficient) * cov + self.coefficient * target * np.eye(cov.shape[0])
+        self.weights = np.linalg.solve(cov, mean1 - mean0)
+        self.bias = -float(self.weights @ (mean0 + mean1)) / 2.0
+        return self
+
+    def decision_function(self, features):
+        return features @ self.weights + self.bias
+
+    def predict(self, features):
+        return self.decision_function(features) > 0
+
+    def score(self, x0, x1):
+        correct = np.count_nonzero(~self.predict(x0)) + np.count_nonzero(self.predict(x1))
+        return correct / (len(x0) + len(x1))
+
+    def save(self, path):
+        np.savez(path, weights=self.weights, bias=self.bias, rows=self.rows,
+                 sampling_rate=self.sampling_rate, bands=self.bands,
+                 shrinkage=np.nan if self.shrinkage is None else self.shrinkage, coefficient=self.coefficient)
+
+    @classmethod
+    def load(cls, path):
+        f = np.load(path)
+        shrinkage = float(f['shrinkage'])
+        clf = cls(f['rows'].tolist(), int(f['sampling_rate']), f['bands'].tolist(),
+                  None if np.isnan(shrinkage) else shrinkage)
+        # Files from before the Ledoit-Wolf coefficient only have the fixed one
+        clf.coefficient = float(f['coefficient']) if 'coefficient' in f.files else shrinkage
+        clf.weights = f['weights']
+        clf.bias = float(f['bias'])
+        return clf
+
+
+def train_from_file(windows_path, model_path, shrinkage=None):
+    f = np.load(windows_path)
+    # Windows hold every EEG row, keep the classifier electrodes only
+    rows = f['rows'].tolist()
+    idx = [rows.index(row) for row in f['feature_rows']]
+    calm = f['calm'][:, idx]
+    move = f['move'][:, idx]
+    clf = LinearClassifier(f['feature_rows'].tolist(), int(f['sampling_rate']), shrinkage=shrinkage)
+    start = time.perf_counter()
+    clf.train(calm, move)
+    elapsed = time.perf_counter() - start
+    x0 = window_features(calm, clf.sampling_rate, clf.bands)
+    x1 = window_features(move, clf.sampling_rate, clf.bands)
+    print("Trained on %d calm / %d move windows in %.1f ms" % (len(x0), len(x1), elapsed * 1000))
+    print("Covariance shrinkage: %.3f (%s)" % (clf.coefficient, 'Ledoit-Wolf' if shrinkage is None else 'fixed'))
+    print("Training accuracy: %.3f" % clf.score(x0, x1))
+    clf.save(model_path)
+    return clf
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('windows', type=str, help='calibration windows saved by OpenCalibration.py')
+    parser.add_argument('model', type=str, help='output classifier file')
+    parser.add_argument('--shrinkage', type=float, help='fixed LDA covariance shrinkage (0..1), default Ledoit-Wolf',
+                        required=False, default=None)
+    args = parser.parse_args()
+    train_from_file(args.windows, args.model, args.shrinkage)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,13 +4,27 @@ import pyqtgraph as pg
 from pyqtgraph.Qt import QtGui, QtCore 
 import PySimpleGUI as sg
 import numpy as np
-import statistics
-from djitellopy import tello
+import time
 from time import sleep
 
 import brainflow
 from brainflow.board_shim import BoardShim, BrainFlowInputParams, LogLevels, BoardIds
-from brainflow.data_filter import DataFilter, DetrendOperations, FilterTypes
+from brainflow.data_filter import DataFilter
+
+from OpenPipeline import detrend, filter_channel, fft_deviation
+from OpenClassifier import LinearClassifier
+from OpenCSP import CSP
+from OpenBands import BandDetector
+from OpenBaseline import AdaptiveBaseline
+from OpenLink import LinkMonitor
+from OpenMetrics import Stopwatch, start_metrics
+from OpenTelloSim import connect_drone
+from OpenSampleBus import BusBoard
+from OpenViewer import qt_app
+from OpenMontage import board_montage
+from OpenMarkers import Markers
+from OpenOrchestrator import CONNECT_TIMEOUT, fly
+from OpenQuality import QualityStrip, board_quality
 
 # Usage:
 #   TESTING          python OpenDronUpDown.py
@@ -18,30 +32,84 @@ from brainflow.data_filter import DataFilter, DetrendOperations, FilterTypes
 #                       NOTE: COM5 depends on port available in your Device Manager
 
 class Graph():
-    def __init__(self, board_shim, me):
+    def __init__(self, board_shim, me, metrics=None, classifier=None, csp=None, markers=None, dtype=np.float64,
+                 quality=None, bands=None, baseline=None, link=None, exec_loop=True):
         self.board_id = board_shim.get_board_id()
+        self.dtype = np.dtype(dtype)
         self.board_shim = board_shim
         self.me = me
+        self.metrics = metrics
+        self.markers = markers
+        self.classifier = classifier
+        self.csp = csp
+        self.quality = quality
+        self.bands = bands
+        self.baseline = baseline
+        self.link = link
         self.sampling_rate = BoardShim.get_sampling_rate(self.board_id)
+        # Row of C4 in the montage of the board
+        self.channelC4 = board_montage(self.board_id).row('C4')
         self.update_speed_ms = 50
         self.window_size = 4
         self.num_points = self.window_size * self.sampling_rate
 
+        # New samples are found with the timestamp channel
+        self.timestamp_channel = BoardShim.get_timestamp_channel(self.board_id)
+        self.last_timestamp = 0
+        if self.metrics is not None:
+            self.metrics.declare_stages(['acquire', 'filter', 'fft', 'drone', 'plot', 'eeg_to_command'])
+            self.metrics.declare_labels('drone_commands_total', 'command', ['takeoff', 'land', 'rc'])
+            if self.quality is not None:
+                self.metrics.declare_labels('channel_ok', 'channel', self.quality.names)
+
+        # Rows the decision depends on (C4 for the deviation), gated on their contact quality
+        if self.csp is not None:
+            self.control_rows = self.csp.rows
+        elif self.classifier is not None:
+            self.control_rows = self.classifier.rows
+        elif self.bands is not None:
+            self.control_rows = self.bands.rows
+        else:
+            self.control_rows = [self.channelC4]
+        if self.quality is not None:
+            self.quality.reset()
+        if self.bands is not None:
+            self.bands.reset()
+        # Running calm baseline of the deviation, learnt from this session (OpenBaseline)
+        self.adaptive_movement = False
+        if self.baseline is not None:
+            self.baseline.start(1000.0 / self.update_speed_ms)
+        if self.link is not None:
+            self.link.reset()
+            self.link_summary = ''
+        # Samples lost for the metrics come from a link monitor as well, its own one when
+        # the link is not shown
+        self.drop_monitor = self.link
+        if self.drop_monitor is None and self.metrics is not None:
+            self.drop_monitor = LinkMonitor(self.board_id)
+
         ## Limit for Up/Down drone movement
         self.deviation_limit = 108194
 
         self.me.takeoff()
+        if self.markers is not None:
+            self.markers.mark('takeoff')
+        if self.metrics is not None:
+            self.metrics.inc('drone_commands_total', 1, 'command', 'takeoff')
 
-        self.app = QtGui.QApplication([])
+        self.app = qt_app()
         self.win = pg.GraphicsWindow(title='BrainFlow Plot',size=(800, 600))
         self.win.setBackground('w')
 
         self._init_timeseries()
 
-        timer = QtCore.QTimer()
-        timer.timeout.connect(self.update)
-        timer.start(self.update_speed_ms)
-        QtGui.QApplication.instance().exec_()
+        # exec_loop=False leaves the ticks to the caller (OpenOrchestrator)
+        self.exec_loop = exec_loop
+        if self.exec_loop:
+            timer = QtCore.QTimer()
+            timer.timeout.connect(self.update)
+            timer.start(self.update_speed_ms)
+            QtGui.QApplication.instance().exec_()
 
     def _init_timeseries(self):
         self.plots = list()
@@ -92,6 +160,9 @@ class Graph():
         curve = p.plot()
         self.curves.append(curve)
 
+        # Status strip of every EEG channel
+        self.strip = QualityStrip(self.win.addPlot(4,0), self.quality) if self.quality is not None else None
+
     def update(self):
         # Plot Data Vars
         plotCharC4Raw = 0
@@ -100,54 +171,147 @@ class Graph():
         plotCharText = 3
 
         # Channel Vars
-        channelC4 = 11
+        channelC4 = self.channelC4
+
+        with Stopwatch(self.metrics, 'acquire'):
+            data = self.board_shim.get_current_board_data(self.num_points)
+        # Samples newer than the last timestamp seen in the previous tick are new
+        timestamps = data[self.timestamp_channel]
+        new_samples = int(np.count_nonzero(timestamps > self.last_timestamp))
+        if new_samples:
+            self.last_timestamp = timestamps[-1]
+        # Radio link of the new samples
+        gaps = list()
+        if self.drop_monitor is not None:
+            gaps = self.drop_monitor.push(data[:, data.shape[1] - new_samples:])
+        if self.metrics is not None:
+            self._count_samples(data, new_samples, sum(missing for _, missing in gaps))
+        # Lost samples of the window interpolated before filtering
+        if self.link is not None and self.link.interpolate:
+            data = self.link.fill(data)
+            new_samples = min(new_samples + sum(missing for _, missing in gaps), data.shape[1])
+        if self.dtype != np.float64:
+            # Single precision from here on, timestamps were read in double above
+            data = data.astype(self.dtype)
+
+        # Contact quality of every EEG channel, from the new samples only
+        if self.quality is not None and new_samples:
+            self.quality.push(data[self.quality.rows, -new_samples:])
+
+        # CSP only sees the new samples, its variance is kept incrementally
+        if self.csp is not None and new_samples:
+            self.csp.push(data[self.csp.rows, -new_samples:])
+
+        # Band detector bins are updated with the new samples only, the FFT below is for display
+        if self.bands is not None and new_samples:
+            self.bands.push(data[self.bands.rows, -new_samples:])
+
+        # Classifier features come from the raw rows, before C4 is filtered in place
+        if self.classifier is not None:
+            features = self.classifier.features(data)
 
-        data = self.board_shim.get_current_board_data(self.num_points)
- 
         ### Plot timeseries C4 Raw Data
-        DataFilter.detrend(data[channelC4], DetrendOperations.CONSTANT.value)
+        detrend(data[channelC4])
         self.curves[plotCharC4Raw].setData(data[channelC4].tolist())
+        if self.link is not None and self.link.summary() != self.link_summary:
+            self.link_summary = self.link.summary()
+            self.plots[plotCharC4Raw].setTitle('C4 RAW DATA - ' + self.link_summary)
 
         ### Plot timeseries C4 Filtered
-        DataFilter.detrend(data[channelC4], DetrendOperations.CONSTANT.value)
-        # Butterworth.Remove Direct Current: Band pass filter from 0.5 Hz to 90 Hz
-        DataFilter.perform_bandpass(data[channelC4], self.sampling_rate, 0.5, 90.0, 2,
-                                    FilterTypes.BUTTERWORTH.value, 0)
-        #   Noise Reduction: Notch filter 50 Hz & 60 Hz
-        DataFilter.perform_bandstop(data[channelC4], self.sampling_rate, 50.0, 4.0, 2,
-                                    FilterTypes.BUTTERWORTH.value, 0)
-        DataFilter.perform_bandstop(data[channelC4], self.sampling_rate, 60.0, 4.0, 2,
-                                    FilterTypes.BUTTERWORTH.value, 0)
+        with Stopwatch(self.metrics, 'filter'):
+            # Detrend, band pass 0.5 Hz to 90 Hz and 50 Hz & 60 Hz notch (OpenPipeline)
+            filter_channel(data[channelC4], self.sampling_rate)
     
         self.curves[plotCharC4Filtered].setData(data[channelC4].tolist())
 
 
         ### Plot C4 FFT
-        YY = np.fft.fft(data[channelC4]) 
-        self.curves[plotCharC4FFT].setData(abs(YY))
+        with Stopwatch(self.metrics, 'fft'):
+            ## Calculate standard deviation on FFT. A large standard deviation indicates that the data is spread out, 
+            #  a small standard deviation indicates that the data is clustered closely around the mean.
+            #  Right-Hand movement  ---> Large standard deviation from electrode C4
+            deviation, YY = fft_deviation(data[channelC4])
+
+        with Stopwatch(self.metrics, 'plot'):
+            self.curves[plotCharC4FFT].setData(abs(YY))
+
+        # Movement decision: CSP, trained classifier or band detector when available, then the adaptive
+        # baseline, the fixed deviation threshold otherwise
+        if self.csp is not None:
+            movement = self.csp.predict()
+        elif self.classifier is not None:
+            movement = self.classifier.predict(features)
+        elif self.bands is not None:
+            movement = self.bands.predict()
+        elif self.baseline is not None:
+            # The baseline only learns from new data, ticks without new samples keep the decision
+            if new_samples:
+                self.adaptive_movement = self.baseline.update(deviation)
+            movement = self.adaptive_movement
+        else:
+            movement = deviation > self.deviation_limit
 
-        ## Calculate standard deviation on FFT. A large standard deviation indicates that the data is spread out, 
-        #  a small standard deviation indicates that the data is clustered closely around the mean.
-        #  Right-Hand movement  ---> Large standard deviation from electrode C4
-        deviation = statistics.pstdev(abs(YY))
+        # No movement decision while a control channel has bad contact
+        contact_ok = True
+        if self.quality is not None:
+            self.strip.update()
+            contact_ok = self.quality.ok(self.control_rows)
+            if self.metrics is not None:
+                for name, state in self.quality.status().items():
+                    self.metrics.set('channel_ok', state == 'ok', 'channel', name)
 
         # Dron movement dependng on deviation
         speed = 50
         print(deviation)
-        if deviation > self.deviation_limit:
-            self.me.send_rc_control(0, 0, speed, 0)
-            self.plots[plotCharText].setTitle("GOING UP")
-        else:
-            self.me.send_rc_control(0, 0, -speed, 0)
-            self.plots[plotCharText].setTitle("GOING DOWN")
-
-        self.app.processEvents()
-
-
-def stream_window(board, me):
-    Graph(board, me)
+        if self.metrics is not None and self.last_timestamp:
+            # Age of the newest EEG sample when the command leaves (BrainFlow timestamps are time.time())
+            self.metrics.observe('eeg_to_command', time.time() - self.last_timestamp)
+        with Stopwatch(self.metrics, 'drone'):
+            if not contact_ok:
+                # Hover until the electrodes are fixed
+                self.me.send_rc_control(0, 0, 0, 0)
+                self.plots[plotCharText].setTitle("HOLD - CHECK ELECTRODES")
+            elif movement:
+                self.me.send_rc_control(0, 0, speed, 0)
+                self.plots[plotCharText].setTitle("GOING UP")
+            else:
+                self.me.send_rc_control(0, 0, -speed, 0)
+                self.plots[plotCharText].setTitle("GOING DOWN")
+        if self.markers is not None:
+            self.markers.mark_change('hold' if not contact_ok else 'up' if movement else 'down')
+
+        if self.metrics is not None:
+            self.metrics.set('deviation', deviation)
+            if self.baseline is not None:
+                self.metrics.set('deviation_z', self.baseline.z)
+            if self.link is not None:
+                self.metrics.set('link_gaps', self.link.gaps)
+                self.metrics.set('link_jitter_seconds', self.link.jitter)
+                self.metrics.set('link_max_interval_seconds', self.link.max_interval)
+            self.metrics.set('decision', movement)
+            self.metrics.inc('drone_commands_total', 1, 'command', 'rc')
+            self.metrics.tick()
+
+        if self.exec_loop:
+            self.app.processEvents()
+
+    def _count_samples(self, data, count, dropped):
+        if count:
+            self.metrics.inc('samples_received_total', count)
+            self.metrics.inc('samples_dropped_total', dropped)
+        self.metrics.set('buffer_samples', self.board_shim.get_board_data_count())
+        self.metrics.set('buffer_fill_ratio', data.shape[1] / self.num_points)
+
+
+def stream_window(board, me, metrics=None, classifier=None, csp=None, markers=None, dtype=np.float64,
+                  quality=None, bands=None, baseline=None, link=None):
+    Graph(board, me, metrics, classifier, csp, markers, dtype, quality, bands, baseline, link)
     # Land drone when application finishes
     me.land()
+    if markers is not None:
+        markers.mark('land')
+    if metrics is not None:
+        metrics.inc('drone_commands_total', 1, 'command', 'land')
 
 def main():
     BoardShim.enable_dev_board_logger()
@@ -167,6 +331,38 @@ def main():
     parser.add_argument('--board-id', type=int, help='board id, check docs to get a list of supported boards',
                         required=False, default=BoardIds.SYNTHETIC_BOARD)
     parser.add_argument('--file', type=str, help='file', required=False, default='')
+    parser.add_argument('--bus', type=str, help='attach to the stream of OpenSampleBus.py instead of the board',
+                        required=False, default='')
+    parser.add_argument('--classifier', type=str, help='classifier trained by OpenCalibration.py, replaces the deviation limit',
+                        required=False, default='')
+    parser.add_argument('--csp', type=str, help='CSP filters trained by OpenCalibration.py, replaces the deviation limit',
+                        required=False, default='')
+    parser.add_argument('--bands', type=str, help='band detector trained by OpenCalibration.py, replaces the deviation limit',
+                        required=False, default='')
+    parser.add_argument('--tello-sim', type=str, help='host:port of OpenTelloSim.py instead of a real drone',
+                        required=False, default='')
+    parser.add_argument('--metrics-port', type=int, help='serve Prometheus metrics on localhost, 0 disables it',
+                        required=False, default=0)
+    parser.add_argument('--events', type=str, help='append drone command events to this csv, off by default',
+                        required=False, default='')
+    parser.add_argument('--float32', action='store_true', help='single precision processing (see OpenPrecision.py)')
+    parser.add_argument('--quality', action='store_true', help='show channel quality and hold on bad contact')
+    parser.add_argument('--adaptive', action='store_true', help='z-score of the deviation against a running calm baseline '
+                        'instead of the fixed limit (see OpenBaseline.py)')
+    parser.add_argument('--baseline-z', type=float, help='z-score of a movement with --adaptive', required=False,
+                        default=3.0)
+    parser.add_argument('--baseline-halflife', type=float, help='seconds of the calm baseline with --adaptive',
+                        required=False, default=30.0)
+    parser.add_argument('--no-freeze', action='store_true', help='keep learning the baseline during movement')
+    parser.add_argument('--link', type=str, help='dropped samples and jitter above the raw plot, interpolate '
+                        'also fills lost samples before filtering (see OpenLink.py)', choices=['off', 'count', 'interpolate'],
+                        required=False, default='off')
+    parser.add_argument('--orchestrator', action='store_true', help='no start window, board, drone, pipeline, '
+                        'recording and metrics as concurrent asyncio tasks (see OpenOrchestrator.py)')
+    parser.add_argument('--record', type=str, help='with --orchestrator, record the session in the SessionStore '
+                        'under this name', required=False, default='')
+    parser.add_argument('--connect-timeout', type=float, help='with --orchestrator, seconds to prepare the board '
+                        'and connect the drone', required=False, default=CONNECT_TIMEOUT)
     args = parser.parse_args()
 
     params = BrainFlowInputParams()
@@ -183,14 +379,39 @@ def main():
     board_id = args.board_id
     sampling_rate = BoardShim.get_sampling_rate(board_id)
     sampling_power_of_two = DataFilter.get_nearest_power_of_two(sampling_rate)
-    board = BoardShim(board_id, params)
-    board.prepare_session()
-    board.start_stream(sampling_power_of_two)
+    if args.bus:
+        # Shared stream published by OpenSampleBus.py, no second board session
+        board = BusBoard(args.bus)
+    else:
+        board = BoardShim(board_id, params)
+
+    def start_board():
+        if not args.bus:
+            board.prepare_session()
+            board.start_stream(sampling_power_of_two)
+
+    metrics = start_metrics(args.metrics_port)
+    classifier = LinearClassifier.load(args.classifier) if args.classifier else None
+    dtype = np.float32 if args.float32 else np.float64
+    csp = CSP.load(args.csp, dtype) if args.csp else None
+    bands = BandDetector.load(args.bands) if args.bands else None
+    baseline = AdaptiveBaseline(args.baseline_halflife, args.baseline_z, not args.no_freeze) if args.adaptive else None
+    markers = Markers(board, args.events)
+    quality = board_quality(board.get_board_id()) if args.quality else None
+    link = LinkMonitor(board.get_board_id(), args.link == 'interpolate') if args.link != 'off' else None
+
+    if args.orchestrator:
+        # Board and drone connect at the same time, then every part runs as its own task
+        fly(board, start_board, lambda board, me: Graph(board, me, metrics, classifier, csp, markers, dtype, quality,
+                                                        bands, baseline, link, exec_loop=False),
+            args.tello_sim, markers, metrics, args.record, args.connect_timeout)
+        return
+
+    start_board()
     BoardShim.log_message(LogLevels.LEVEL_INFO.value, 'start sleeping in the main thread')
 
-    # Connect dron
-    me = tello.Tello()
-    me.connect()
+    # Connect dron (or the local simulator from OpenTelloSim.py)
+    me = connect_drone(args.tello_sim)
 
     layout = [ 
         [sg.Button('Stream Electrodes', size=(100,1), key="stream")]
@@ -201,7 +422,7 @@ def main():
         event, values = window.read()
     
         if event == "stream":
-            stream_window(board, me)
+            stream_window(board, me, metrics, classifier, csp, markers, dtype, quality, bands, baseline, link)
 
         if event == sg.WIN_CLOSED:
             if board.is_prepared():
@@ -1,7 +1,5 @@
 import argparse
 from contextlib import nullcontext
-import pyqtgraph as pg
-from pyqtgraph.Qt import QtGui, QtCore 
 import PySimpleGUI as sg
 import numpy as np
 
@@ -9,31 +7,35 @@ import brainflow
 from brainflow.board_shim import BoardShim, BrainFlowInputParams, LogLevels, BoardIds
 from brainflow.data_filter import DataFilter, DetrendOperations, FilterTypes
 
+from OpenSampleBus import BusBoard
+from OpenViewer import Viewer
+from OpenMontage import board_montage
+
 # Usage:
 #   TESTING          python OpenFFT.py
 #   OPENBCI DATA     python OpenFFT.py --board-id 2 --serial-port COM5
 #                       NOTE: COM5 depends on port available in your Device Manager
 
+VIEW = 'OpenFFT'
+
 class Graph():
-    def __init__(self, board_shim):
+    def __init__(self, board_shim, viewer=None):
         self.board_id = board_shim.get_board_id()
         self.board_shim = board_shim
         self.sampling_rate = BoardShim.get_sampling_rate(self.board_id)
         self.update_speed_ms = 50
         self.window_size = 4
         self.num_points = self.window_size * self.sampling_rate
+        # Only the C4 row is fetched each tick
+        self.channels = board_montage(self.board_id).subset(['C4'])
 
-        self.app = QtGui.QApplication([])
-        self.win = pg.GraphicsWindow(title='BrainFlow Plot',size=(800, 600))
-        self.win.setBackground('w')
+        # Plots are built once into this view of the viewer, Viewer.open shows them
+        self.viewer = viewer if viewer is not None else Viewer(size=(800, 600))
+        self.app = self.viewer.app
+        self.win = self.viewer.layout(VIEW)
 
         self._init_timeseries()
 
-        timer = QtCore.QTimer()
-        timer.timeout.connect(self.update)
-        timer.start(self.update_speed_ms)
-        QtGui.QApplication.instance().exec_()
-
     def _init_timeseries(self):
         self.plots = list()
         self.curves = list()
@@ -82,10 +84,10 @@ class Graph():
         plotCharC4Filtered = 1
         plotCharC4FFT = 2
 
-        # Channel Vars
-        channelC4 = 11
+        # Channel Vars (rows of the fetched subset)
+        channelC4 = 0
 
-        data = self.board_shim.get_current_board_data(self.num_points)
+        data = self.channels.fetch(self.board_shim, self.num_points)
  
         ### Plot timeseries C4 Raw Data
         DataFilter.detrend(data[channelC4], DetrendOperations.CONSTANT.value)
@@ -111,8 +113,9 @@ class Graph():
         self.app.processEvents()
 
 
-def stream_window(board):
-    Graph(board)
+def stream_window(board, viewer):
+    # Same window and plots on every click, only built the first time
+    viewer.open(VIEW, Graph, board)
     
 
 def main():
@@ -133,6 +136,8 @@ def main():
     parser.add_argument('--board-id', type=int, help='board id, check docs to get a list of supported boards',
                         required=False, default=BoardIds.SYNTHETIC_BOARD)
     parser.add_argument('--file', type=str, help='file', required=False, default='')
+    parser.add_argument('--bus', type=str, help='attach to the stream of OpenSampleBus.py instead of the board',
+                        required=False, default='')
     args = parser.parse_args()
 
     params = BrainFlowInputParams()
@@ -149,11 +154,17 @@ def main():
     board_id = args.board_id
     sampling_rate = BoardShim.get_sampling_rate(board_id)
     sampling_power_of_two = DataFilter.get_nearest_power_of_two(sampling_rate)
-    board = BoardShim(board_id, params)
-    board.prepare_session()
-    board.start_stream(sampling_power_of_two)
+    if args.bus:
+        # Shared stream published by OpenSampleBus.py, no second board session
+        board = BusBoard(args.bus)
+    else:
+        board = BoardShim(board_id, params)
+        board.prepare_session()
+        board.start_stream(sampling_power_of_two)
     BoardShim.log_message(LogLevels.LEVEL_INFO.value, 'start sleeping in the main thread')
 
+    viewer = Viewer(size=(800, 600))
+
     layout = [ 
         [sg.Button('Stream Electrodes', size=(100,1), key="stream")]
      ]
@@ -163,7 +174,7 @@ def main():
         event, values = window.read()
     
         if event == "stream":
-            stream_window(board)
+            stream_window(board, viewer)
 
         if event == sg.WIN_CLOSED:
             if board.is_prepared():
@@ -0,0 +1,148 @@
+import argparse
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+from OpenFilters import butter_sos, sosfilt_zi
+
+# Usage:
+#   Precompute the designs    python OpenFilterCache.py --sampling-rates 125 250
+#   List the cached designs   python OpenFilterCache.py --show
+#
+# Filter designs (second-order sections and the steady-state vector of sosfilt_zi) kept
+# by their parameters, so every script and every tick gets the same arrays instead of
+# designing them again: OpenPipeline.filter_sos (float32 path, OpenBatch, replay and
+# sweeps), CSP and StreamingFilter. The float64 path keeps BrainFlow's
+# DataFilter, whose design inside each call costs less than the filtering itself.
+#
+# In-process the cache is a LRU of MAX_ENTRIES designs. If FILTER_CACHE_FILE exists its
+# designs are loaded on first use, so a new session starts with exactly the coefficients
+# of the ones before it, bit for bit. The file is only written by this script; designs
+# it lacks are computed in-process as before. A file of another CACHE_VERSION (after a
+# change to the design code) is ignored.
+
+FILTER_CACHE_FILE = 'data/filter_cache.npz'
+CACHE_VERSION = 1
+MAX_ENTRIES = 128
+
+
+class FilterCache():
+    def __init__(self, path=FILTER_CACHE_FILE, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.loaded = not path
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, design, dtype=np.float64):
+        # key: tuple of the design parameters, design() -> float64 sos. Returns (sos, zi)
+        # in dtype, zi from the float64 design. Both arrays are shared by every caller
+        # and must not be changed (scipy's sosfilt does not take read-only arrays).
+        key = repr(tuple(key) + (np.dtype(dtype).str,))
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+        sos = np.asarray(design(), dtype=np.float64)
+        entry = (sos.astype(dtype), sosfilt_zi(sos).astype(dtype))
+        with self.lock:
+            self.misses += 1
+            self._put(key, entry)
+        return entry
+
+    def _put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def load(self, path=None):
+        path = path or self.path
+        self.loaded = True
+        if not path or not os.path.exists(path):
+            return 0
+        with np.load(path, allow_pickle=False) as f:
+            if int(f['version']) != CACHE_VERSION:
+                return 0
+            keys = f['keys']
+            for i, key in enumerate(keys):
+                self._put(str(key), (f['sos_%d' % i], f['zi_%d' % i]))
+        return len(keys)
+
+    def save(self, path=None):
+        path = path or self.path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self.lock:
+            items = list(self.entries.items())
+        arrays = {'version': CACHE_VERSION, 'keys': np.array([key for key, _ in items])}
+        for i, (key, (sos, zi)) in enumerate(items):
+            arrays['sos_%d' % i] = sos
+            arrays['zi_%d' % i] = zi
+        # np.savez adds .npz to other names
+        tmp = path + '.tmp.npz'
+        np.savez(tmp, **arrays)
+        os.replace(tmp, path)
+        return len(items)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.loaded = not self.path
+            self.hits = 0
+            self.misses = 0
+
+    def describe(self):
+        return '%d designs, %d hits, %d misses' % (len(self.entries), self.hits, self.misses)
+
+
+# Cache of the process, shared by every module
+filter_cache = FilterCache()
+
+
+def butter_design(order, low, high, sampling_rate, btype='bandpass', dtype=np.float64):
+    # butter_sos and its sosfilt_zi, from the cache
+    return filter_cache.get(('butter', order, float(low), float(high), float(sampling_rate), btype),
+                            lambda: butter_sos(order, low, high, sampling_rate, btype), dtype)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sampling-rates', type=int, nargs='+', help='sampling rates of the boards in use',
+                        required=False, default=[125, 250])
+    parser.add_argument('--file', type=str, required=False, default=FILTER_CACHE_FILE)
+    parser.add_argument('--show', action='store_true', help='list the designs in the file')
+    args = parser.parse_args()
+
+    if args.show:
+        cache = FilterCache(args.file)
+        cache.load()
+        for key, (sos, zi) in cache.entries.items():
+            print("%-90s %d sections %s" % (key, len(sos), sos.dtype))
+        return
+
+    # Through the modules that use the cache (they import this file as OpenFilterCache,
+    # not as __main__), with the designs of their defaults
+    import OpenFilterCache
+    from OpenCSP import CSP_BAND, CSP_ORDER
+    from OpenPipeline import filter_sos
+    cache = OpenFilterCache.filter_cache
+    cache.path = args.file
+    start = time.perf_counter()
+    for sampling_rate in args.sampling_rates:
+        for dtype in (np.float64, np.float32):
+            filter_sos(sampling_rate, dtype=dtype)
+        OpenFilterCache.butter_design(CSP_ORDER, CSP_BAND[0], CSP_BAND[1], sampling_rate)
+    print("%s in %.1f ms" % (cache.describe(), (time.perf_counter() - start) * 1e3))
+    print("Saved %d designs to %s" % (cache.save(), args.file))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import numpy as np
+
+try:
+    from scipy.signal import sosfilt as _scipy_sosfilt
+except ImportError:
+    _scipy_sosfilt = None
+
+# Causal Butterworth filters as second-order sections (SOS), with filter state kept
+# between calls so a stream can be filtered block by block. BrainFlow's
+# DataFilter.perform_* functions always start from zero state on the array they get,
+# which is fine for re-filtering a whole window every tick but not for streaming.
+#
+# sos rows are [b0, b1, b2, 1, a1, a2], the same layout as scipy.signal.
+
+
+def _butter_prototype(order):
+    k = np.arange(1, order + 1)
+    return np.exp(1j * np.pi * (2 * k + order - 1) / (2 * order))
+
+
+def butter_sos(order, low, high, sampling_rate, btype='bandpass'):
+    # Digital Butterworth band-pass/band-stop (or low-pass at high) via analog prototype,
+    # band transform and bilinear transform with prewarping. order is the prototype order,
+    # band filters have order sections.
+    fs2 = 2.0 * sampling_rate
+    w2 = fs2 * np.tan(np.pi * high / sampling_rate)
+    proto = _butter_prototype(order)
+
+    if btype == 'lowpass':
+        poles = proto * w2
+    else:
+        w1 = fs2 * np.tan(np.pi * low / sampling_rate)
+        bw = w2 - w1
+        w0 = np.sqrt(w1 * w2)
+        if btype == 'bandpass':
+            half = proto * bw / 2.0
+        elif btype == 'bandstop':
+            half = (bw / 2.0) / proto
+        else:
+            raise ValueError('unsupported filter type: %s' % btype)
+        root = np.sqrt(half ** 2 - w0 ** 2)
+        poles = np.concatenate((half + root, half - root))
+    poles = (fs2 + poles) / (fs2 - poles)
+
+    # One conjugate pole pair (or two real poles, possible for odd orders) per section
+    is_real = np.abs(poles.imag) <= 1e-10 * np.abs(poles)
+    real = np.sort(poles[is_real].real)
+    denominators = [[1.0, -2.0 * p.real, abs(p) ** 2] for p in poles[~is_real & (poles.imag > 0)]]
+    denominators += [[1.0, -(r1 + r2), r1 * r2] for r1, r2 in zip(real[0::2], real[1::2])]
+    if len(real) % 2:
+        denominators.append([1.0, -real[-1], 0.0])
+    if btype == 'lowpass':
+        # Zeros at infinity map to -1, a single one for the first order section
+        numerator = np.array([1.0, 2.0, 1.0])
+        gain_freq = 0.0
+    elif btype == 'bandpass':
+        # N analog zeros at 0 map to +1, the N zeros at infinity map to -1
+        numerator = np.array([1.0, 0.0, -1.0])
+        gain_freq = np.sqrt(low * high)
+    else:
+        # Zeros at +-j*w0 map onto the unit circle at the stop band centre
+        zero = (fs2 + 1j * w0) / (fs2 - 1j * w0)
+        numerator = np.array([1.0, -2.0 * zero.real, 1.0])
+        gain_freq = 0.0
+
+    sos = np.zeros((len(denominators), 6))
+    for i, denominator in enumerate(denominators):
+        # A single real pole (odd low-pass) has a single zero
+        sos[i, :3] = [1.0, 1.0, 0.0] if denominator[2] == 0.0 else numerator
+        sos[i, 3:] = denominator
+
+    # Normalise to unit gain in the pass band (band centre or DC)
+    z = np.exp(2j * np.pi * gain_freq / sampling_rate)
+    response = np.prod([np.polyval(s[:3][::-1], 1 / z) / np.polyval(s[3:][::-1], 1 / z) for s in sos])
+    sos[0, :3] /= abs(response)
+    return sos
+
+
+def sosfilt_zi(sos):
+    # Steady-state section states for a unit step input, scale by the first sample
+    # to start a filter without the usual start-up transient
+    zi = np.zeros((len(sos), 2))
+    scale = 1.0
+    for i, (b0, b1, b2, a0, a1, a2) in enumerate(sos):
+        b = np.array([b0, b1, b2])
+        a = np.array([a0, a1, a2])
+        companion = np.array([[-a1, 1.0], [-a2, 0.0]])
+        zi[i] = np.linalg.solve(np.eye(2) - companion, b[1:] - a[1:] * b[0]) * scale
+        scale *= b.sum() / a.sum()
+    return zi
+
+
+def sosfilt(sos, x, zi):
+    # x: (channels, samples), zi: (sections, channels, 2), updated in place. Computed in
+    # the common precision of sos, x and zi (float32 when all three are float32).
+    if _scipy_sosfilt is not None:
+        y, zf = _scipy_sosfilt(sos, x, axis=-1, zi=zi)
+        zi[...] = zf
+        return y
+    y = np.array(x, dtype=np.result_type(sos, x, zi), copy=True)
+    for s, (b0, b1, b2, a0, a1, a2) in enumerate(sos):
+        z = zi[s]
+        for n in range(y.shape[-1]):
+            xn = y[..., n]
+            yn = b0 * xn + z[..., 0]
+            z[..., 0] = b1 * xn - a1 * yn + z[..., 1]
+            z[..., 1] = b2 * xn - a2 * yn
+            y[..., n] = yn
+    return y
+
+
+class StreamingFilter():
+    def __init__(self, sos, channels, dtype=np.float64, zi=None):
+        # zi: sosfilt_zi(sos) when already known (OpenFilterCache)
+        self.sos = np.asarray(sos, dtype=dtype)
+        self.step_zi = sosfilt_zi(np.asarray(sos, dtype=np.float64)) if zi is None else np.asarray(zi, dtype=np.float64)
+        self.zi = np.zeros((len(sos), channels, 2), dtype=dtype)
+        self.started = False
+
+    def reset(self):
+        self.zi[...] = 0.0
+        self.started = False
+
+    def process(self, block):
+        # block: (channels, new samples)
+        if not self.started and block.shape[-1]:
+            self.zi[...] = self.step_zi[:, np.newaxis, :] * block[:, 0][np.newaxis, :, np.newaxis]
+            self.started = True
+        return sosfilt(self.sos, block, self.zi)
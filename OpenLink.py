@@ -0,0 +1,115 @@
+import numpy as np
+
+from brainflow.board_shim import BoardShim
+
+# Radio link monitor. Every new block of samples is checked on the package number and
+# timestamp channels:
+#
+#   dropped   samples lost on the radio link: package number steps larger than the
+#             normal one (1 for Cyton, 2 for Cyton+Daisy, learnt from the stream)
+#   gaps      places where samples were lost
+#   jitter    mean |interval - 1/sampling rate| between sample timestamps (smoothed)
+#   max       longest interval between two samples since the start
+#
+# With a high count of dropped samples the link is the problem; with a clean link and a
+# slow update (OpenMetrics stage times) it is the pipeline. The drone scripts show the
+# counters above the raw plot (--link count) and can interpolate the lost samples of
+# the window before filtering (--link interpolate), so a gap does not show up in the FFT
+# as a step. SessionRecorder flags every gap of a recording as a 'dropped' artifact, and
+# the samples_dropped_total metric counts the samples lost found here.
+
+MAX_PACKAGE = 256
+
+
+def missing_samples(steps, step):
+    # Samples lost behind each package number step, with step the normal one: a step of
+    # 3 on Cyton+Daisy (normal 2) still lost one sample, ceil(steps / step) - 1
+    return np.where(steps > step, -(-steps // step) - 1, 0)
+
+
+class LinkMonitor():
+    def __init__(self, board_id, interpolate=False, max_package=MAX_PACKAGE):
+        self.package_channel = BoardShim.get_package_num_channel(board_id)
+        self.timestamp_channel = BoardShim.get_timestamp_channel(board_id)
+        self.marker_channel = BoardShim.get_marker_channel(board_id)
+        self.sampling_rate = BoardShim.get_sampling_rate(board_id)
+        self.interpolate = interpolate
+        self.max_package = max_package
+        self.reset()
+
+    def reset(self):
+        self.last_package = None
+        self.last_timestamp = None
+        self.step_counts = np.zeros(self.max_package, dtype=np.int64)
+        self.samples = 0
+        self.dropped = 0
+        self.gaps = 0
+        self.jitter = 0.0
+        self.max_interval = 0.0
+
+    @property
+    def step(self):
+        # Most frequent package number step seen so far
+        counts = self.step_counts[1:]
+        return int(counts.argmax()) + 1 if counts.any() else 1
+
+    def push(self, block):
+        # block: (rows, new samples) -> [(index in block, samples lost before it)]
+        if block.shape[1] == 0:
+            return []
+        packages = block[self.package_channel].astype(np.int64)
+        timestamps = block[self.timestamp_channel]
+        first = 0 if self.last_package is None else 1
+        if first:
+            packages = np.concatenate(([self.last_package], packages))
+            timestamps = np.concatenate(([self.last_timestamp], timestamps))
+        steps = np.diff(packages) % self.max_package
+        self.step_counts += np.bincount(steps, minlength=self.max_package)
+        missing = missing_samples(steps, self.step)
+        positions = np.flatnonzero(missing)
+        gaps = [(int(i) + 1 - first, int(missing[i])) for i in positions]
+        self.dropped += int(missing.sum())
+        self.gaps += len(gaps)
+        self.samples += block.shape[1]
+
+        intervals = np.diff(timestamps)
+        if len(intervals):
+            deviation = float(np.abs(intervals - 1.0 / self.sampling_rate).mean())
+            self.jitter = deviation if self.jitter == 0.0 else 0.9 * self.jitter + 0.1 * deviation
+            self.max_interval = max(self.max_interval, float(intervals.max()))
+        self.last_package = int(packages[-1])
+        self.last_timestamp = float(timestamps[-1])
+        return gaps
+
+    def fill(self, window):
+        # (rows, n) window -> same window with the samples lost inside it linearly
+        # interpolated (markers left empty), the oldest samples dropped to keep n
+        packages = window[self.package_channel].astype(np.int64)
+        steps = np.diff(packages) % self.max_package
+        step = self.step
+        if not np.any(steps > step):
+            return window
+        position = np.concatenate(([0], np.cumsum(missing_samples(steps, step) + 1)))
+        full = np.arange(position[-1] + 1)
+        out = np.empty((window.shape[0], len(full)), dtype=window.dtype)
+        for row in range(window.shape[0]):
+            out[row] = np.interp(full, position, window[row])
+        inserted = np.ones(len(full), dtype=bool)
+        inserted[position] = False
+        out[self.marker_channel, inserted] = 0
+        out[self.package_channel] = (packages[0] + full * step) % self.max_package
+        return np.ascontiguousarray(out[:, -window.shape[1]:])
+
+    def counters(self):
+        return {
+            'samples': self.samples,
+            'dropped': self.dropped,
+            'gaps': self.gaps,
+            'jitter_ms': round(self.jitter * 1e3, 3),
+            'max_interval_ms': round(self.max_interval * 1e3, 3),
+        }
+
+    def summary(self):
+        lost = 100.0 * self.dropped / max(self.samples + self.dropped, 1)
+        return 'dropped %d (%.1f%%) in %d gaps, jitter %.0f ms, max %.0f ms' % (
+            self.dropped, lost, self.gaps, self.jitter * 1e3, self.max_interval * 1e3)
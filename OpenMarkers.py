@@ -0,0 +1,97 @@
+import csv
+import os
+import time
+import numpy as np
+
+from brainflow.board_shim import BoardShim, BrainFlowError, LogLevels
+
+# Event markers for calibration phases and drone commands.
+#
+# Each event is written twice:
+#   - into the board stream with BoardShim.insert_marker, so the marker channel of the
+#     recording holds its code on the exact sample (BrainFlow stores it on the next sample)
+#   - into a parallel event log (csv: time, label, code) with time.time(), the clock of the
+#     timestamp channel, for boards or bus consumers that cannot insert markers
+#
+# Offline, epochs_from_markers() turns the marker channel back into calm/move epochs and
+# align_events() maps event log times onto sample indices.
+
+MARKER_CODES = {
+    'calm': 1,
+    'move': 2,
+    'end': 3,
+    'takeoff': 10,
+    'land': 11,
+    'up': 12,
+    'down': 13,
+    'hold': 14,
+}
+MARKER_LABELS = dict((code, label) for label, code in MARKER_CODES.items())
+# Markers that open or close a calibration phase
+PHASE_MARKERS = ('calm', 'move', 'end')
+
+
+class Markers():
+    def __init__(self, board_shim, log_path=''):
+        self.board_shim = board_shim
+        self.log = None
+        self.last = None
+        self.stream_markers = True
+        if log_path:
+            os.makedirs(os.path.dirname(log_path) or '.', exist_ok=True)
+            new_file = not os.path.exists(log_path)
+            self.log = open(log_path, 'a', newline='')
+            self.writer = csv.writer(self.log)
+            if new_file:
+                self.writer.writerow(['time', 'label', 'code'])
+
+    def mark(self, label):
+        code = MARKER_CODES[label]
+        if self.stream_markers:
+            try:
+                self.board_shim.insert_marker(code)
+            except (BrainFlowError, RuntimeError) as e:
+                # Not streaming or a bus consumer: keep going with the event log only
+                BoardShim.log_message(LogLevels.LEVEL_WARN.value, 'insert_marker not available: ' + str(e))
+                self.stream_markers = False
+        if self.log is not None:
+            self.writer.writerow([repr(time.time()), label, code])
+            self.log.flush()
+        self.last = label
+
+    def mark_change(self, label):
+        # For commands repeated every tick (rc up/down) only the changes are marked
+        if label != self.last:
+            self.mark(label)
+
+    def close(self):
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+
+
+def read_events(log_path):
+    with open(log_path, newline='') as f:
+        return [(float(row['time']), row['label'], int(row['code'])) for row in csv.DictReader(f)]
+
+
+def align_events(events, timestamps):
+    # Sample index of the first sample at or after each event time
+    times = np.array([event[0] for event in events])
+    return np.searchsorted(timestamps, times)
+
+
+def marker_events(marker_row):
+    # (sample index, label) for every non zero value of the marker channel
+    idx = np.flatnonzero(marker_row)
+    return [(int(i), MARKER_LABELS.get(int(marker_row[i]), str(marker_row[i]))) for i in idx]
+
+
+def epochs_from_markers(events, num_samples):
+    # Phase markers open an epoch that lasts until the next phase marker
+    epochs = list()
+    phases = [(sample, label) for sample, label in events if label in PHASE_MARKERS]
+    for (start, label), (stop, _) in zip(phases, phases[1:] + [(num_samples, 'end')]):
+        if label != 'end':
+            epochs.append({'label': label, 'start': start, 'stop': stop})
+    return epochs
@@ -0,0 +1,159 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Usage:
+#   python OpenDroneUpDown.py --metrics-port 9100
+#   curl http://127.0.0.1:9100/metrics
+#
+# Metrics are written by the acquisition loop (Graph.update) and read by the HTTP
+# thread. Every value is a plain float stored in a dict whose keys are all created
+# up front, so writes are single dict item assignments (atomic under the GIL) and
+# the scraper only takes a snapshot copy. No locks are taken on either side.
+
+class Metrics():
+    def __init__(self, prefix='openbci'):
+        self.prefix = prefix
+        self.help = dict()
+        self.types = dict()
+        self.values = dict()
+        self.last_tick = None
+
+        self._declare('samples_received_total', 'counter', 'Samples received from the board')
+        self._declare('samples_dropped_total', 'counter', 'Samples lost on the radio link (OpenLink)')
+        self._declare('buffer_samples', 'gauge', 'Samples currently held in the BrainFlow ring buffer')
+        self._declare('buffer_fill_ratio', 'gauge', 'Fraction of the analysis window available in the buffer')
+        self._declare('updates_total', 'counter', 'Processed Graph.update ticks')
+        self._declare('update_rate_hz', 'gauge', 'Smoothed Graph.update rate')
+        self._declare('stage_seconds_sum', 'counter', 'Total time spent per processing stage', labelled=True)
+        self._declare('stage_seconds_count', 'counter', 'Number of timed executions per processing stage', labelled=True)
+        self._declare('stage_last_seconds', 'gauge', 'Duration of the last execution per processing stage', labelled=True)
+        self._declare('deviation', 'gauge', 'Current FFT deviation of the control channel')
+        self._declare('deviation_z', 'gauge', 'z-score of the deviation against the adaptive baseline')
+        self._declare('decision', 'gauge', 'Current decision (1 movement, 0 relaxed)')
+        self._declare('drone_commands_total', 'counter', 'Commands sent to the drone', labelled=True)
+        self._declare('link_gaps', 'gauge', 'Places where samples were lost on the radio link (OpenLink)')
+        self._declare('link_jitter_seconds', 'gauge', 'Smoothed mean deviation of sample intervals from 1/sampling rate')
+        self._declare('link_max_interval_seconds', 'gauge', 'Longest interval between two samples')
+        self._declare('channel_ok', 'gauge', 'Contact quality per EEG channel (1 ok, 0 bad)', labelled=True)
+        self._declare('task_deadline_misses_total', 'counter', 'Task calls past their deadline (OpenOrchestrator)',
+                      labelled=True)
+        self._declare('loop_lag_seconds', 'gauge', 'How late the asyncio loop wakes up (OpenOrchestrator)')
+
+    def _declare(self, name, kind, text, labelled=False):
+        self.help[name] = text
+        self.types[name] = kind
+        if not labelled:
+            self.values[(name, '')] = 0.0
+
+    def _key(self, name, label, value):
+        if label is None:
+            return (name, '')
+        return (name, '%s="%s"' % (label, value))
+
+    def declare_labels(self, name, label, values):
+        # Create labelled series before the loop starts so later writes never grow the dict
+        for value in values:
+            self.values.setdefault(self._key(name, label, value), 0.0)
+
+    def declare_stages(self, stages):
+        for name in ('stage_seconds_sum', 'stage_seconds_count', 'stage_last_seconds'):
+            self.declare_labels(name, 'stage', stages)
+
+    def inc(self, name, amount=1, label=None, value=None):
+        key = self._key(name, label, value)
+        self.values[key] = self.values.get(key, 0.0) + amount
+
+    def set(self, name, amount, label=None, value=None):
+        self.values[self._key(name, label, value)] = float(amount)
+
+    def observe(self, stage, seconds):
+        self.inc('stage_seconds_sum', seconds, 'stage', stage)
+        self.inc('stage_seconds_count', 1, 'stage', stage)
+        self.set('stage_last_seconds', seconds, 'stage', stage)
+
+    def tick(self):
+        now = time.perf_counter()
+        if self.last_tick is not None and now > self.last_tick:
+            rate = 1.0 / (now - self.last_tick)
+            old = self.values[('update_rate_hz', '')] or rate
+            self.set('update_rate_hz', 0.9 * old + 0.1 * rate)
+        self.last_tick = now
+        self.inc('updates_total')
+
+    def render(self):
+        # Snapshot first: list(dict.items()) is a single C call and cannot interleave with a writer
+        snapshot = sorted(list(self.values.items()))
+        lines = list()
+        seen = set()
+        for (name, labels), amount in snapshot:
+            metric = self.prefix + '_' + name
+            if name not in seen:
+                seen.add(name)
+                lines.append('# HELP %s %s' % (metric, self.help.get(name, name)))
+                lines.append('# TYPE %s %s' % (metric, self.types.get(name, 'untyped')))
+            if labels:
+                lines.append('%s{%s} %r' % (metric, labels, amount))
+            else:
+                lines.append('%s %r' % (metric, amount))
+        return '\n'.join(lines) + '\n'
+
+
+class Stopwatch():
+    # with Stopwatch(metrics, 'filter'): ...   (metrics may be None)
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.metrics is not None:
+            self.metrics.observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Keep scrapes out of the console used by the acquisition loop
+        pass
+
+
+class MetricsServer():
+    def __init__(self, metrics, port, host='127.0.0.1'):
+        self.metrics = metrics
+        self.httpd = ThreadingHTTPServer((host, port), _MetricsHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.metrics = metrics
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='metrics', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def start_metrics(port):
+    # port 0 keeps the endpoint disabled, the loop then runs without any metrics overhead
+    if not port:
+        return None
+    metrics = Metrics()
+    MetricsServer(metrics, port).start()
+    return metrics
+
@@ -0,0 +1,96 @@
+import json
+import os
+import numpy as np
+
+from brainflow.board_shim import BoardShim
+
+# Electrode names of the EEG rows of each board, and index arrays for the channels a
+# script needs, resolved once instead of hard-coded rows in every update.
+#
+# The default montage is the 16-channel cap of this project in the order of
+# BoardShim.get_eeg_channels. 8-channel boards (Cyton) take OpenBCI's default Cyton
+# placement, which keeps C3 and C4; other boards take the first names of the cap.
+# data/montage.json overrides it per board id:
+#
+#   {"2": ["FP1", "FP2", "F7", ...], "0": ["C3", "C4", ...]}
+
+ELECTRODES = ['FP1', 'FP2', 'F7', 'F3', 'Fz', 'F4', 'F8', 'T3', 'C3', 'Cz', 'C4', 'T4', 'T5', 'P3', 'Pz', 'P4']
+CYTON_ELECTRODES = ['FP1', 'FP2', 'C3', 'C4', 'P7', 'P8', 'O1', 'O2']
+MONTAGE_FILE = 'data/montage.json'
+
+# Montage per (board id, file), the file is read once
+_montages = dict()
+
+
+def load_montages(path=MONTAGE_FILE):
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+class ChannelSubset():
+    # A fixed set of board rows. Consecutive rows are a slice (a view of the board data),
+    # others one fancy index (one copy of just those rows).
+    def __init__(self, rows):
+        self.rows = [int(row) for row in rows]
+        if len(self.rows) > 0 and np.all(np.diff(self.rows) == 1):
+            self.index = slice(self.rows[0], self.rows[-1] + 1)
+        else:
+            self.index = np.array(self.rows, dtype=np.intp)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def take(self, data):
+        return data[self.index]
+
+    def fetch(self, board_shim, num_samples):
+        # Latest num_samples of these rows only. BoardShim always returns every row; BusBoard
+        # copies just these rows out of shared memory.
+        if hasattr(board_shim, 'get_current_rows'):
+            return board_shim.get_current_rows(self.index, num_samples)
+        return self.take(board_shim.get_current_board_data(num_samples))
+
+
+class Montage():
+    def __init__(self, board_id, names=None, path=MONTAGE_FILE):
+        self.board_id = board_id
+        self.path = path
+        self.eeg_channels = BoardShim.get_eeg_channels(board_id)
+        if names is None:
+            names = load_montages(path).get(str(board_id))
+        if names is None and len(self.eeg_channels) == len(CYTON_ELECTRODES):
+            names = list(CYTON_ELECTRODES)
+        if names is None:
+            names = ELECTRODES[:len(self.eeg_channels)]
+            names += ['CH%d' % row for row in self.eeg_channels[len(names):]]
+        if len(names) != len(self.eeg_channels):
+            raise ValueError('montage of board %d has %d names for %d EEG channels' %
+                             (board_id, len(names), len(self.eeg_channels)))
+        self.names = list(names)
+        self._rows = dict(zip(self.names, self.eeg_channels))
+
+    def row(self, name):
+        if name not in self._rows:
+            raise ValueError('electrode %s is not in the montage of board %d (%s); name the EEG channels of '
+                             'this board in %s' % (name, self.board_id, ', '.join(self.names),
+                                                   self.path or MONTAGE_FILE))
+        return self._rows[name]
+
+    def rows(self, names):
+        return [self.row(name) for name in names]
+
+    def label(self, row):
+        return self.names[self.eeg_channels.index(row)]
+
+    def subset(self, names=None):
+        # All EEG channels by default
+        return ChannelSubset(self.eeg_channels if names is None else self.rows(names))
+
+
+def board_montage(board_id, path=MONTAGE_FILE):
+    key = (board_id, path)
+    if key not in _montages:
+        _montages[key] = Montage(board_id, path=path)
+    return _montages[key]
@@ -0,0 +1,330 @@
+import asyncio
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from brainflow.board_shim import BoardShim, LogLevels
+
+from OpenSessionStore import SessionRecorder, SessionStore
+from OpenTelloSim import connect_drone
+from OpenViewer import qt_app
+
+try:
+    import qasync
+except ImportError:
+    qasync = None
+
+# Usage:
+#   python OpenDroneUpDown.py --orchestrator --tello-sim 127.0.0.1:8889
+#   python OpenDroneUpDown.py --board-id 2 --serial-port COM5 --orchestrator --record flight_04 --metrics-port 8000
+#
+# Runs a drone session as concurrent asyncio tasks instead of the start window and the
+# nested Qt loop of the scripts:
+#
+#   board, drone  prepare_session/start_stream and connecting the drone, at the same time,
+#                 each with a deadline (--connect-timeout)
+#   pipeline      Graph.update every update_speed_ms on the GUI thread
+#   drone         commands of the pipeline sent by their own thread (DroneCommands), a
+#                 slow or lost answer of the drone does not hold the next tick
+#   recorder      with --record, the new samples go to the SessionStore and the index is
+#                 flushed every few seconds, on their own thread
+#   metrics       deadline misses per task and event loop lag (--metrics-port)
+#
+# Blocking calls run on one single-thread executor per device, so calls to the same
+# device never overlap and a stalled device only stalls its own task. Work on the GUI
+# thread cannot be interrupted; it is timed against its deadline and a late call is
+# counted, as is a call that raises. Closing the plot window, Ctrl+C, a failing task or
+# a Graph that has queued its last command stops every task, then the commands still
+# queued are sent (the drone landed), the recording closed and the board released, in
+# that order.
+#
+# Qt runs inside the asyncio loop: with qasync installed its QEventLoop is the asyncio
+# loop, otherwise a plain asyncio loop processes the Qt events every PUMP_MS.
+
+PUMP_MS = 10
+CONNECT_TIMEOUT = 30.0
+LAND_TIMEOUT = 15.0
+DRONE_PERIOD = 0.02
+DRONE_DEADLINE = 0.5
+RECORD_PERIOD = 0.5
+FLUSH_PERIOD = 2.0
+
+
+class Orchestrator():
+    def __init__(self, metrics=None, pump_ms=PUMP_MS):
+        self.metrics = metrics
+        self.pump_ms = pump_ms
+        self.app = qt_app()
+        self.specs = list()
+        self.tasks = list()
+        self.executors = dict()
+        self.misses = dict()
+        self.lag = 0.0
+        self.loop = None
+        self.stopping = None
+
+    def every(self, name, period, func, deadline=None, thread=None):
+        # func() every period seconds; thread names the executor of blocking calls,
+        # None runs func on the GUI thread
+        self.misses.setdefault(name, 0)
+        if self.metrics is not None:
+            self.metrics.declare_stages(['task_' + name])
+            self.metrics.declare_labels('task_deadline_misses_total', 'task', [name])
+        spec = (name, period, func, deadline, thread)
+        self.specs.append(spec)
+        if self.loop is not None:
+            self.tasks.append(self.loop.create_task(self._periodic(*spec)))
+
+    def stop(self):
+        if self.stopping is not None:
+            self.stopping.set()
+
+    def _executor(self, thread):
+        if thread not in self.executors:
+            self.executors[thread] = ThreadPoolExecutor(1, thread)
+        return self.executors[thread]
+
+    def _missed(self, name, seconds, deadline, error=None):
+        self.misses[name] = self.misses.get(name, 0) + 1
+        if error is not None:
+            BoardShim.log_message(LogLevels.LEVEL_WARN.value, 'task %s failed after %.3f s: %r' % (
+                name, seconds, error))
+        else:
+            BoardShim.log_message(LogLevels.LEVEL_WARN.value, 'task %s took %.3f s, deadline %.3f s' % (
+                name, seconds, deadline))
+        if self.metrics is not None:
+            self.metrics.inc('task_deadline_misses_total', 1, 'task', name)
+
+    async def call(self, name, func, *args, deadline=None, thread=None, fail=False):
+        # One call of func, timed against deadline. A blocking call past its deadline is
+        # counted and waited for (a thread cannot be cancelled), or raises with fail=True.
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            if thread is None:
+                result = func(*args)
+            else:
+                future = loop.run_in_executor(self._executor(thread), func, *args)
+                try:
+                    result = await asyncio.wait_for(asyncio.shield(future), deadline)
+                except asyncio.TimeoutError:
+                    if fail:
+                        raise TimeoutError('%s did not finish within %.1f s' % (name, deadline))
+                    self._missed(name, loop.time() - start, deadline)
+                    deadline = None
+                    result = await future
+        except asyncio.CancelledError:
+            raise
+        except BaseException as e:
+            # A call that raises (exit() of a Graph included) did not finish its work in time
+            if deadline is not None:
+                self._missed(name, loop.time() - start, deadline, e)
+            raise
+        seconds = loop.time() - start
+        if deadline is not None and seconds > deadline:
+            self._missed(name, seconds, deadline)
+        if self.metrics is not None:
+            self.metrics.observe('task_' + name, seconds)
+        return result
+
+    async def _periodic(self, name, period, func, deadline, thread):
+        # Fixed rate; a late call starts the next period from now instead of catching up
+        loop = asyncio.get_running_loop()
+        next_time = loop.time()
+        while True:
+            try:
+                await self.call(name, func, deadline=deadline, thread=thread)
+            except SystemExit:
+                # exit() of a Graph ends the run like closing its window, cleanups still run
+                self.stop()
+                return
+            next_time += period
+            now = loop.time()
+            if next_time < now:
+                next_time = now
+            await asyncio.sleep(next_time - now)
+
+    async def _heartbeat(self):
+        # Lag of the loop (how late this task wakes up), and the Qt events without qasync
+        loop = asyncio.get_running_loop()
+        period = self.pump_ms / 1000.0
+        while True:
+            start = loop.time()
+            if qasync is None:
+                self.app.processEvents()
+            await asyncio.sleep(period)
+            self.lag = max(loop.time() - start - period, 0.0)
+            if self.metrics is not None:
+                self.metrics.set('loop_lag_seconds', self.lag)
+
+    async def wait(self):
+        # Runs the registered tasks until stop(), then cancels them. A task that fails
+        # stops the others and its exception is raised here.
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        self.tasks = [self.loop.create_task(self._heartbeat())]
+        self.tasks += [self.loop.create_task(self._periodic(*spec)) for spec in self.specs]
+        stop = self.loop.create_task(self.stopping.wait())
+        try:
+            while not stop.done():
+                done, _ = await asyncio.wait(self.tasks + [stop], return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task is not stop and not task.cancelled() and task.exception() is not None:
+                        raise task.exception()
+                self.tasks = [task for task in self.tasks if not task.done()]
+        finally:
+            stop.cancel()
+            for task in self.tasks:
+                task.cancel()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+            self.tasks = list()
+
+    def close(self):
+        for executor in self.executors.values():
+            executor.shutdown(wait=False)
+        self.executors = dict()
+
+    def report(self):
+        return ', '.join('%s %d' % (name, count) for name, count in self.misses.items())
+
+
+def run(main):
+    # Runs the coroutine main on an asyncio loop that also runs Qt
+    if qasync is None:
+        return asyncio.run(main)
+    loop = qasync.QEventLoop(qt_app())
+    asyncio.set_event_loop(loop)
+    task = loop.create_task(main)
+    # Ctrl+C cancels the session, its cleanups still run
+    previous = signal.signal(signal.SIGINT, lambda *args: loop.call_soon_threadsafe(task.cancel))
+    try:
+        with loop:
+            return loop.run_until_complete(task)
+    finally:
+        signal.signal(signal.SIGINT, previous)
+
+
+class DroneCommands():
+    # Stands in for the drone in Graph: takeoff, land, hover and rc only queue the command
+    # and the drone task sends it. Only the newest rc command is kept; takeoff and land keep
+    # their order, and a hover holds the commands queued after it for its seconds (the
+    # hover of OpenDroneTakeoffLand) without holding the drone thread.
+    def __init__(self, me):
+        self.me = me
+        self.lock = threading.Lock()
+        self.queue = list()
+        self.rc = None
+        self.flying = False
+        self.resume = 0.0
+
+    def takeoff(self):
+        with self.lock:
+            self.queue.append(('takeoff', 0.0))
+            self.flying = True
+
+    def land(self):
+        with self.lock:
+            self.queue.append(('land', 0.0))
+            self.rc = None
+            self.flying = False
+
+    def hover(self, seconds):
+        with self.lock:
+            self.queue.append(('hover', seconds))
+
+    def send_rc_control(self, left_right_velocity, forward_backward_velocity, up_down_velocity, yaw_velocity):
+        with self.lock:
+            self.rc = (left_right_velocity, forward_backward_velocity, up_down_velocity, yaw_velocity)
+
+    def send(self, wait=False):
+        # On the drone thread. wait=True sleeps through the hovers and sends every queued
+        # command (end of the session)
+        while True:
+            delay = self.resume - time.perf_counter()
+            if delay > 0:
+                if not wait:
+                    break
+                time.sleep(delay)
+            with self.lock:
+                if not self.queue:
+                    break
+                command, seconds = self.queue.pop(0)
+            if command == 'hover':
+                self.resume = time.perf_counter() + seconds
+            else:
+                getattr(self.me, command)()
+        with self.lock:
+            rc, self.rc = self.rc, None
+        if rc is not None:
+            self.me.send_rc_control(*rc)
+
+
+async def _fly(orchestrator, board, start_board, graph_factory, drone_address, markers, metrics, session_name,
+               timeout):
+    commands = None
+    writer = None
+    try:
+        _, me = await asyncio.gather(
+            orchestrator.call('board', start_board, deadline=timeout, thread='board', fail=True),
+            orchestrator.call('drone', connect_drone, drone_address, deadline=timeout, thread='drone', fail=True))
+        commands = DroneCommands(me)
+        # Builds the plots and queues the takeoff
+        graph = graph_factory(board, commands)
+        period = graph.update_speed_ms / 1000.0
+
+        def tick():
+            # Closing the plot window ends the session, its plot items are gone. A Graph
+            # that has queued its last command (OpenDroneTakeoffLand) ends it as well.
+            if not graph.win.isVisible() or getattr(graph, 'finished', False):
+                orchestrator.stop()
+                return
+            graph.update()
+            if getattr(graph, 'finished', False):
+                orchestrator.stop()
+
+        orchestrator.every('pipeline', period, tick, deadline=period)
+        orchestrator.every('drone', DRONE_PERIOD, commands.send, deadline=DRONE_DEADLINE, thread='drone')
+        if session_name:
+            writer = SessionStore().create(session_name, board.get_board_id())
+            recorder = SessionRecorder(writer, board.get_board_id())
+            orchestrator.every('recorder', RECORD_PERIOD,
+                               lambda: recorder.update(board.get_current_board_data(graph.num_points)),
+                               deadline=RECORD_PERIOD, thread='recorder')
+            orchestrator.every('flush', FLUSH_PERIOD, writer.flush_index, deadline=FLUSH_PERIOD, thread='recorder')
+        await orchestrator.wait()
+    finally:
+        # Land drone when the session finishes, and send every command still queued
+        if commands is not None:
+            if commands.flying:
+                commands.land()
+                if markers is not None:
+                    markers.mark('land')
+                if metrics is not None:
+                    metrics.inc('drone_commands_total', 1, 'command', 'land')
+            await _cleanup(orchestrator.call('land', commands.send, True, deadline=LAND_TIMEOUT, thread='drone'))
+        if writer is not None:
+            await _cleanup(orchestrator.call('close', writer.close, deadline=LAND_TIMEOUT, thread='recorder'))
+        if board.is_prepared():
+            BoardShim.log_message(LogLevels.LEVEL_INFO.value, 'Releasing session')
+            await _cleanup(orchestrator.call('release', board.release_session, deadline=LAND_TIMEOUT, thread='board'))
+        orchestrator.close()
+        BoardShim.log_message(LogLevels.LEVEL_INFO.value, 'deadline misses: ' + orchestrator.report())
+
+
+async def _cleanup(call):
+    # A failing cleanup step is logged and the next one still runs
+    try:
+        await call
+    except Exception as e:
+        BoardShim.log_message(LogLevels.LEVEL_ERROR.value, 'cleanup failed: %r' % e)
+
+
+def fly(board, start_board, graph_factory, drone_address='', markers=None, metrics=None, session_name='',
+        timeout=CONNECT_TIMEOUT):
+    # start_board() prepares and starts the board, graph_factory(board, drone) builds the
+    # Graph of the script without its own Qt loop
+    orchestrator = Orchestrator(metrics)
+    run(_fly(orchestrator, board, start_board, graph_factory, drone_address, markers, metrics, session_name,
+             timeout))
+    return orchestrator
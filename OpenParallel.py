@@ -0,0 +1,174 @@
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from brainflow.data_filter import DataFilter, DetrendOperations, FilterTypes
+
+# Usage:
+#   python RealTimePlot.py --threads 0             all cores
+#   python OpenParallel.py --channels 16 32 --workers 1 2 4 8
+#
+# Per-channel filter and FFT work of RealTimePlot.update spread over a persistent thread
+# pool. BrainFlow's DataFilter goes through ctypes and numpy's FFT is C code; both only
+# run in parallel if they release the GIL during the call, otherwise threads only add
+# overhead. ChannelPool checks that once at start-up for the calls it runs and falls
+# back to the serial loop on the GUI thread when they do not (or on a single core).
+#
+# The check: a Python thread notes the longest time it could not run while the main
+# thread makes one long native call. A call that holds the GIL stops it for the whole
+# call, one that releases it only for an OS time slice.
+
+# Native call length needed for a clear answer
+CHECK_SECONDS = 0.05
+CHECK_MAX_SAMPLES = 1 << 22
+
+
+def releases_gil(call, min_seconds=CHECK_SECONDS, max_samples=CHECK_MAX_SAMPLES):
+    # call(x) runs the native function on a float64 array x
+    num_samples = 1 << 16
+    while True:
+        x = np.random.default_rng(0).standard_normal(num_samples)
+        start = time.perf_counter()
+        call(x)
+        if time.perf_counter() - start >= min_seconds or num_samples >= max_samples:
+            break
+        num_samples *= 4
+
+    state = {'stop': False, 'stall': 0.0}
+
+    def spin():
+        last = time.perf_counter()
+        while not state['stop']:
+            now = time.perf_counter()
+            if now - last > state['stall']:
+                state['stall'] = now - last
+            last = now
+
+    thread = threading.Thread(target=spin, daemon=True)
+    thread.start()
+    time.sleep(0.02)
+    state['stall'] = 0.0
+    start = time.perf_counter()
+    call(x)
+    seconds = time.perf_counter() - start
+    stall = state['stall']
+    state['stop'] = True
+    thread.join()
+    return stall < seconds / 2
+
+
+def filter_fft(x, sampling_rate):
+    # In place: the DataFilter calls of RealTimePlot.update, then |FFT|
+    DataFilter.detrend(x, DetrendOperations.CONSTANT.value)
+    # Butterworth.Remove Direct Current: Band pass filter from 0.5 Hz to 90 Hz
+    DataFilter.perform_bandpass(x, sampling_rate, 0.5, 90.0, 2, FilterTypes.BUTTERWORTH.value, 0)
+    # Noise Reduction: Notch filter 50 Hz & 60 Hz
+    DataFilter.perform_bandstop(x, sampling_rate, 50.0, 4.0, 2, FilterTypes.BUTTERWORTH.value, 0)
+    DataFilter.perform_bandstop(x, sampling_rate, 60.0, 4.0, 2, FilterTypes.BUTTERWORTH.value, 0)
+    return abs(np.fft.fft(x))
+
+
+# Native calls of filter_fft, each must release the GIL for the pool to be used
+CHECKS = {
+    'DataFilter.detrend': lambda x: DataFilter.detrend(x, DetrendOperations.CONSTANT.value),
+    'DataFilter.perform_bandpass': lambda x: DataFilter.perform_bandpass(x, 125, 0.5, 90.0, 2,
+                                                                         FilterTypes.BUTTERWORTH.value, 0),
+    'DataFilter.perform_bandstop': lambda x: DataFilter.perform_bandstop(x, 125, 50.0, 4.0, 2,
+                                                                         FilterTypes.BUTTERWORTH.value, 0),
+    'numpy.fft.fft': lambda x: np.fft.fft(x),
+}
+
+# Result of the check, made once per process
+_gil_checks = dict()
+
+
+def gil_checks():
+    if not _gil_checks:
+        for name, call in CHECKS.items():
+            _gil_checks[name] = releases_gil(call)
+    return _gil_checks
+
+
+class ChannelPool():
+    def __init__(self, workers=0, check=True):
+        # workers: threads, 0 for one per core, 1 for the serial loop
+        self.workers = workers or os.cpu_count() or 1
+        self.reason = ''
+        if self.workers < 2:
+            self.reason = 'one worker'
+        elif check:
+            held = [name for name, released in gil_checks().items() if not released]
+            if held:
+                self.reason = 'GIL held by ' + ', '.join(held)
+        self.parallel = not self.reason
+        self.executor = ThreadPoolExecutor(self.workers, 'channels') if self.parallel else None
+
+    def map(self, func, rows, *args):
+        # [func(row, *args) for row in rows], rows split into one group per worker so a
+        # task is a few channels and not a few microseconds
+        rows = list(rows)
+        if not self.parallel or len(rows) < 2:
+            return [func(row, *args) for row in rows]
+        groups = np.array_split(np.arange(len(rows)), min(self.workers, len(rows)))
+        futures = [self.executor.submit(_run_group, func, [rows[i] for i in group], args) for group in groups]
+        results = list()
+        for future in futures:
+            results += future.result()
+        return results
+
+    def describe(self):
+        if self.parallel:
+            return '%d threads' % self.workers
+        return 'serial (%s)' % self.reason
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+
+def _run_group(func, rows, args):
+    return [func(row, *args) for row in rows]
+
+
+def benchmark(channels, workers, num_samples, sampling_rate=125, repeats=50):
+    # Seconds per update of filter_fft over every channel, by pool size
+    data = np.random.default_rng(0).standard_normal((channels, num_samples)) * 100
+    times = dict()
+    for count in workers:
+        pool = ChannelPool(count, check=False)
+        samples = list()
+        for _ in range(repeats):
+            rows = [row for row in data.copy()]
+            start = time.perf_counter()
+            pool.map(filter_fft, rows, sampling_rate)
+            samples.append(time.perf_counter() - start)
+        pool.close()
+        times[count] = float(np.median(samples))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--channels', type=int, nargs='+', required=False, default=[16, 32])
+    parser.add_argument('--workers', type=int, nargs='+', required=False, default=[1, 2, 4, 8])
+    parser.add_argument('--samples', type=int, help='samples per channel (4 s at 125 Hz)', required=False,
+                        default=500)
+    parser.add_argument('--repeats', type=int, required=False, default=50)
+    args = parser.parse_args()
+
+    print("Cores:", os.cpu_count())
+    for name, released in gil_checks().items():
+        print("%-30s %s" % (name, 'releases the GIL' if released else 'HOLDS THE GIL'))
+    print("%8s %8s %12s %8s" % ('channels', 'workers', 'ms/update', 'speedup'))
+    for channels in args.channels:
+        times = benchmark(channels, args.workers, args.samples, repeats=args.repeats)
+        base = times[args.workers[0]]
+        for count in args.workers:
+            print("%8d %8d %12.3f %8.2f" % (channels, count, times[count] * 1e3, base / times[count]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import time
+import numpy as np
+
+from brainflow.data_filter import DataFilter, DetrendOperations, FilterTypes
+
+from OpenFilterCache import filter_cache
+from OpenFilters import butter_sos, sosfilt
+
+try:
+    # scipy.fft keeps single precision (complex64), numpy < 2 always computes in double
+    from scipy import fft as _fft
+except ImportError:
+    _fft = np.fft
+
+# Processing path of the control scripts (OpenCalibration, OpenDroneUpDown,
+# OpenDroneTakeoffLand) with its tunable parameters in one place, so the live loop,
+# replays and parameter sweeps run exactly the same code.
+#
+# float64 arrays go through BrainFlow's DataFilter (double only). float32 arrays take the
+# same filters as one SOS cascade from OpenFilters and a complex64 FFT, so the whole
+# path runs in single precision; OpenPrecision.py reports the difference.
+
+DEFAULT_PARAMS = {
+    'window_size': 4,           # seconds of data per window
+    'update_speed_ms': 50,      # time between two Graph.update ticks
+    'bandpass': (0.5, 90.0),    # Butterworth.Remove Direct Current
+    'notches': (50.0, 60.0),    # Noise Reduction
+    'notch_width': 4.0,
+    'deviation_limit': 108194,  # movement when deviation is above it
+    'phase_s': 20,              # OpenCalibration phase length
+    'speed': 50,                # drone rc speed (cm/s)
+    'dtype': 'float64',         # 'float32' for the single precision path
+}
+
+def make_params(**overrides):
+    params = dict(DEFAULT_PARAMS)
+    params.update(overrides)
+    return params
+
+
+def filter_sos(sampling_rate, bandpass=DEFAULT_PARAMS['bandpass'], notches=DEFAULT_PARAMS['notches'],
+               notch_width=DEFAULT_PARAMS['notch_width'], dtype=np.float32):
+    # The DataFilter calls of filter_channel as one SOS cascade. Bands are centre and width
+    # as DataFilter takes them; a band reaching 0 Hz is what BrainFlow makes of it, a
+    # low-pass at its upper edge. Designed once per (sampling rate, filters, dtype) and
+    # shared by every script (OpenFilterCache).
+    key = ('filter_channel', float(sampling_rate), tuple(map(float, bandpass)), tuple(map(float, notches)),
+           float(notch_width))
+    return filter_cache.get(key, lambda: _design_sos(sampling_rate, bandpass, notches, notch_width), dtype)[0]
+
+
+def _design_sos(sampling_rate, bandpass, notches, notch_width):
+    low = bandpass[0] - bandpass[1] / 2.0
+    high = bandpass[0] + bandpass[1] / 2.0
+    if low <= 0:
+        sections = [butter_sos(2, 0.0, high, sampling_rate, 'lowpass')]
+    else:
+        sections = [butter_sos(2, low, high, sampling_rate, 'bandpass')]
+    for freq in notches:
+        sections.append(butter_sos(2, freq - notch_width / 2.0, freq + notch_width / 2.0, sampling_rate,
+                                   'bandstop'))
+    return np.concatenate(sections)
+
+
+def detrend(x):
+    # In place, DetrendOperations.CONSTANT for any dtype
+    if x.dtype == np.float64:
+        DataFilter.detrend(x, DetrendOperations.CONSTANT.value)
+    else:
+        x -= x.mean()
+    return x
+
+
+def filter_channel(x, sampling_rate, bandpass=DEFAULT_PARAMS['bandpass'], notches=DEFAULT_PARAMS['notches'],
+                   notch_width=DEFAULT_PARAMS['notch_width']):
+    # In place, like the DataFilter calls in Graph.update
+    if x.dtype != np.float64:
+        detrend(x)
+        sos = filter_sos(sampling_rate, bandpass, notches, notch_width, x.dtype)
+        x[:] = sosfilt(sos, x[np.newaxis], np.zeros((len(sos), 1, 2), dtype=x.dtype))[0]
+        return x
+    DataFilter.detrend(x, DetrendOperations.CONSTANT.value)
+    # Butterworth.Remove Direct Current: Band pass filter from 0.5 Hz to 90 Hz
+    DataFilter.perform_bandpass(x, sampling_rate, bandpass[0], bandpass[1], 2,
+                                FilterTypes.BUTTERWORTH.value, 0)
+    # Noise Reduction: Notch filter 50 Hz & 60 Hz
+    for freq in notches:
+        DataFilter.perform_bandstop(x, sampling_rate, freq, notch_width, 2,
+                                    FilterTypes.BUTTERWORTH.value, 0)
+    return x
+
+
+def fft_deviation(x):
+    ## Standard deviation of the FFT magnitude (statistics.pstdev in the original scripts).
+    #  Right-Hand movement  ---> Large standard deviation from electrode C4
+    YY = _fft.fft(x) if x.dtype == np.float32 else np.fft.fft(x)
+    return float(np.std(np.abs(YY))), YY
+
+
+def tick_ends(stop, sampling_rate, params, start=0):
+    # Last sample (exclusive) of every Graph.update tick ending in [start, stop]. Ticks are
+    # update_speed_ms apart in time, 6.25 samples at 125 Hz: rounding each tick to its
+    # sample (as OpenRegression steps the board) keeps them on the live ticks, a whole
+    # number of samples per tick would drift away from them.
+    num_points = int(params['window_size'] * sampling_rate)
+    step = params['update_speed_ms'] * sampling_rate / 1000.0
+    first = max(int(np.floor((start - num_points) / step)), 0)
+    last = int(np.floor((stop - num_points) / step)) + 1
+    ends = num_points + np.round(np.arange(first, max(last + 1, first)) * step).astype(int)
+    return ends[(ends >= max(start, num_points)) & (ends <= stop)]
+
+
+def replay(signal, sampling_rate, params):
+    # Runs the control path over a recorded channel tick by tick, as Graph.update would
+    # see it: every update_speed_ms the last window_size seconds are filtered and the
+    # deviation of their FFT decides. Returns tick end samples, deviations and seconds
+    # spent per tick.
+    num_points = int(params['window_size'] * sampling_rate)
+    ends = tick_ends(len(signal), sampling_rate, params)
+    deviations = np.empty(len(ends))
+    seconds = np.empty(len(ends))
+    for i, end in enumerate(ends):
+        start = time.perf_counter()
+        window = np.array(signal[end - num_points:end], dtype=params['dtype'])
+        filter_channel(window, sampling_rate, params['bandpass'], params['notches'], params['notch_width'])
+        deviations[i] = fft_deviation(window)[0]
+        seconds[i] = time.perf_counter() - start
+    return ends, deviations, seconds
@@ -0,0 +1,118 @@
+import argparse
+import numpy as np
+
+from brainflow.board_shim import BoardShim
+
+from OpenClassifier import band_powers, electrode_rows
+from OpenPipeline import fft_deviation, filter_channel, make_params, replay
+from OpenSessionStore import SessionStore
+
+# Usage:
+#   Seeded synthetic EEG    python OpenPrecision.py --board-id 2 --seconds 120
+#   Recorded session        python OpenPrecision.py --session calib_01
+#
+# Accuracy report of the float32 path (--float32 in OpenCalibration / OpenDrone*) against
+# the float64 path: filtered C4, FFT magnitude, deviation, decisions and band power
+# features, plus time per tick and bytes per window / recorded second.
+
+
+def synthetic_eeg(sampling_rate, seconds, channels, seed=0):
+    # 1/f background with a large electrode offset (raw Cyton values), mu bursts on the
+    # central channels and 50 Hz mains; fixed seed so reports can be compared
+    rng = np.random.default_rng(seed)
+    n = int(seconds * sampling_rate)
+    t = np.arange(n) / sampling_rate
+    spectrum = np.fft.rfft(rng.standard_normal((channels, n)), axis=-1)
+    freqs = np.fft.rfftfreq(n, 1.0 / sampling_rate)
+    spectrum /= np.sqrt(np.maximum(freqs, 1.0))
+    x = np.fft.irfft(spectrum, n, axis=-1) * 400.0
+    bursts = (np.sin(2 * np.pi * t / 20.0) > 0) * 30.0 * np.sin(2 * np.pi * 10.0 * t)
+    x += bursts * np.linspace(0.2, 1.0, channels)[:, np.newaxis]
+    x += 15.0 * np.sin(2 * np.pi * 50.0 * t)
+    x += rng.uniform(-30000.0, 30000.0, (channels, 1))
+    return x
+
+
+def compare(reference, single):
+    # Largest error relative to the scale of the reference
+    return float(np.max(np.abs(reference - single)) / max(np.max(np.abs(reference)), 1e-30))
+
+
+def report(eeg, sampling_rate, control, params):
+    # eeg: (channels, samples) float64, control: index of the control channel in eeg
+    signal = eeg[control]
+    num_points = int(params['window_size'] * sampling_rate)
+    p64 = make_params(**dict(params, dtype='float64'))
+    p32 = make_params(**dict(params, dtype='float32'))
+    ends, dev64, sec64 = replay(signal, sampling_rate, p64)
+    _, dev32, sec32 = replay(signal.astype(np.float32), sampling_rate, p32)
+
+    filtered = list()
+    magnitude = list()
+    features = list()
+    for end in ends[::max(len(ends) // 50, 1)]:
+        window = signal[end - num_points:end]
+        a = filter_channel(np.array(window), sampling_rate, params['bandpass'], params['notches'],
+                           params['notch_width'])
+        b = filter_channel(window.astype(np.float32), sampling_rate, params['bandpass'], params['notches'],
+                           params['notch_width'])
+        filtered.append(compare(a, b))
+        magnitude.append(compare(np.abs(fft_deviation(a)[1]), np.abs(fft_deviation(b)[1])))
+        windows = eeg[:, end - num_points:end]
+        features.append(np.max(np.abs(band_powers(windows, sampling_rate) -
+                                      band_powers(windows.astype(np.float32), sampling_rate))))
+
+    deviation_error = np.abs(dev32 - dev64) / np.maximum(np.abs(dev64), 1e-30)
+    results = [
+        ('ticks', len(ends)),
+        ('filtered_max_rel_error', max(filtered)),
+        ('fft_magnitude_max_rel_error', max(magnitude)),
+        ('deviation_median_rel_error', float(np.median(deviation_error))),
+        ('deviation_max_rel_error', float(np.max(deviation_error))),
+        ('band_power_max_abs_error_log10', float(max(features))),
+    ]
+    # Agreement at the configured limit and at the median deviation (the hardest threshold)
+    for name, limit in (('decision_agreement_limit', params['deviation_limit']),
+                        ('decision_agreement_median', np.median(dev64))):
+        results.append((name, float(np.mean((dev64 > float(limit)) == (dev32 > float(limit))))))
+    results += [
+        ('tick_ms_float64', 1000.0 * float(np.mean(sec64))),
+        ('tick_ms_float32', 1000.0 * float(np.mean(sec32))),
+        ('window_bytes_float64', num_points * 8),
+        ('window_bytes_float32', num_points * 4),
+    ]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--board-id', type=int, help='board id of the synthetic data', required=False, default=2)
+    parser.add_argument('--seconds', type=float, help='seconds of synthetic data', required=False, default=120)
+    parser.add_argument('--seed', type=int, required=False, default=0)
+    parser.add_argument('--session', type=str, help='recorded session instead of synthetic data', required=False,
+                        default='')
+    parser.add_argument('--root', type=str, help='session store directory', required=False, default='data/sessions')
+    parser.add_argument('--channel', type=str, help='control electrode', required=False, default='C4')
+    args = parser.parse_args()
+
+    if args.session:
+        session = SessionStore(args.root).open(args.session)
+        board_id = session.board_id
+        sampling_rate = session.sampling_rate
+        rows = BoardShim.get_eeg_channels(board_id)
+        eeg = np.array(session.data[:, rows].T, dtype=np.float64)
+    else:
+        board_id = args.board_id
+        sampling_rate = BoardShim.get_sampling_rate(board_id)
+        rows = BoardShim.get_eeg_channels(board_id)
+        eeg = synthetic_eeg(sampling_rate, args.seconds, len(rows), args.seed)
+    control = rows.index(electrode_rows(board_id, [args.channel])[0])
+
+    for name, value in report(eeg, sampling_rate, control, make_params()):
+        print('%-32s %.6g' % (name, value))
+    num_rows = BoardShim.get_num_rows(board_id)
+    print('%-32s %d / %d' % ('recording_bytes_per_s 64/32', num_rows * sampling_rate * 8, num_rows * sampling_rate * 4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import os
+import numpy as np
+
+# Min/max/mean pyramid of a recording, written next to data.bin by SessionWriter while
+# it records (OpenSessionStore) and read by OpenReview.py.
+#
+# Level 1 is data.bin itself. Each other level is one file of buckets of that many
+# samples, bucket-major (buckets, board rows, 3) float32 with min, max and mean:
+#
+#   pyramid_8.bin  pyramid_64.bin  pyramid_512.bin
+#
+# Level 8 is reduced from the samples, every further level from the buckets of the one
+# below (min of mins, max of maxes, mean of means), so appending costs O(new samples)
+# and only less than one bucket per level is held in memory. A reader memory-maps the
+# files and picks the level that gives about as many points as the plot is wide: the
+# values read for a view do not depend on the length of the recording.
+
+LEVELS = [8, 64, 512]
+PYRAMID_FILE = 'pyramid_%d.bin'
+DTYPE = np.float32
+# Samples reduced at once, bounds the temporaries of import_csv
+CHUNK = 65536
+
+
+def _reduce(buckets):
+    # (buckets, n, rows, 3) -> (buckets, rows, 3)
+    out = np.empty((buckets.shape[0],) + buckets.shape[2:], dtype=DTYPE)
+    out[..., 0] = buckets[..., 0].min(axis=1)
+    out[..., 1] = buckets[..., 1].max(axis=1)
+    out[..., 2] = buckets[..., 2].mean(axis=1)
+    return out
+
+
+def _reduce_samples(samples):
+    # (buckets, n, rows) -> (buckets, rows, 3)
+    out = np.empty((samples.shape[0], samples.shape[2], 3), dtype=DTYPE)
+    out[..., 0] = samples.min(axis=1)
+    out[..., 1] = samples.max(axis=1)
+    out[..., 2] = samples.mean(axis=1)
+    return out
+
+
+class PyramidWriter():
+    def __init__(self, path, num_rows, levels=LEVELS):
+        self.levels = sorted(int(level) for level in levels)
+        self.num_rows = num_rows
+        self.files = [open(os.path.join(path, PYRAMID_FILE % level), 'wb') for level in self.levels]
+        # Buckets (or samples for the first level) of the level below not reduced yet
+        self.ratios = [self.levels[0]] + [b // a for a, b in zip(self.levels, self.levels[1:])]
+        self.pending = [None] * len(self.levels)
+
+    def append(self, block):
+        # block: (samples, rows) as written to data.bin
+        for start in range(0, block.shape[0], CHUNK):
+            self._push(0, block[start:start + CHUNK])
+
+    def _push(self, i, items):
+        if i == len(self.levels) or len(items) == 0:
+            return
+        if self.pending[i] is not None:
+            items = np.concatenate((self.pending[i], items))
+        ratio = self.ratios[i]
+        count = len(items) // ratio
+        self.pending[i] = items[count * ratio:].copy() if len(items) % ratio else None
+        if count == 0:
+            return
+        full = items[:count * ratio].reshape((count, ratio) + items.shape[1:])
+        buckets = _reduce_samples(full) if i == 0 else _reduce(full)
+        self.files[i].write(buckets.tobytes())
+        self._push(i + 1, buckets)
+
+    def flush(self):
+        for f in self.files:
+            f.flush()
+
+    def close(self):
+        # The last incomplete bucket of every level covers what is left
+        for i in range(len(self.levels)):
+            items = self.pending[i]
+            self.pending[i] = None
+            if items is not None:
+                full = items.reshape((1,) + items.shape)
+                bucket = _reduce_samples(full) if i == 0 else _reduce(full)
+                self.files[i].write(bucket.tobytes())
+                self._push(i + 1, bucket)
+        for f in self.files:
+            f.close()
+
+
+def build(path, data, levels=LEVELS):
+    # Pyramid of a recording made before it was written by SessionWriter
+    writer = PyramidWriter(path, data.shape[1], levels)
+    writer.append(data)
+    writer.close()
+
+
+class Pyramid():
+    def __init__(self, path, data, levels=LEVELS):
+        # data: the (samples, rows) memmap of data.bin, level 1
+        self.data = data
+        self.num_rows = data.shape[1]
+        self.levels = dict()
+        record = self.num_rows * 3 * np.dtype(DTYPE).itemsize
+        for level in sorted(levels):
+            name = os.path.join(path, PYRAMID_FILE % level)
+            buckets = os.path.getsize(name) // record if os.path.exists(name) else 0
+            if buckets:
+                self.levels[level] = np.memmap(name, dtype=DTYPE, mode='r', shape=(buckets, self.num_rows, 3))
+
+    def level(self, span, max_points):
+        # Finest level that shows span samples in at most max_points points
+        for level in [1] + sorted(self.levels):
+            if span <= level * max_points:
+                return level
+        return max(self.levels) if self.levels else 1
+
+    def envelope(self, row, start, stop, max_points=2000):
+        # -> level, x (sample of each point), min, max, mean of row between start and stop
+        level = self.level(stop - start, max_points)
+        if level == 1:
+            values = np.asarray(self.data[start:stop, row], dtype=np.float64)
+            return level, np.arange(start, start + len(values)), values, values, values
+        buckets = self.levels[level]
+        first = start // level
+        last = min(-(-stop // level), len(buckets))
+        values = np.asarray(buckets[first:last, row], dtype=np.float64)
+        origin = first * level
+        group = -(-len(values) // max_points)
+        if group > 1:
+            # Longer than the coarsest level covers, merge its buckets in memory
+            count = len(values) // group
+            merged = values[:count * group].reshape(count, group, 3)
+            values = np.column_stack((merged[..., 0].min(axis=1), merged[..., 1].max(axis=1),
+                                      merged[..., 2].mean(axis=1)))
+            level *= group
+        x = origin + (np.arange(len(values)) + 0.5) * level
+        return level, x, values[:, 0], values[:, 1], values[:, 2]
@@ -0,0 +1,159 @@
+import numpy as np
+import pyqtgraph as pg
+
+from brainflow.board_shim import BoardShim
+
+from OpenMontage import board_montage
+
+# Per-channel signal quality of every EEG channel, updated with the new samples of each
+# tick only (like OpenCSP): a ring of the last window per channel with running sums for
+# mean/variance, running counts of railed and flat samples, and sliding DFT bins at the
+# mains frequencies. A tick costs O(new samples x channels), independent of the window.
+#
+# Status per channel, first match wins:
+#   waiting  window not full yet
+#   railed   more than railed_limit of the window at the amplifier limit
+#   flat     more than flat_limit of the window without change (or no variance at all)
+#   line     mains power above line_limit of the channel variance
+#   ok
+
+QUALITY_STATES = ['ok', 'line', 'flat', 'railed', 'waiting']
+QUALITY_COLORS = [(0, 170, 0), (230, 180, 0), (120, 120, 120), (210, 0, 0), (220, 220, 220)]
+# Cyton/Daisy input range in uV at gain 24, railed like the OpenBCI GUI at 90 %
+RAIL_UV = 0.9 * 187500.0
+
+
+class QualityMonitor():
+    def __init__(self, rows, sampling_rate, window_s=2, line_freqs=(50.0, 60.0), rail=RAIL_UV,
+                 railed_limit=0.05, flat_limit=0.5, line_limit=0.5, flat_eps=1e-6, names=None):
+        self.rows = list(rows)
+        self.names = list(names) if names is not None else [str(row) for row in self.rows]
+        self.sampling_rate = sampling_rate
+        self.window = int(window_s * sampling_rate)
+        self.rail = rail
+        self.railed_limit = railed_limit
+        self.flat_limit = flat_limit
+        self.line_limit = line_limit
+        self.flat_eps = flat_eps
+        # Mains bins below Nyquist, rounded to the window's frequency grid
+        self.bins = np.array([round(f * self.window / sampling_rate) for f in line_freqs
+                              if f < sampling_rate / 2.0], dtype=np.float64)
+        # rotation[b, i] = exp(j 2 pi bin i / N), i = 0..N
+        self.rotation = np.exp(2j * np.pi * np.outer(self.bins, np.arange(self.window + 1)) / self.window)
+        self.reset()
+
+    def reset(self):
+        n = len(self.rows)
+        self.ring = np.zeros((n, self.window))
+        self.railed_ring = np.zeros((n, self.window), dtype=bool)
+        self.flat_ring = np.zeros((n, self.window), dtype=bool)
+        self.last = None
+        self.pos = 0
+        self.count = 0
+        self.sum = np.zeros(n)
+        self.sum_sq = np.zeros(n)
+        self.railed = np.zeros(n, dtype=np.int64)
+        self.flat = np.zeros(n, dtype=np.int64)
+        self.dft = np.zeros((n, len(self.bins)), dtype=np.complex128)
+
+    def push(self, block):
+        # block: (len(rows), new samples) of raw EEG as it comes from the board
+        if block.shape[-1] == 0:
+            return
+        block = np.asarray(block, dtype=np.float64)
+        previous = self.last if self.last is not None else block[:, :1]
+        flat = np.abs(np.diff(block, axis=-1, prepend=previous)) <= self.flat_eps
+        railed = np.abs(block) >= self.rail
+        self.last = block[:, -1:].copy()
+        if block.shape[-1] > self.window:
+            block, flat, railed = block[:, -self.window:], flat[:, -self.window:], railed[:, -self.window:]
+
+        k = block.shape[-1]
+        idx = (self.pos + np.arange(k)) % self.window
+        leaving = self.ring[:, idx]
+        self.sum += block.sum(axis=-1) - leaving.sum(axis=-1)
+        self.sum_sq += (block * block).sum(axis=-1) - (leaving * leaving).sum(axis=-1)
+        self.railed += railed.sum(axis=-1) - self.railed_ring[:, idx].sum(axis=-1)
+        self.flat += flat.sum(axis=-1) - self.flat_ring[:, idx].sum(axis=-1)
+        # Sliding DFT, k steps at once: S <- S w^k + sum_i (x_i - x_i-N) w^(k - i)
+        self.dft = self.dft * self.rotation[:, k] + (block - leaving) @ self.rotation[:, k:0:-1].T
+
+        self.ring[:, idx] = block
+        self.railed_ring[:, idx] = railed
+        self.flat_ring[:, idx] = flat
+        self.count = min(self.count + k, self.window)
+        self.pos = (self.pos + k) % self.window
+        if self.pos < k:
+            self._resync()
+
+    def _resync(self):
+        # Once per window length, drop the drift of the running sums and DFT bins
+        self.sum = self.ring.sum(axis=-1)
+        self.sum_sq = (self.ring * self.ring).sum(axis=-1)
+        ordered = np.roll(self.ring, -self.pos, axis=-1)
+        self.dft = ordered @ self.rotation[:, self.window:0:-1].T
+
+    def mean(self):
+        return self.sum / max(self.count, 1)
+
+    def variance(self):
+        mean = self.mean()
+        return np.maximum(self.sum_sq / max(self.count, 1) - mean * mean, 0.0)
+
+    def line_ratio(self):
+        # Mean square of the mains sinusoids over the channel variance
+        line = 2.0 * (np.abs(self.dft) ** 2).sum(axis=-1) / float(self.window) ** 2
+        return line / np.maximum(self.variance(), 1e-12)
+
+    def codes(self):
+        codes = np.zeros(len(self.rows), dtype=np.int64)
+        if self.count < self.window:
+            codes[:] = QUALITY_STATES.index('waiting')
+            return codes
+        codes[self.line_ratio() > self.line_limit] = QUALITY_STATES.index('line')
+        flat = (self.flat > self.flat_limit * self.window) | (self.variance() <= self.flat_eps)
+        codes[flat] = QUALITY_STATES.index('flat')
+        codes[self.railed > self.railed_limit * self.window] = QUALITY_STATES.index('railed')
+        return codes
+
+    def status(self):
+        return dict((name, QUALITY_STATES[code]) for name, code in zip(self.names, self.codes()))
+
+    def ok(self, rows=None):
+        # True when every given board row (all by default) has good contact
+        codes = self.codes()
+        if rows is None:
+            return bool(np.all(codes == 0))
+        return all(codes[self.rows.index(row)] == 0 for row in rows)
+
+
+def board_quality(board_id, **kwargs):
+    # Monitor over BoardShim.get_eeg_channels, named after the montage of the board
+    montage = board_montage(board_id)
+    return QualityMonitor(montage.eeg_channels, BoardShim.get_sampling_rate(board_id), names=montage.names, **kwargs)
+
+
+class QualityStrip():
+    # One coloured cell per channel in a single plot row, redrawn only when a status changes
+    def __init__(self, plot, monitor):
+        self.monitor = monitor
+        self.image = pg.ImageItem(np.zeros((len(monitor.rows), 1)))
+        self.image.setLookupTable(np.array(QUALITY_COLORS, dtype=np.ubyte))
+        self.image.setLevels((0, len(QUALITY_STATES) - 1))
+        plot.addItem(self.image)
+        plot.hideAxis('left')
+        plot.setMenuEnabled(False)
+        plot.setMouseEnabled(x=False, y=False)
+        plot.getAxis('bottom').setTicks([[(i + 0.5, name) for i, name in enumerate(monitor.names)]])
+        plot.setRange(xRange=[0, len(monitor.rows)], yRange=[0, 1], padding=0)
+        plot.setMaximumHeight(60)
+        plot.setTitle('SIGNAL QUALITY')
+        self.codes = None
+
+    def update(self):
+        codes = self.monitor.codes()
+        if self.codes is None or np.any(codes != self.codes):
+            self.image.setImage(codes[:, np.newaxis].astype(np.float64), autoLevels=False,
+                                levels=(0, len(QUALITY_STATES) - 1))
+            self.codes = codes
+        return codes
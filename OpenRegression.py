@@ -0,0 +1,346 @@
+import argparse
+import contextlib
+import importlib
+import io
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+import pyqtgraph as pg
+from pyqtgraph.Qt import QtGui, QtCore
+
+from brainflow.board_shim import BoardShim, BoardIds
+
+from OpenPrecision import synthetic_eeg
+
+# Usage:
+#   Check every script              python OpenRegression.py
+#   Check some scripts              python OpenRegression.py OpenFFT OpenDroneUpDown
+#   Record golden outputs/budgets   python OpenRegression.py --update
+#
+# Golden-output regression check of the Graph.update of every script. Each Graph is built
+# headlessly (offscreen Qt; QApplication, QTimer and exec_ replaced so the constructor
+# returns) on a board that serves seeded synthetic Cyton+Daisy data, and update() is
+# called tick by tick. The plotted curves, printed deviations, drone commands and
+# calibration results are compared with golden/<script>.npz, and the time per update
+# and the memory allocated by one update must stay within the budgets stored there.
+# --update rewrites the golden files from the current code: only after checking that a
+# change of the outputs is intended.
+
+GOLDEN_DIR = 'golden'
+BOARD_ID = BoardIds.CYTON_DAISY_BOARD.value
+SEED = 0
+SECONDS = 60
+POINTS_PER_CURVE = 64
+# Headroom of the recorded budgets over the measured values
+TIME_HEADROOM = 3.0
+ALLOC_HEADROOM = 1.5
+# Updates left out of the budgets (lazy initialisation in Qt and numpy), the updates of
+# the allocation run after them, and the percentile of the time per update
+WARMUP_TICKS = 2
+ALLOC_TICKS = 8
+TIME_PERCENTILE = 95
+
+# Deviation of the synthetic C4 before (about 1760) and after (above 1800) the mu burst
+# onset at 10 s, seen around tick 67 of the drone scripts
+SYNTHETIC_DEVIATION = 1760.0
+SYNTHETIC_BURST = 1800.0
+
+# ticks, first tick time (s into the data), whether Graph takes a drone and the EEG gain.
+# The drone scripts scale the EEG so their deviation limit (108194 and 30000) falls inside
+# the synthetic deviations: UpDown goes up and down, TakeoffLand takes off at the burst.
+SCRIPTS = {
+    'OpenBCI': {'ticks': 20, 'start': 9.0, 'drone': False, 'gain': 1.0},
+    'OpenFFT': {'ticks': 20, 'start': 9.0, 'drone': False, 'gain': 1.0},
+    'RealTimePlot': {'ticks': 10, 'start': 9.0, 'drone': False, 'gain': 1.0},
+    'RealTimePlotFFT': {'ticks': 10, 'start': 9.0, 'drone': False, 'gain': 1.0},
+    'OpenCalibration': {'ticks': 40, 'start': 4.0, 'drone': False, 'gain': 1.0},
+    'OpenDroneUpDown': {'ticks': 80, 'start': 8.0, 'drone': True, 'gain': 108194 / SYNTHETIC_DEVIATION},
+    'OpenDroneTakeoffLand': {'ticks': 80, 'start': 8.0, 'drone': True, 'gain': 30000 / SYNTHETIC_BURST},
+}
+
+
+class FixedBoard():
+    # BoardShim stand-in over a prepared (rows, samples) array; advance() plays the role
+    # of the time passing between two ticks
+    def __init__(self, board_id, data, position):
+        self.board_id = board_id
+        self.data = data
+        self.position = position
+
+    def advance(self, num_samples):
+        self.position = min(self.position + num_samples, self.data.shape[1])
+
+    def get_board_id(self):
+        return self.board_id
+
+    def get_current_board_data(self, num_samples):
+        return np.array(self.data[:, max(self.position - num_samples, 0):self.position])
+
+    def get_board_data_count(self):
+        return self.position
+
+    def get_board_data(self):
+        return np.array(self.data[:, :self.position])
+
+    def insert_marker(self, value):
+        pass
+
+    def is_prepared(self):
+        return True
+
+    def release_session(self):
+        pass
+
+
+class FakeDrone():
+    def __init__(self):
+        self.commands = list()
+        self.tick = 0
+
+    def connect(self):
+        pass
+
+    def takeoff(self):
+        self.commands.append('%d:takeoff' % self.tick)
+
+    def land(self):
+        self.commands.append('%d:land' % self.tick)
+
+    def send_rc_control(self, left_right_velocity, forward_backward_velocity, up_down_velocity, yaw_velocity):
+        self.commands.append('%d:rc %d %d %d %d' % (self.tick, left_right_velocity, forward_backward_velocity,
+                                                   up_down_velocity, yaw_velocity))
+
+    def end(self):
+        pass
+
+
+class _Signal():
+    def connect(self, slot):
+        pass
+
+
+class _Timer():
+    # The harness calls update() itself
+    def __init__(self, *args):
+        self.timeout = _Signal()
+
+    def start(self, interval):
+        pass
+
+    def stop(self):
+        pass
+
+
+class _Application():
+    # QtGui.QApplication for the scripts: the one real application is kept, exec_() and
+    # exit() return immediately
+    def __init__(self, args=None):
+        pass
+
+    @staticmethod
+    def instance():
+        return _Application()
+
+    def exec_(self):
+        return 0
+
+    def exit(self, code=0):
+        pass
+
+    def processEvents(self):
+        pg.mkQApp().processEvents()
+
+
+class _Module():
+    # A Qt module with some names replaced
+    def __init__(self, real, **replaced):
+        self.real = real
+        self.__dict__.update(replaced)
+
+    def __getattr__(self, name):
+        return getattr(self.real, name)
+
+
+def board_data(board_id=BOARD_ID, seconds=SECONDS, seed=SEED, gain=1.0):
+    sampling_rate = BoardShim.get_sampling_rate(board_id)
+    eeg_channels = BoardShim.get_eeg_channels(board_id)
+    data = np.zeros((BoardShim.get_num_rows(board_id), int(seconds * sampling_rate)))
+    data[eeg_channels] = gain * synthetic_eeg(sampling_rate, seconds, len(eeg_channels), seed)
+    data[BoardShim.get_package_num_channel(board_id)] = np.arange(data.shape[1]) % 256
+    data[BoardShim.get_timestamp_channel(board_id)] = 1.6e9 + np.arange(data.shape[1]) / sampling_rate
+    return data
+
+
+@contextlib.contextmanager
+def headless(module):
+    saved = dict((name, getattr(module, name)) for name in ('QtGui', 'QtCore', 'sleep') if hasattr(module, name))
+    module.QtGui = _Module(QtGui, QApplication=_Application)
+    module.QtCore = _Module(QtCore, QTimer=_Timer)
+    if 'sleep' in saved:
+        module.sleep = lambda seconds: None
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(module, name, value)
+
+
+def _curves(graph):
+    # y of every curve at POINTS_PER_CURVE evenly spaced samples
+    points = list()
+    for curve in graph.curves:
+        y = curve.getData()[1]
+        if y is None or len(y) == 0:
+            points.append(np.zeros(POINTS_PER_CURVE))
+        else:
+            points.append(np.asarray(y, dtype=np.float64)[np.linspace(0, len(y) - 1, POINTS_PER_CURVE).astype(int)])
+    return points
+
+
+def run_script(name, ticks=None, measure_alloc=False):
+    # Returns the outputs of every tick and the seconds (or allocated bytes) per update
+    config = SCRIPTS[name]
+    ticks = config['ticks'] if ticks is None else ticks
+    data = board_data(gain=config['gain'])
+    module = importlib.import_module(name)
+    sampling_rate = BoardShim.get_sampling_rate(BOARD_ID)
+    board = FixedBoard(BOARD_ID, data, int(config['start'] * sampling_rate))
+    drone = FakeDrone() if config['drone'] else None
+
+    curves = list()
+    printed = list()
+    cost = list()
+    exit_tick = -1
+    with headless(module):
+        with contextlib.redirect_stdout(io.StringIO()):
+            g = module.Graph(board, drone) if drone is not None else module.Graph(board)
+        if hasattr(g, 'viewer'):
+            # Shown and painted like the GraphicsWindow of the other scripts
+            g.viewer.win.setCentralItem(g.win)
+            g.viewer.win.show()
+        step = g.update_speed_ms * sampling_rate / 1000.0
+        for tick in range(ticks):
+            if drone is not None:
+                drone.tick = tick
+            out = io.StringIO()
+            try:
+                with contextlib.redirect_stdout(out):
+                    if measure_alloc:
+                        tracemalloc.start()
+                        g.update()
+                        cost.append(tracemalloc.get_traced_memory()[1])
+                        tracemalloc.stop()
+                    else:
+                        start = time.perf_counter()
+                        g.update()
+                        cost.append(time.perf_counter() - start)
+            except SystemExit:
+                # OpenDroneTakeoffLand exits after landing
+                tracemalloc.stop()
+                curves.append(_curves(g))
+                exit_tick = tick
+                break
+            finally:
+                for line in out.getvalue().split():
+                    try:
+                        printed.append(float(line))
+                    except ValueError:
+                        pass
+            curves.append(_curves(g))
+            board.advance(int(round((tick + 1) * step)) - int(round(tick * step)))
+        # Graphs on an OpenViewer.Viewer own the window through it
+        (g.viewer.win if hasattr(g, 'viewer') else g.win).close()
+
+    outputs = {
+        'curves': np.array(curves),
+        'printed': np.array(printed),
+        'exit_tick': np.array(exit_tick),
+    }
+    if drone is not None:
+        outputs['commands'] = np.array(drone.commands, dtype=str)
+    if hasattr(g, 'dev_calm'):
+        outputs['calibration'] = np.array([g.dev_calm, g.dev_move])
+    return outputs, np.array(cost)
+
+
+def compare(golden, outputs, rtol):
+    # Largest relative error over the numeric outputs, None when the shapes or the
+    # commands do not match
+    worst = 0.0
+    for key, value in outputs.items():
+        expected = golden[key]
+        if expected.shape != value.shape:
+            return None
+        if value.dtype.kind in 'US':
+            if not np.array_equal(expected, value):
+                return None
+            continue
+        scale = max(float(np.max(np.abs(expected))) if expected.size else 0.0, 1e-12)
+        if expected.size:
+            worst = max(worst, float(np.max(np.abs(expected - value))) / scale)
+    return worst
+
+
+def check(name, rtol, time_scale, update):
+    outputs, seconds = run_script(name)
+    _, allocated = run_script(name, ticks=min(SCRIPTS[name]['ticks'], WARMUP_TICKS + ALLOC_TICKS),
+                              measure_alloc=True)
+    # Worst allocation and a high percentile of the time after the warm-up updates: the
+    # time of a single update also counts the Qt events pending at that moment
+    timed, allocated = seconds[WARMUP_TICKS:], allocated[WARMUP_TICKS:]
+    ms = 1000.0 * float(np.percentile(timed, TIME_PERCENTILE)) if len(timed) else 0.0
+    kb = float(np.max(allocated)) / 1024.0 if len(allocated) else 0.0
+    path = os.path.join(GOLDEN_DIR, name + '.npz')
+
+    if update:
+        os.makedirs(GOLDEN_DIR, exist_ok=True)
+        np.savez_compressed(path, budget_ms=ms * TIME_HEADROOM, budget_kb=kb * ALLOC_HEADROOM, **outputs)
+        return [name, len(seconds), 0.0, ms, ms * TIME_HEADROOM, kb, kb * ALLOC_HEADROOM, 'UPDATED']
+
+    if not os.path.exists(path):
+        return [name, len(seconds), float('nan'), ms, float('nan'), kb, float('nan'), 'NO GOLDEN']
+    golden = np.load(path)
+    error = compare(golden, outputs, rtol)
+    budget_ms = float(golden['budget_ms']) * time_scale
+    budget_kb = float(golden['budget_kb'])
+    if error is None:
+        status = 'MISMATCH'
+    elif error > rtol:
+        status = 'DIFFERS'
+    elif ms > budget_ms:
+        status = 'TOO SLOW'
+    elif kb > budget_kb:
+        status = 'ALLOCATES'
+    else:
+        status = 'OK'
+    return [name, len(seconds), float('nan') if error is None else error, ms, budget_ms, kb, budget_kb, status]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('scripts', type=str, nargs='*', help='scripts to check, default all')
+    parser.add_argument('--update', action='store_true', help='record golden outputs and budgets')
+    parser.add_argument('--rtol', type=float, help='largest error relative to the output scale', required=False,
+                        default=1e-6)
+    parser.add_argument('--time-scale', type=float, help='multiply the time budgets (slower hosts)', required=False,
+                        default=1.0)
+    args = parser.parse_args()
+
+    pg.mkQApp()
+    names = args.scripts or list(SCRIPTS)
+    print('%-22s %5s %10s %9s %9s %9s %9s  %s' % ('script', 'ticks', 'error', 'ms', 'budget', 'KB', 'budget',
+                                                  'status'))
+    failed = 0
+    for name in names:
+        row = check(name, args.rtol, args.time_scale, args.update)
+        print('%-22s %5d %10.3g %9.3f %9.3f %9.1f %9.1f  %s' % tuple(row))
+        failed += row[-1] not in ('OK', 'UPDATED')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
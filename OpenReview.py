@@ -0,0 +1,109 @@
+import argparse
+import numpy as np
+import pyqtgraph as pg
+
+from OpenMontage import board_montage
+from OpenPyramid import LEVELS, build
+from OpenSessionStore import DEFAULT_ROOT, SessionStore
+from OpenViewer import qt_app
+
+# Usage:
+#   Review a session          python OpenReview.py calib_01
+#   Pyramid of old sessions   python OpenReview.py calib_01 --build
+#
+# Scrolls and zooms through a recorded session of the SessionStore, one plot per EEG
+# channel with linked time axes. Every view change asks the pyramid of the session
+# (OpenPyramid) for the level that gives about --points points for the visible span:
+# the raw samples when zoomed in, min/max buckets of up to 512 samples over hours.
+# Only that slice of the memory-mapped files is read, so memory does not depend on the
+# length of the recording. The envelope is the min/max of each bucket, the dark curve
+# its mean; every channel is shown around the mean of the visible span.
+
+
+class Review():
+    def __init__(self, session, max_points=2000):
+        self.session = session
+        self.pyramid = session.pyramid()
+        self.sampling_rate = session.sampling_rate
+        self.num_samples = len(session.data)
+        self.max_points = max_points
+        montage = board_montage(session.board_id)
+        self.rows = montage.eeg_channels
+
+        self.app = qt_app()
+        self.win = pg.GraphicsLayoutWidget(title='Review %s' % session.name, size=(1600, 1000))
+        self.win.setBackground('w')
+        duration = self.num_samples / float(self.sampling_rate)
+
+        self.plots = list()
+        self.envelopes = list()
+        self.means = list()
+        for i, row in enumerate(self.rows):
+            p = self.win.addPlot(row=i, col=0)
+            p.setMenuEnabled('left', False)
+            p.setMenuEnabled('bottom', False)
+            p.showAxis('bottom', i == len(self.rows) - 1)
+            p.setLabel('left', montage.names[i])
+            p.setLimits(xMin=0, xMax=max(duration, 1.0))
+            if i == 0:
+                self.title = p
+            else:
+                p.setXLink(self.plots[0])
+            self.plots.append(p)
+            self.envelopes.append(p.plot(pen=pg.mkPen((150, 150, 220))))
+            self.means.append(p.plot(pen=pg.mkPen((20, 20, 120))))
+
+        self.plots[0].sigXRangeChanged.connect(self.update)
+        self.plots[0].setXRange(0, max(duration, 1.0), padding=0)
+        self.update()
+
+    def update(self, *args):
+        x0, x1 = self.plots[0].viewRange()[0]
+        start = min(max(int(x0 * self.sampling_rate), 0), self.num_samples)
+        stop = min(max(int(np.ceil(x1 * self.sampling_rate)) + 1, start), self.num_samples)
+        level = 1
+        for i, row in enumerate(self.rows):
+            level, x, low, high, mean = self.pyramid.envelope(row, start, stop, self.max_points)
+            if len(x) == 0:
+                self.envelopes[i].setData([], [])
+                self.means[i].setData([], [])
+                continue
+            offset = mean.mean()
+            seconds = x / self.sampling_rate
+            if level == 1:
+                self.envelopes[i].setData([], [])
+            else:
+                # One vertical segment per bucket from its min to its max
+                self.envelopes[i].setData(np.repeat(seconds, 2), np.column_stack((low, high)).ravel() - offset,
+                                          connect='pairs')
+            self.means[i].setData(seconds, mean - offset)
+        self.title.setTitle('%s  %.1f s - %.1f s  (%s)' % (
+            self.session.name, start / float(self.sampling_rate), stop / float(self.sampling_rate),
+            'raw' if level == 1 else '%dx' % level))
+
+    def show(self):
+        self.win.show()
+        self.app.exec_()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('session', type=str, help='session name in the store')
+    parser.add_argument('--root', type=str, help='session store directory', required=False, default=DEFAULT_ROOT)
+    parser.add_argument('--points', type=int, help='points per channel drawn for any span', required=False,
+                        default=2000)
+    parser.add_argument('--build', action='store_true', help='write the pyramid of a session recorded without it')
+    args = parser.parse_args()
+
+    store = SessionStore(args.root)
+    session = store.open(args.session)
+    if args.build:
+        build(session.path, session.data, LEVELS)
+        session.index['pyramid'] = list(LEVELS)
+        session.save_index()
+        print("Pyramid of", session.name, LEVELS)
+    Review(session, args.points).show()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+import argparse
+import time
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+
+from brainflow.board_shim import BoardShim, BrainFlowInputParams, LogLevels, BoardIds
+
+# Usage:
+#   Acquisition daemon   python OpenSampleBus.py --board-id 2 --serial-port COM5
+#   Viewers/controllers  python OpenFFT.py --bus openbci
+#                        python RealTimePlot.py --bus openbci
+#
+# One process owns the BoardShim session and publishes the stream into a shared memory
+# ring buffer; any number of processes attach read-only. The ring is mirrored (every
+# sample is written at i and i + capacity), so the newest n <= capacity samples are
+# always one contiguous block and SampleBusReader.latest() returns a zero-copy view.
+#
+# Header (int64): sequence (samples written so far), capacity, rows, board id, sampling rate.
+# The writer stores the samples first and bumps the sequence last; a reader that wants to
+# be sure a view was not overwritten while it used it calls still_valid() afterwards.
+
+DEFAULT_NAME = 'openbci'
+HEADER = 5
+SEQ, CAPACITY, ROWS, BOARD_ID, SAMPLING_RATE = range(HEADER)
+
+
+def _buffers(shm, rows, capacity):
+    header = np.ndarray((HEADER,), dtype=np.int64, buffer=shm.buf)
+    ring = np.ndarray((rows, 2 * capacity), dtype=np.float64, buffer=shm.buf, offset=HEADER * 8)
+    return header, ring
+
+
+class SampleBus():
+    def __init__(self, board_id, rows, capacity, name=DEFAULT_NAME):
+        size = HEADER * 8 + rows * 2 * capacity * 8
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.header, self.ring = _buffers(self.shm, rows, capacity)
+        self.capacity = capacity
+        self.header[:] = [0, capacity, rows, board_id, BoardShim.get_sampling_rate(board_id)]
+
+    def write(self, data):
+        # data: (rows, samples) from BoardShim.get_board_data
+        n = data.shape[1]
+        if n == 0:
+            return
+        if n > self.capacity:
+            data = data[:, -self.capacity:]
+            self.header[SEQ] += n - self.capacity
+            n = self.capacity
+        seq = int(self.header[SEQ])
+        idx = (seq + np.arange(n)) % self.capacity
+        self.ring[:, idx] = data
+        self.ring[:, idx + self.capacity] = data
+        self.header[SEQ] = seq + n
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+class SampleBusReader():
+    def __init__(self, name=DEFAULT_NAME):
+        self.shm = shared_memory.SharedMemory(name=name)
+        # Readers must not unlink the block when they exit, only the daemon owns it
+        try:
+            resource_tracker.unregister(self.shm._name, 'shared_memory')
+        except Exception:
+            pass
+        header = np.ndarray((HEADER,), dtype=np.int64, buffer=self.shm.buf)
+        self.capacity = int(header[CAPACITY])
+        self.rows = int(header[ROWS])
+        self.board_id = int(header[BOARD_ID])
+        self.sampling_rate = int(header[SAMPLING_RATE])
+        self.header, ring = _buffers(self.shm, self.rows, self.capacity)
+        self.ring = ring.view()
+        self.ring.flags.writeable = False
+
+    @property
+    def sequence(self):
+        return int(self.header[SEQ])
+
+    def latest(self, num_samples):
+        # Zero-copy (rows, n) view of the newest samples and the sequence it ends at
+        seq = self.sequence
+        n = min(num_samples, seq, self.capacity)
+        end = seq % self.capacity + self.capacity
+        return self.ring[:, end - n:end], seq
+
+    def since(self, last_seq, max_samples=None):
+        # Samples written after last_seq (e.g. for recorders), as a zero-copy view
+        seq = self.sequence
+        n = min(seq - last_seq, self.capacity if max_samples is None else max_samples)
+        end = seq % self.capacity + self.capacity
+        return self.ring[:, end - n:end], seq
+
+    def still_valid(self, seq, num_samples):
+        # True while the samples of a view taken at seq have not been overwritten yet
+        return self.sequence - seq + num_samples <= self.capacity
+
+    def close(self):
+        self.ring = None
+        self.header = None
+        self.shm.close()
+
+
+class BusBoard():
+    # Stand-in for BoardShim in the Graph classes. get_current_board_data returns a copy,
+    # like BoardShim does, because the scripts filter the rows they get in place.
+    def __init__(self, name=DEFAULT_NAME):
+        self.reader = SampleBusReader(name)
+        self.last_seq = self.reader.sequence
+
+    def get_board_id(self):
+        return self.reader.board_id
+
+    def get_current_board_data(self, num_samples):
+        view, _ = self.reader.latest(num_samples)
+        return np.array(view)
+
+    def get_current_rows(self, index, num_samples):
+        # Copy of only some rows (OpenMontage.ChannelSubset), the other rows are not touched
+        view, _ = self.reader.latest(num_samples)
+        return np.array(view[index])
+
+    def get_board_data_count(self):
+        return min(self.reader.sequence, self.reader.capacity)
+
+    def get_board_data(self):
+        # Everything published since the last call, the bus itself is not drained
+        view, self.last_seq = self.reader.since(self.last_seq)
+        return np.array(view)
+
+    def insert_marker(self, value):
+        raise RuntimeError('markers can only be inserted by the acquisition process')
+
+    def is_prepared(self):
+        return self.reader.header is not None
+
+    def release_session(self):
+        self.reader.close()
+
+
+def main():
+    BoardShim.enable_dev_board_logger()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--timeout', type=int, help='timeout for device discovery or connection', required=False,
+                        default=0)
+    parser.add_argument('--ip-port', type=int, help='ip port', required=False, default=0)
+    parser.add_argument('--ip-protocol', type=int, help='ip protocol, check IpProtocolType enum', required=False,
+                        default=0)
+    parser.add_argument('--ip-address', type=str, help='ip address', required=False, default='')
+    parser.add_argument('--serial-port', type=str, help='serial port', required=False, default='')
+    parser.add_argument('--mac-address', type=str, help='mac address', required=False, default='')
+    parser.add_argument('--other-info', type=str, help='other info', required=False, default='')
+    parser.add_argument('--streamer-params', type=str, help='streamer params', required=False, default='')
+    parser.add_argument('--serial-number', type=str, help='serial number', required=False, default='')
+    parser.add_argument('--board-id', type=int, help='board id, check docs to get a list of supported boards',
+                        required=False, default=BoardIds.SYNTHETIC_BOARD)
+    parser.add_argument('--file', type=str, help='file', required=False, default='')
+    parser.add_argument('--bus', type=str, help='shared memory name', required=False, default=DEFAULT_NAME)
+    parser.add_argument('--seconds', type=int, help='seconds of data kept on the bus', required=False, default=60)
+    parser.add_argument('--poll-ms', type=int, help='board polling interval', required=False, default=10)
+    args = parser.parse_args()
+
+    params = BrainFlowInputParams()
+    params.ip_port = args.ip_port
+    params.serial_port = args.serial_port
+    params.mac_address = args.mac_address
+    params.other_info = args.other_info
+    params.serial_number = args.serial_number
+    params.ip_address = args.ip_address
+    params.ip_protocol = args.ip_protocol
+    params.timeout = args.timeout
+    params.file = args.file
+
+    board_id = args.board_id
+    sampling_rate = BoardShim.get_sampling_rate(board_id)
+    board = BoardShim(board_id, params)
+    board.prepare_session()
+    board.start_stream(45000, args.streamer_params)
+    bus = SampleBus(board_id, BoardShim.get_num_rows(board_id), args.seconds * sampling_rate, args.bus)
+    BoardShim.log_message(LogLevels.LEVEL_INFO.value, 'Publishing board data on shared memory ' + args.bus)
+
+    try:
+        while True:
+            bus.write(board.get_board_data())
+            time.sleep(args.poll_ms / 1000.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        bus.close()
+        if board.is_prepared():
+            BoardShim.log_message(LogLevels.LEVEL_INFO.value, 'Releasing session')
+            board.release_session()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+import argparse
+import json
+import os
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from brainflow.board_shim import BoardShim
+from brainflow.data_filter import DataFilter
+
+from OpenClassifier import electrode_rows
+from OpenMarkers import align_events, epochs_from_markers, marker_events, read_events
+from OpenPyramid import LEVELS, Pyramid, PyramidWriter
+from OpenLink import LinkMonitor
+
+# Usage:
+#   Record calibration     python OpenCalibration.py --record calib_01
+#   Import old recordings  python OpenSessionStore.py import data/test.csv --name test --board-id 2
+#   List sessions          python OpenSessionStore.py list
+#   Count windows          python OpenSessionStore.py windows --label move --channel C4
+#
+# Session layout (one directory per recording under data/sessions):
+#   data.bin     raw samples, sample-major (samples, board rows), appended while recording
+#   index.json   board id, sampling rate, shape, epochs, markers and artifact flags
+#   pyramid_*.bin min/max/mean of buckets of 8, 64 and 512 samples (OpenPyramid), for review
+#
+# data.bin is opened with np.memmap, so a channel is a strided view over the file and
+# windows of an epoch are a sliding_window_view of that: nothing is parsed or copied
+# until the caller touches the values, and only the touched pages are read from disk.
+
+DEFAULT_ROOT = 'data/sessions'
+DATA_FILE = 'data.bin'
+INDEX_FILE = 'index.json'
+
+
+class SessionWriter():
+    def __init__(self, path, board_id, sampling_rate, num_rows, dtype='float64', pyramid=LEVELS):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.index = {
+            'board_id': int(board_id),
+            'sampling_rate': int(sampling_rate),
+            'num_rows': int(num_rows),
+            'dtype': dtype,
+            'num_samples': 0,
+            'epochs': [],
+            'markers': [],
+            'artifacts': [],
+            'timestamp_offset': 0.0,
+            'pyramid': list(pyramid or []),
+        }
+        self.dtype = np.dtype(dtype)
+        # float32 cannot hold time.time() (steps of 128 s), single precision recordings
+        # keep timestamps relative to the first sample
+        self.timestamp_channel = None
+        if self.dtype != np.float64:
+            self.timestamp_channel = BoardShim.get_timestamp_channel(board_id)
+        self.file = open(os.path.join(path, DATA_FILE), 'wb')
+        self.open_epoch = None
+        self.pyramid = PyramidWriter(path, num_rows, pyramid) if pyramid else None
+
+    @property
+    def num_samples(self):
+        return self.index['num_samples']
+
+    def append(self, data):
+        # data: (rows, samples) as returned by BoardShim
+        if data.shape[1] == 0:
+            return
+        block = np.ascontiguousarray(data.T, dtype=self.dtype)
+        if self.timestamp_channel is not None:
+            if self.num_samples == 0:
+                self.index['timestamp_offset'] = float(data[self.timestamp_channel, 0])
+            block[:, self.timestamp_channel] = data[self.timestamp_channel] - self.index['timestamp_offset']
+        self.file.write(block.tobytes())
+        if self.pyramid is not None:
+            self.pyramid.append(block)
+        self.index['num_samples'] += data.shape[1]
+
+    def begin_epoch(self, label, sample=None):
+        # Closes the running epoch, phases of a calibration are back to back
+        sample = self.num_samples if sample is None else sample
+        self.end_epoch(sample)
+        self.open_epoch = {'label': label, 'start': int(sample), 'stop': None}
+        self.index['epochs'].append(self.open_epoch)
+        self.flush_index()
+
+    def end_epoch(self, sample=None):
+        if self.open_epoch is not None:
+            self.open_epoch['stop'] = int(self.num_samples if sample is None else sample)
+            self.open_epoch = None
+
+    def add_marker(self, label, sample=None):
+        sample = self.num_samples if sample is None else sample
+        self.index['markers'].append({'label': label, 'sample': int(sample)})
+
+    def flag_artifact(self, start, stop, reason, row=None):
+        self.index['artifacts'].append({'start': int(start), 'stop': int(stop), 'reason': reason,
+                                        'row': None if row is None else int(row)})
+
+    def flush_index(self):
+        self.file.flush()
+        if self.pyramid is not None:
+            self.pyramid.flush()
+        tmp = os.path.join(self.path, INDEX_FILE + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.index, f, indent=1)
+        os.replace(tmp, os.path.join(self.path, INDEX_FILE))
+
+    def close(self):
+        self.end_epoch()
+        if self.pyramid is not None:
+            self.pyramid.close()
+            self.pyramid = None
+        self.flush_index()
+        self.file.close()
+
+
+class SessionRecorder():
+    # Appends the samples that are new in each window returned by get_current_board_data
+    def __init__(self, writer, board_id):
+        self.writer = writer
+        self.timestamp_channel = BoardShim.get_timestamp_channel(board_id)
+        self.marker_channel = BoardShim.get_marker_channel(board_id)
+        self.last_timestamp = 0
+        # Samples lost on the radio link become 'dropped' artifacts, the counters go to the index
+        self.link = LinkMonitor(board_id)
+
+    def update(self, data):
+        timestamps = data[self.timestamp_channel]
+        count = int(np.count_nonzero(timestamps > self.last_timestamp))
+        if count == 0:
+            return 0
+        if self.last_timestamp and count == data.shape[1]:
+            # The whole window is new, samples between the two ticks were never seen
+            self.writer.flag_artifact(self.writer.num_samples, self.writer.num_samples + 1, 'gap')
+        self.last_timestamp = timestamps[-1]
+        block = data[:, -count:]
+        start = self.writer.num_samples
+        for i, label in marker_events(block[self.marker_channel]):
+            self.writer.add_marker(label, start + i)
+        for i, missing in self.link.push(block):
+            self.writer.flag_artifact(start + i, start + i + 1, 'dropped')
+        self.writer.index['link'] = self.link.counters()
+        self.writer.append(block)
+        return count
+
+
+class Session():
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(os.path.normpath(path))
+        with open(os.path.join(path, INDEX_FILE)) as f:
+            self.index = json.load(f)
+        self.board_id = self.index['board_id']
+        self.sampling_rate = self.index['sampling_rate']
+        shape = (self.index['num_samples'], self.index['num_rows'])
+        if shape[0]:
+            self.data = np.memmap(os.path.join(path, DATA_FILE), dtype=self.index['dtype'], mode='r', shape=shape)
+        else:
+            self.data = np.zeros(shape, dtype=self.index['dtype'])
+
+    def channel(self, row):
+        # Strided view of one board row over the whole session
+        return self.data[:, row]
+
+    def save_index(self):
+        tmp = os.path.join(self.path, INDEX_FILE + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.index, f, indent=1)
+        os.replace(tmp, os.path.join(self.path, INDEX_FILE))
+
+    def pyramid(self):
+        # Downsampled levels for review, only data.bin for sessions recorded without them
+        return Pyramid(self.path, self.data, self.index.get('pyramid', []))
+
+    def timestamps(self):
+        # Absolute time.time() of every sample, whatever the precision of the recording
+        row = BoardShim.get_timestamp_channel(self.board_id)
+        return self.channel(row).astype(np.float64) + self.index.get('timestamp_offset', 0.0)
+
+    def epochs(self, label=None):
+        for epoch in self.index['epochs']:
+            if label is None or epoch['label'] == label:
+                stop = epoch['stop'] if epoch['stop'] is not None else len(self.data)
+                yield epoch['start'], stop
+
+    def artifact_mask(self, row=None):
+        mask = np.zeros(len(self.data), dtype=bool)
+        for artifact in self.index['artifacts']:
+            if row is None or artifact['row'] is None or artifact['row'] == row:
+                mask[artifact['start']:artifact['stop']] = True
+        return mask
+
+    def windows(self, label, row, window, hop, skip_artifacts=True):
+        # One (windows, window) strided view per epoch with that label; windows touching
+        # a flagged artifact are dropped by striding over the clean stretches only
+        mask = self.artifact_mask(row) if skip_artifacts and self.index['artifacts'] else None
+        views = list()
+        for start, stop in self.epochs(label):
+            for clean_start, clean_stop in _clean_runs(mask, start, stop):
+                if clean_stop - clean_start >= window:
+                    views.append(sliding_window_view(self.data[clean_start:clean_stop, row], window)[::hop])
+        return views
+
+
+def _clean_runs(mask, start, stop):
+    if mask is None or not mask[start:stop].any():
+        return [(start, stop)]
+    bad = np.concatenate(([True], mask[start:stop], [True]))
+    edges = np.flatnonzero(np.diff(bad.astype(np.int8)))
+    return [(start + a, start + b) for a, b in zip(edges[0::2], edges[1::2])]
+
+
+class SessionStore():
+    def __init__(self, root=DEFAULT_ROOT):
+        self.root = root
+
+    def sessions(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root)
+                      if os.path.exists(os.path.join(self.root, name, INDEX_FILE)))
+
+    def create(self, name, board_id, sampling_rate=None, num_rows=None, dtype='float64'):
+        # dtype='float32' halves the size of a recording
+        if sampling_rate is None:
+            sampling_rate = BoardShim.get_sampling_rate(board_id)
+        if num_rows is None:
+            num_rows = BoardShim.get_num_rows(board_id)
+        return SessionWriter(os.path.join(self.root, name), board_id, sampling_rate, num_rows, dtype)
+
+    def open(self, name):
+        return Session(os.path.join(self.root, name))
+
+    def windows(self, label, row, window, hop, sessions=None):
+        # e.g. all 'move' windows of C4 across every session: yields (session, view)
+        for name in sessions or self.sessions():
+            session = self.open(name)
+            for view in session.windows(label, row, window, hop):
+                yield session, view
+
+    def import_csv(self, csv_path, name, board_id, label=None, events_path='', dtype='float64'):
+        # DataFilter.write_file output, as produced by rec_data_into_file. Markers inserted
+        # into the stream (OpenMarkers.py) become markers and calm/move epochs of the session;
+        # the event log is used instead when the board could not insert them.
+        data = DataFilter.read_file(csv_path)
+        writer = self.create(name, board_id, num_rows=data.shape[0], dtype=dtype)
+        events = marker_events(data[BoardShim.get_marker_channel(board_id)])
+        if events_path and not events:
+            # The log is shared by every session, keep the events of this recording only
+            timestamps = data[BoardShim.get_timestamp_channel(board_id)]
+            logged = [event for event in read_events(events_path)
+                      if timestamps[0] <= event[0] <= timestamps[-1]]
+            idx = align_events(logged, timestamps)
+            events = [(int(i), event[1]) for i, event in zip(idx, logged) if i < data.shape[1]]
+        for sample, marker in events:
+            writer.add_marker(marker, sample)
+        writer.index['epochs'] = epochs_from_markers(events, data.shape[1])
+        if label and not writer.index['epochs']:
+            writer.begin_epoch(label)
+        writer.append(data)
+        writer.close()
+        return self.open(name)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--root', type=str, help='session store directory', required=False, default=DEFAULT_ROOT)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('import', help='import a DataFilter.write_file csv')
+    p.add_argument('csv', type=str)
+    p.add_argument('--name', type=str, required=True)
+    p.add_argument('--board-id', type=int, required=False, default=2)
+    p.add_argument('--label', type=str, help='epoch label when the file has no phase markers', required=False,
+                   default='')
+    p.add_argument('--events', type=str, help='event log written by OpenMarkers.py', required=False, default='')
+    p.add_argument('--float32', action='store_true', help='store the samples in single precision')
+
+    sub.add_parser('list', help='list sessions and their epochs')
+
+    p = sub.add_parser('windows', help='count windows of one label and channel over all sessions')
+    p.add_argument('--label', type=str, required=True)
+    p.add_argument('--channel', type=str, required=False, default='C4')
+    p.add_argument('--window-size', type=float, help='seconds', required=False, default=4)
+    p.add_argument('--hop', type=float, help='seconds', required=False, default=0.05)
+    args = parser.parse_args()
+
+    store = SessionStore(args.root)
+    if args.command == 'import':
+        session = store.import_csv(args.csv, args.name, args.board_id, args.label, args.events,
+                                   'float32' if args.float32 else 'float64')
+        print("Imported", session.name, session.data.shape)
+    elif args.command == 'list':
+        for name in store.sessions():
+            session = store.open(name)
+            labels = sorted(set(e['label'] for e in session.index['epochs']))
+            print(name, session.data.shape, 'epochs:', labels, 'markers:', len(session.index['markers']),
+                  'artifacts:', len(session.index['artifacts']))
+    elif args.command == 'windows':
+        total = 0
+        for name in store.sessions():
+            # Sessions can come from different boards, resolve electrode and sizes per session
+            session = store.open(name)
+            row = electrode_rows(session.board_id, [args.channel])[0]
+            window = int(args.window_size * session.sampling_rate)
+            hop = max(int(args.hop * session.sampling_rate), 1)
+            total += sum(len(view) for view in session.windows(args.label, row, window, hop))
+        print(args.label, args.channel, 'windows:', total)
+
+
+if __name__ == "__main__":
+    main()
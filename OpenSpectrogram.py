@@ -0,0 +1,214 @@
+import argparse
+import pyqtgraph as pg
+from pyqtgraph.Qt import QtGui, QtCore
+import PySimpleGUI as sg
+import numpy as np
+
+from brainflow.board_shim import BoardShim, BrainFlowInputParams, LogLevels, BoardIds
+
+from OpenClassifier import electrode_rows
+from OpenSampleBus import BusBoard
+from OpenViewer import qt_app
+
+# Usage:
+#   TESTING          python OpenSpectrogram.py
+#   OPENBCI DATA     python OpenSpectrogram.py --board-id 2 --serial-port COM5 --history 60
+#                       NOTE: COM5 depends on port available in your Device Manager
+#
+# Time-frequency waterfall of C3/C4 (mu and beta desynchronization). Every tick only the
+# newest STFT column is computed (one Hann windowed rfft of the last second) and written
+# into a preallocated ring image; the plot shows the ring with a rolling offset, so the
+# cost per frame does not depend on the history length.
+
+# Black-blue-green-yellow-red, 256 colors packed as 0xffRRGGBB (QImage RGB32)
+COLORS = np.array([[0, 0, 0], [0, 0, 160], [0, 160, 120], [230, 220, 0], [255, 40, 0]], dtype=np.ubyte)
+
+
+def color_table(colors=COLORS):
+    lut = pg.ColorMap(np.linspace(0.0, 1.0, len(colors)), colors).getLookupTable(0.0, 1.0, 256, alpha=False)
+    lut = lut.astype(np.uint32)
+    return 0xff000000 | (lut[:, 0] << 16) | (lut[:, 1] << 8) | lut[:, 2]
+
+
+def stft_column(x, window):
+    # Power (dB) of the newest len(window) samples
+    segment = x[-len(window):]
+    spectrum = np.fft.rfft((segment - segment.mean()) * window)
+    return 10.0 * np.log10(np.abs(spectrum) ** 2 + 1e-12)
+
+
+class WaterfallItem(pg.ImageItem):
+    # ImageItem over a ring of colour mapped columns. The ring is mirrored (column i is
+    # written at i and i + columns) so the visible history is always one contiguous
+    # source rectangle of the same QImage, which shares memory with the buffer: a new
+    # column touches bins pixels and the image is never rebuilt or copied.
+    def __init__(self, bins, columns, levels=None):
+        super().__init__()
+        self.bins = bins
+        self.columns = columns
+        self.levels = levels
+        self.lut = color_table()
+        self.buffer = np.zeros((bins, 2 * columns), dtype=np.uint32)
+        self.qimage = pg.functions.makeQImage(self.buffer.view(np.ubyte).reshape(bins, 2 * columns, 4),
+                                              alpha=False, copy=False, transpose=False)
+        # width()/height()/boundingRect() of ImageItem read the shape of self.image
+        self.image = self.buffer[:, :columns].T
+        self.cursor = 0
+
+    def push(self, values):
+        if self.levels is None:
+            # Fixed after the first column so old columns keep their colours
+            self.levels = (float(np.percentile(values, 5)), float(values.max()))
+        low, high = self.levels
+        idx = np.clip((values - low) * (255.0 / max(high - low, 1e-12)), 0, 255).astype(np.intp)
+        colors = self.lut[idx]
+        self.buffer[:, self.cursor] = colors
+        self.buffer[:, self.cursor + self.columns] = colors
+        self.cursor = (self.cursor + 1) % self.columns
+        self.update()
+
+    def render(self):
+        pass
+
+    def paint(self, p, *args):
+        p.drawImage(QtCore.QRectF(0, 0, self.columns, self.bins), self.qimage,
+                    QtCore.QRectF(self.cursor, 0, self.columns, self.bins))
+
+
+class Graph():
+    def __init__(self, board_shim, electrodes=('C3', 'C4'), history_s=60, max_freq=40):
+        self.board_id = board_shim.get_board_id()
+        self.board_shim = board_shim
+        self.sampling_rate = BoardShim.get_sampling_rate(self.board_id)
+        self.update_speed_ms = 50
+        self.electrodes = list(electrodes)
+        self.rows = electrode_rows(self.board_id, self.electrodes)
+
+        # One second per column: 1 Hz bins
+        self.nfft = self.sampling_rate
+        self.window = np.hanning(self.nfft)
+        self.bins = int(max_freq * self.nfft / self.sampling_rate) + 1
+        self.columns = int(history_s * 1000 / self.update_speed_ms)
+        self.history_s = history_s
+
+        self.app = qt_app()
+        self.win = pg.GraphicsWindow(title='BrainFlow Plot',size=(800, 600))
+        self.win.setBackground('w')
+
+        self._init_timeseries()
+
+        timer = QtCore.QTimer()
+        timer.timeout.connect(self.update)
+        timer.start(self.update_speed_ms)
+        QtGui.QApplication.instance().exec_()
+
+    def _init_timeseries(self):
+        self.plots = list()
+        self.images = list()
+
+        # Time (s, 0 = now) on x, frequency (Hz) on y
+        transform = QtGui.QTransform()
+        transform.translate(-self.history_s, 0)
+        transform.scale(self.update_speed_ms / 1000.0, self.sampling_rate / self.nfft)
+
+        for i, name in enumerate(self.electrodes):
+            p = self.win.addPlot(i,0)
+            p.showAxis('left', True)
+            p.setMenuEnabled('left', False)
+            p.showAxis('bottom', True)
+            p.setMenuEnabled('bottom', False)
+            p.setTitle(name + ' SPECTROGRAM')
+            p.setLabel("bottom", "Time (s)")
+            p.setLabel("left", "Freq (Hz)")
+            image = WaterfallItem(self.bins, self.columns)
+            image.setTransform(transform)
+            p.addItem(image)
+            p.setRange(xRange=[-self.history_s, 0], yRange=[0, self.bins], padding=0)
+            self.plots.append(p)
+            self.images.append(image)
+
+    def update(self):
+        data = self.board_shim.get_current_board_data(self.nfft)
+        if data.shape[1] < self.nfft:
+            return
+
+        for image, row in zip(self.images, self.rows):
+            image.push(stft_column(data[row], self.window)[:self.bins])
+
+        self.app.processEvents()
+
+
+def stream_window(board, electrodes, history_s, max_freq):
+    Graph(board, electrodes, history_s, max_freq)
+
+
+def main():
+    BoardShim.enable_dev_board_logger()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--timeout', type=int, help='timeout for device discovery or connection', required=False,
+                        default=0)
+    parser.add_argument('--ip-port', type=int, help='ip port', required=False, default=0)
+    parser.add_argument('--ip-protocol', type=int, help='ip protocol, check IpProtocolType enum', required=False,
+                        default=0)
+    parser.add_argument('--ip-address', type=str, help='ip address', required=False, default='')
+    parser.add_argument('--serial-port', type=str, help='serial port', required=False, default='')
+    parser.add_argument('--mac-address', type=str, help='mac address', required=False, default='')
+    parser.add_argument('--other-info', type=str, help='other info', required=False, default='')
+    parser.add_argument('--streamer-params', type=str, help='streamer params', required=False, default='')
+    parser.add_argument('--serial-number', type=str, help='serial number', required=False, default='')
+    parser.add_argument('--board-id', type=int, help='board id, check docs to get a list of supported boards',
+                        required=False, default=BoardIds.SYNTHETIC_BOARD)
+    parser.add_argument('--file', type=str, help='file', required=False, default='')
+    parser.add_argument('--bus', type=str, help='attach to the stream of OpenSampleBus.py instead of the board',
+                        required=False, default='')
+    parser.add_argument('--electrodes', type=str, nargs='+', help='electrodes to show', required=False,
+                        default=['C3', 'C4'])
+    parser.add_argument('--history', type=float, help='seconds of history', required=False, default=60)
+    parser.add_argument('--max-freq', type=float, help='highest frequency shown (Hz)', required=False, default=40)
+    args = parser.parse_args()
+
+    params = BrainFlowInputParams()
+    params.ip_port = args.ip_port
+    params.serial_port = args.serial_port
+    params.mac_address = args.mac_address
+    params.other_info = args.other_info
+    params.serial_number = args.serial_number
+    params.ip_address = args.ip_address
+    params.ip_protocol = args.ip_protocol
+    params.timeout = args.timeout
+    params.file = args.file
+
+    board_id = args.board_id
+    if args.bus:
+        # Shared stream published by OpenSampleBus.py, no second board session
+        board = BusBoard(args.bus)
+    else:
+        board = BoardShim(board_id, params)
+        board.prepare_session()
+        # Room for the one second STFT window
+        board.start_stream(45000, args.streamer_params)
+    BoardShim.log_message(LogLevels.LEVEL_INFO.value, 'start sleeping in the main thread')
+
+    layout = [
+        [sg.Button('Spectrogram', size=(100,1), key="stream")]
+     ]
+
+    window = sg.Window('OpenSpectrogram', layout, size=(400,300), grab_anywhere=True)
+    while True:
+        event, values = window.read()
+
+        if event == "stream":
+            stream_window(board, args.electrodes, args.history, args.max_freq)
+
+        if event == sg.WIN_CLOSED:
+            if board.is_prepared():
+                    BoardShim.log_message(LogLevels.LEVEL_INFO, 'Releasing session')
+                    board.release_session()
+            break
+
+        window.close()
+
+
+if __name__ == "__main__":
+    main()
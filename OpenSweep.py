@@ -0,0 +1,234 @@
+import argparse
+import csv
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory, util
+import numpy as np
+
+from OpenClassifier import electrode_rows
+from OpenPipeline import make_params, replay
+from OpenSessionStore import SessionStore
+
+# Usage:
+#   python OpenSweep.py --window-size 2 4 --notch-width 2 4 --deviation-limit 30000 108194 calibrated
+#   python OpenSweep.py --sessions calib_01 calib_02 --bandpass 0.5:90 1:45 --out data/sweep.csv
+#
+# Replays recorded sessions (OpenSessionStore, with calm/move epochs) through the control
+# path for every combination of the given parameters, one configuration per worker of a
+# process pool. The control channel of every session is loaded once into a shared memory
+# block; workers attach to it at start-up and never read the recordings again.
+
+LABEL_NONE = 0
+LABEL_CALM = 1
+LABEL_MOVE = 2
+
+COLUMNS = ['window_size', 'bandpass', 'notch_width', 'deviation_limit', 'phase_s', 'speed',
+           'accuracy', 'false_triggers_per_min', 'detect_latency_s', 'separation_cm', 'tick_ms']
+
+# Worker side views, set by _attach
+_shared = dict()
+
+
+def load_corpus(store, names, channel):
+    # One float64 block with the control channel of every session followed by one int8
+    # block with the epoch label of every sample
+    signals = list()
+    labels = list()
+    meta = list()
+    for name in names:
+        session = store.open(name)
+        if not session.index['epochs']:
+            print("Skipping", name, "(no epochs)")
+            continue
+        row = electrode_rows(session.board_id, [channel])[0]
+        label = np.zeros(len(session.data), dtype=np.int8)
+        for start, stop in session.epochs('calm'):
+            label[start:stop] = LABEL_CALM
+        for start, stop in session.epochs('move'):
+            label[start:stop] = LABEL_MOVE
+        signals.append(session.channel(row))
+        labels.append(label)
+        meta.append((name, session.sampling_rate, len(label)))
+
+    total = sum(len(s) for s in signals)
+    shm = shared_memory.SharedMemory(create=True, size=max(total * 9, 1))
+    data = np.ndarray((total,), dtype=np.float64, buffer=shm.buf)
+    label_block = np.ndarray((total,), dtype=np.int8, buffer=shm.buf, offset=total * 8)
+    offset = 0
+    layout = list()
+    for (name, sampling_rate, length), signal, label in zip(meta, signals, labels):
+        data[offset:offset + length] = signal
+        label_block[offset:offset + length] = label
+        layout.append((name, sampling_rate, offset, length))
+        offset += length
+    return shm, layout, total
+
+
+def _attach(shm_name, layout, total):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    # Workers must not unlink the block when they exit, only the parent owns it
+    try:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+    # Closed when the worker exits (the pool does not run atexit handlers)
+    util.Finalize(shm, _detach, exitpriority=10)
+    _shared['shm'] = shm
+    data = np.ndarray((total,), dtype=np.float64, buffer=shm.buf)
+    labels = np.ndarray((total,), dtype=np.int8, buffer=shm.buf, offset=total * 8)
+    _shared['sessions'] = [(name, sampling_rate, data[offset:offset + length], labels[offset:offset + length])
+                           for name, sampling_rate, offset, length in layout]
+
+
+def _detach():
+    # The views into the block go first, close() fails while any is alive
+    shm = _shared.pop('shm', None)
+    _shared.clear()
+    if shm is not None:
+        shm.close()
+
+
+def _calibrated_limit(deviations, tick_labels, tick_seconds, phase_s):
+    # OpenCalibration: mean deviation over the first phase_s seconds of each phase, midpoint
+    calm_start = tick_seconds[tick_labels == LABEL_CALM]
+    move_start = tick_seconds[tick_labels == LABEL_MOVE]
+    if len(calm_start) == 0 or len(move_start) == 0:
+        return np.inf
+    calm = deviations[(tick_labels == LABEL_CALM) & (tick_seconds < calm_start[0] + phase_s)]
+    move = deviations[(tick_labels == LABEL_MOVE) & (tick_seconds < move_start[0] + phase_s)]
+    return (calm.mean() + move.mean()) / 2.0
+
+
+def evaluate(params):
+    correct = 0
+    labelled = 0
+    false_triggers = 0
+    calm_seconds = 0.0
+    latencies = list()
+    separation = list()
+    tick_seconds = list()
+    for name, sampling_rate, signal, labels in _shared['sessions']:
+        ends, deviations, seconds = replay(signal, sampling_rate, params)
+        if len(ends) == 0:
+            continue
+        tick_seconds.append(seconds)
+        tick_labels = labels[ends - 1]
+        tick_time = ends / sampling_rate
+        # Seconds of new data behind each tick, from the tick grid (hops of 6 and 7
+        # samples at 125 Hz); the first tick gets one nominal hop
+        dt = np.diff(tick_time, prepend=tick_time[0] - params['update_speed_ms'] / 1000.0)
+        limit = params['deviation_limit']
+        if limit == 'calibrated':
+            limit = _calibrated_limit(deviations, tick_labels, tick_time, params['phase_s'])
+        movement = deviations > float(limit)
+
+        known = tick_labels != LABEL_NONE
+        correct += np.count_nonzero(movement[known] == (tick_labels[known] == LABEL_MOVE))
+        labelled += np.count_nonzero(known)
+
+        # Rising edges of the decision while the subject was told to keep calm
+        calm = tick_labels == LABEL_CALM
+        rising = np.flatnonzero(movement[1:] & ~movement[:-1]) + 1
+        false_triggers += np.count_nonzero(calm[rising])
+        calm_seconds += float(dt[calm].sum())
+
+        # Time from the start of each move epoch to the first movement decision
+        move = tick_labels == LABEL_MOVE
+        starts = np.flatnonzero(move & ~np.concatenate(([False], move[:-1])))
+        for start in starts:
+            hits = np.flatnonzero(movement[start:] & move[start:])
+            if len(hits):
+                latencies.append(tick_time[start + hits[0]] - tick_time[start])
+
+        # Simple altitude model of OpenDroneUpDown: +speed when moving, -speed otherwise
+        altitude = np.empty(len(movement))
+        height = 0.0
+        for i, up in enumerate(movement):
+            height = min(max(height + (dt[i] if up else -dt[i]) * params['speed'], 0.0), 300.0)
+            altitude[i] = height
+        if move.any() and calm.any():
+            separation.append(altitude[move].mean() - altitude[calm].mean())
+
+    all_ticks = np.concatenate(tick_seconds) if tick_seconds else np.zeros(1)
+    return {
+        'accuracy': correct / labelled if labelled else float('nan'),
+        'false_triggers_per_min': 60.0 * false_triggers / calm_seconds if calm_seconds else float('nan'),
+        'detect_latency_s': float(np.mean(latencies)) if latencies else float('nan'),
+        'separation_cm': float(np.mean(separation)) if separation else float('nan'),
+        'tick_ms': 1000.0 * float(np.mean(all_ticks)),
+    }
+
+
+def parse_limit(value):
+    return value if value == 'calibrated' else float(value)
+
+
+def parse_band(value):
+    low, high = value.split(':')
+    return (float(low), float(high))
+
+
+def build_grid(args):
+    grid = list()
+    for window_size, bandpass, notch_width, limit, phase_s, speed in itertools.product(
+            args.window_size, args.bandpass, args.notch_width, args.deviation_limit, args.phase, args.speed):
+        grid.append(make_params(window_size=window_size, bandpass=bandpass, notch_width=notch_width,
+                                deviation_limit=limit, phase_s=phase_s, speed=speed))
+    return grid
+
+
+def format_row(params, result):
+    row = dict((key, params[key]) for key in COLUMNS[:6])
+    row['bandpass'] = '%g:%g' % params['bandpass']
+    row.update(result)
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--root', type=str, help='session store directory', required=False, default='data/sessions')
+    parser.add_argument('--sessions', type=str, nargs='*', help='session names, default all', required=False,
+                        default=None)
+    parser.add_argument('--channel', type=str, help='control electrode', required=False, default='C4')
+    parser.add_argument('--window-size', type=float, nargs='+', required=False, default=[4])
+    parser.add_argument('--bandpass', type=parse_band, nargs='+', required=False, default=[(0.5, 90.0)])
+    parser.add_argument('--notch-width', type=float, nargs='+', required=False, default=[4.0])
+    parser.add_argument('--deviation-limit', type=parse_limit, nargs='+', required=False, default=[108194.0])
+    parser.add_argument('--phase', type=float, nargs='+', help='calibration phase seconds (calibrated limit)',
+                        required=False, default=[20])
+    parser.add_argument('--speed', type=float, nargs='+', required=False, default=[50])
+    parser.add_argument('--workers', type=int, help='process pool size, default all cores', required=False,
+                        default=os.cpu_count())
+    parser.add_argument('--out', type=str, help='write the table as csv', required=False, default='')
+    args = parser.parse_args()
+
+    store = SessionStore(args.root)
+    names = args.sessions or store.sessions()
+    shm, layout, total = load_corpus(store, names, args.channel)
+    grid = build_grid(args)
+    print("Sessions: %d, samples: %d, configurations: %d, workers: %d" % (len(layout), total, len(grid), args.workers))
+
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=_attach,
+                                 initargs=(shm.name, layout, total)) as pool:
+            rows = [format_row(params, result) for params, result in zip(grid, pool.map(evaluate, grid))]
+    finally:
+        # The workers share this process' resource tracker and dropped its entry when
+        # they attached, register it again so unlink() has one to remove
+        resource_tracker.register(shm._name, 'shared_memory')
+        shm.close()
+        shm.unlink()
+
+    print('\t'.join(COLUMNS))
+    for row in rows:
+        print('\t'.join(('%.4g' % row[c]) if isinstance(row[c], float) else str(row[c]) for c in COLUMNS))
+    if args.out:
+        with open(args.out, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    main()
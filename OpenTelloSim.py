@@ -0,0 +1,304 @@
+import argparse
+import csv
+import socket
+import sys
+import threading
+import time
+
+# Usage:
+#   Simulator              python OpenTelloSim.py --port 9889 --log data/tello_sim.csv
+#   Drone script against it python OpenDroneUpDown.py --tello-sim 127.0.0.1:9889
+#   Latency check          python OpenTelloSim.py --check
+#
+# Local stand-in for a DJI Tello speaking the SDK text protocol over UDP: control commands
+# are answered with "ok" (after --delay seconds), rc is never answered like on the real
+# drone, state packets can be sent to a client state port and a simple altitude model
+# follows takeoff/land/rc.
+# Each received command is timestamped with time.time(), the same clock BrainFlow uses
+# for its timestamp channel, so command times can be compared with EEG sample times.
+#
+# djitellopy binds the fixed Tello ports 8889/8890 on all interfaces, which makes a
+# simulator on the same host impossible to reach with it. TelloLink below is the small
+# client the drone scripts use instead when --tello-sim is given.
+
+TAKEOFF_HEIGHT_CM = 80
+MAX_HEIGHT_CM = 1000
+
+
+class TelloSimulator():
+    def __init__(self, host='127.0.0.1', port=8889, state_port=None, state_interval=0.1, delay=0.0):
+        self.delay = delay
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.sock.settimeout(0.05)
+        self.address = self.sock.getsockname()
+        self.state_interval = state_interval
+        self.client = None
+        self.state_port = state_port
+        self.log = list()
+        self.flying = False
+        self.height = 0.0
+        self.vz = 0.0
+        self.last_update = time.time()
+        self.running = False
+        self.thread = threading.Thread(target=self._serve, name='tello-sim', daemon=True)
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        self.sock.close()
+
+    def _advance(self, now):
+        # Integrate the last rc vertical speed until now
+        if self.flying:
+            self.height = min(max(self.height + self.vz * (now - self.last_update), 0.0), MAX_HEIGHT_CM)
+        self.last_update = now
+
+    def handle(self, command, now):
+        self._advance(now)
+        words = command.split()
+        name = words[0] if words else ''
+        if name == 'takeoff':
+            self.flying = True
+            self.height = TAKEOFF_HEIGHT_CM
+            self.vz = 0.0
+        elif name == 'land':
+            self.flying = False
+            self.height = 0.0
+            self.vz = 0.0
+        elif name == 'rc' and len(words) == 5:
+            # rc a b c d: left/right, forward/back, up/down, yaw in -100..100 (cm/s for up/down)
+            self.vz = float(words[3]) if self.flying else 0.0
+            return None
+        elif name.endswith('?'):
+            if name == 'height?':
+                return '%ddm' % int(self.height / 10)
+            if name == 'battery?':
+                return '100'
+            return '0'
+        return 'ok'
+
+    def state(self):
+        return ('pitch:0;roll:0;yaw:0;vgx:0;vgy:0;vgz:%d;templ:40;temph:45;tof:%d;h:%d;bat:100;'
+                'baro:0.00;time:0;agx:0.00;agy:0.00;agz:0.00;\r\n' % (-self.vz, self.height + 10, self.height))
+
+    def _serve(self):
+        next_state = time.time()
+        while self.running:
+            try:
+                data, address = self.sock.recvfrom(1024)
+            except (socket.timeout, ConnectionError):
+                # ConnectionError: ICMP port unreachable left over from a state packet
+                data = None
+            now = time.time()
+            if data:
+                command = data.decode('utf-8', 'replace').strip()
+                self.client = address
+                response = self.handle(command, now)
+                self.log.append((now, command, round(self.height, 1)))
+                if response is not None and self.delay > 0:
+                    # Late answer without holding the commands that follow
+                    threading.Timer(self.delay, self._reply, (response, address)).start()
+                elif response is not None:
+                    self._reply(response, address)
+            if self.state_port and self.client is not None and now >= next_state:
+                self._advance(now)
+                self.sock.sendto(self.state().encode('utf-8'), (self.client[0], self.state_port))
+                next_state = now + self.state_interval
+
+    def _reply(self, response, address):
+        try:
+            self.sock.sendto(response.encode('utf-8'), address)
+        except OSError:
+            # Stopped meanwhile
+            pass
+
+    def report(self):
+        counts = dict()
+        for _, command, _ in self.log:
+            name = command.split()[0] if command else ''
+            counts[name] = counts.get(name, 0) + 1
+        rc_times = [t for t, command, _ in self.log if command.startswith('rc ')]
+        rate = 0.0
+        interval_max = 0.0
+        if len(rc_times) > 1:
+            rate = (len(rc_times) - 1) / (rc_times[-1] - rc_times[0])
+            interval_max = max(b - a for a, b in zip(rc_times[:-1], rc_times[1:]))
+        return {'counts': counts, 'rc_rate_hz': rate, 'rc_interval_max_s': interval_max,
+                'height_cm': self.height}
+
+    def write_log(self, path):
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['time', 'command', 'height_cm'])
+            writer.writerows(self.log)
+
+
+class TelloLink():
+    # The part of djitellopy.tello.Tello used by the drone scripts, over an ephemeral port.
+    # Control commands wait for their answer, rc is sent without waiting as djitellopy
+    # does. command_log keeps (send time, command, round trip seconds, None without an
+    # answer) for latency measurements.
+    def __init__(self, host='127.0.0.1', port=8889, timeout=1.0):
+        self.address = (host, port)
+        self.timeout = timeout
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1' if host.startswith('127.') else '', 0))
+        self.sock.settimeout(timeout)
+        self.command_log = list()
+        self.lock = threading.Lock()
+
+    def _drain(self):
+        # Answers that arrived after their command timed out would be taken as the answer
+        # of the next one
+        self.sock.setblocking(False)
+        try:
+            while True:
+                self.sock.recvfrom(1024)
+        except (BlockingIOError, ConnectionError):
+            pass
+        finally:
+            self.sock.settimeout(self.timeout)
+
+    def send_command_without_return(self, command):
+        with self.lock:
+            self.sock.sendto(command.encode('utf-8'), self.address)
+            self.command_log.append((time.time(), command, None))
+
+    def send_command(self, command):
+        with self.lock:
+            self._drain()
+            sent = time.time()
+            self.sock.sendto(command.encode('utf-8'), self.address)
+            try:
+                data, address = self.sock.recvfrom(1024)
+            except socket.timeout:
+                self.command_log.append((sent, command, None))
+                return None
+            response = data.decode('utf-8', 'replace').strip()
+            self.command_log.append((sent, command, time.time() - sent))
+            return response
+
+    def connect(self):
+        if self.send_command('command') != 'ok':
+            raise RuntimeError('No answer from Tello simulator at %s:%d' % self.address)
+
+    def takeoff(self):
+        self.send_command('takeoff')
+
+    def land(self):
+        self.send_command('land')
+
+    def send_rc_control(self, left_right_velocity, forward_backward_velocity, up_down_velocity, yaw_velocity):
+        self.send_command_without_return('rc %d %d %d %d' % (left_right_velocity, forward_backward_velocity,
+                                                             up_down_velocity, yaw_velocity))
+
+    def end(self):
+        self.sock.close()
+
+
+def connect_drone(sim_address=''):
+    # Real drone through djitellopy, or the local simulator when "host:port" is given
+    if sim_address:
+        host, port = sim_address.rsplit(':', 1)
+        me = TelloLink(host, int(port))
+    else:
+        from djitellopy import tello
+        me = tello.Tello()
+    me.connect()
+    return me
+
+
+def latency_check(ticks=60, delay=0.1):
+    # OpenDroneUpDown.Graph against a simulator that answers delay seconds late, on the
+    # synthetic board (timestamps from time.time() like a real board). Returns the mean
+    # eeg_to_command and drone stage seconds, the rc commands received and the round trip
+    # of a control command sent after them.
+    import contextlib
+    import io
+    from brainflow.board_shim import BoardIds, BoardShim, BrainFlowInputParams
+    from OpenMetrics import Metrics
+    import OpenDroneUpDown
+
+    sim = TelloSimulator('127.0.0.1', 0, delay=delay).start()
+    board = BoardShim(BoardIds.SYNTHETIC_BOARD.value, BrainFlowInputParams())
+    board.prepare_session()
+    board.start_stream()
+    try:
+        me = TelloLink(*sim.address, timeout=1.0 + delay)
+        me.connect()
+        metrics = Metrics()
+        time.sleep(1.0)
+        with contextlib.redirect_stdout(io.StringIO()):
+            g = OpenDroneUpDown.Graph(board, me, metrics, exec_loop=False)
+            period = g.update_speed_ms / 1000.0
+            next_tick = time.perf_counter()
+            for _ in range(ticks):
+                g.update()
+                next_tick += period
+                time.sleep(max(next_tick - time.perf_counter(), 0.0))
+        me.land()
+        g.win.close()
+    finally:
+        board.release_session()
+        sim.stop()
+
+    def mean(stage):
+        count = metrics.values[('stage_seconds_count', 'stage="%s"' % stage)]
+        return metrics.values[('stage_seconds_sum', 'stage="%s"' % stage)] / max(count, 1)
+
+    return mean('eeg_to_command'), mean('drone'), sim.report()['counts'].get('rc', 0), me.command_log[-1][2]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, help='address to listen on', required=False, default='127.0.0.1')
+    parser.add_argument('--port', type=int, help='command port', required=False, default=8889)
+    parser.add_argument('--state-port', type=int, help='send Tello state packets to this client port',
+                        required=False, default=0)
+    parser.add_argument('--duration', type=float, help='seconds to run, 0 runs until Ctrl+C', required=False,
+                        default=0)
+    parser.add_argument('--log', type=str, help='write every received command to this csv', required=False,
+                        default='')
+    parser.add_argument('--delay', type=float, help='seconds before a control command is answered',
+                        required=False, default=0.0)
+    parser.add_argument('--check', action='store_true',
+                        help='check that rc commands do not wait for the drone (eeg_to_command metric)')
+    args = parser.parse_args()
+
+    if args.check:
+        # The synthetic board clock is not exactly time.time(), so eeg_to_command is
+        # compared with a drone that answers at once
+        ticks = 60
+        delay = args.delay or 0.1
+        base, _, _, _ = latency_check(ticks, 0.0)
+        latency, drone, received, round_trip = latency_check(ticks, delay)
+        print("eeg_to_command %+.1f ms over an immediate answer, drone stage %.1f ms, rc received %d of %d" % (
+            1e3 * (latency - base), 1e3 * drone, received, ticks))
+        print("Control command round trip %.0f ms (answer delay %.0f ms)" % (1e3 * (round_trip or 0.0), 1e3 * delay))
+        # rc must not wait for an answer, and a control command gets its own answer
+        ok = (drone < 0.1 * delay and latency - base < 0.25 * delay and received == ticks and
+              round_trip is not None and delay <= round_trip < 2 * delay)
+        sys.exit(0 if ok else 1)
+
+    sim = TelloSimulator(args.host, args.port, args.state_port, delay=args.delay).start()
+    print("Tello simulator listening on %s:%d" % sim.address)
+    try:
+        start = time.time()
+        while not args.duration or time.time() - start < args.duration:
+            time.sleep(0.2)
+    except KeyboardInterrupt:
+        pass
+    sim.stop()
+    print(sim.report())
+    if args.log:
+        sim.write_log(args.log)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import argparse
+import logging
+import numpy as np
+import pyqtgraph as pg
+from pyqtgraph.Qt import QtGui, QtCore
+
+from brainflow.board_shim import BoardShim, BrainFlowInputParams, BoardIds
+
+from OpenClassifier import band_powers
+from OpenMontage import board_montage
+from OpenSampleBus import BusBoard
+from OpenViewer import qt_app
+
+# Usage:
+#   TESTING          python OpenTopoMap.py
+#   OPENBCI DATA     python OpenTopoMap.py --board-id 2 --serial-port COM5 --band mu
+#                       NOTE: COM5 depends on port available in your Device Manager
+#
+# Scalp map of the mu or beta band power of the 16 Cyton+Daisy electrodes, instead of the
+# 32 curves of RealTimePlot.py. The inverse distance interpolation weights from the
+# electrodes to every pixel are computed once; each update is the band power of the 16
+# channels and one matrix-vector product into a small image.
+
+# Approximate 10-20 positions, head radius 1, nose up (+y)
+POSITIONS = {
+    'FP1': (-0.31, 0.95), 'FP2': (0.31, 0.95),
+    'F7': (-0.81, 0.59), 'F3': (-0.42, 0.55), 'Fz': (0.0, 0.5), 'F4': (0.42, 0.55), 'F8': (0.81, 0.59),
+    'T3': (-1.0, 0.0), 'C3': (-0.5, 0.0), 'Cz': (0.0, 0.0), 'C4': (0.5, 0.0), 'T4': (1.0, 0.0),
+    'T5': (-0.81, -0.59), 'P3': (-0.42, -0.55), 'Pz': (0.0, -0.5), 'P4': (0.42, -0.55),
+}
+TOPO_BANDS = {
+    'mu': (8.0, 12.0),
+    'beta': (13.0, 30.0),
+}
+
+
+def interpolation_matrix(positions, size=64, power=2.0):
+    # (size * size, electrodes) inverse distance weights; pixel (x, y) is row x * size + y,
+    # the col-major order of pyqtgraph's ImageItem. Rows sum to 1.
+    axis = np.linspace(-1.0, 1.0, size)
+    xs, ys = np.meshgrid(axis, axis, indexing='ij')
+    pixels = np.stack((xs.ravel(), ys.ravel()), axis=1)
+    distance = np.linalg.norm(pixels[:, np.newaxis] - np.asarray(positions)[np.newaxis], axis=2)
+    weights = 1.0 / np.maximum(distance, 1e-6) ** power
+    return weights / weights.sum(axis=1, keepdims=True)
+
+
+class Graph:
+    def __init__(self, board_shim, band='mu', size=64):
+        self.board_id = board_shim.get_board_id()
+        self.board_shim = board_shim
+        self.sampling_rate = BoardShim.get_sampling_rate(self.board_id)
+        self.update_speed_ms = 50
+        self.window_size = 2
+        self.num_points = self.window_size * self.sampling_rate
+
+        # Electrodes of the montage with a known scalp position, fetched as one subset
+        self.electrodes = [name for name in board_montage(self.board_id).names if name in POSITIONS]
+        self.channels = board_montage(self.board_id).subset(self.electrodes)
+        self.band = TOPO_BANDS[band]
+        self.size = size
+        self.weights = interpolation_matrix([POSITIONS[name] for name in self.electrodes], size)
+        self.image = np.zeros((size, size))
+
+        self.app = qt_app()
+        self.win = pg.GraphicsWindow(title='BrainFlow Plot',size=(600, 600))
+        self.win.setBackground('w')
+
+        self._init_timeseries(band)
+
+        timer = QtCore.QTimer()
+        timer.timeout.connect(self.update)
+        timer.start(self.update_speed_ms)
+        QtGui.QApplication.instance().exec_()
+
+    def _init_timeseries(self, band):
+        self.plot = self.win.addPlot(0,0)
+        self.plot.setAspectLocked(True)
+        self.plot.hideAxis('left')
+        self.plot.hideAxis('bottom')
+        self.plot.setMenuEnabled(False)
+        self.plot.setTitle(band.upper() + ' BAND POWER (log)')
+
+        # Image pixels cover [-1, 1] x [-1, 1]
+        self.topo = pg.ImageItem(self.image)
+        self.topo.setLookupTable(pg.ColorMap([0.0, 0.5, 1.0], [(0, 0, 200), (255, 255, 255), (200, 0, 0)])
+                                 .getLookupTable(0.0, 1.0, 256))
+        transform = QtGui.QTransform()
+        transform.translate(-1.0, -1.0)
+        transform.scale(2.0 / self.size, 2.0 / self.size)
+        self.topo.setTransform(transform)
+        self.plot.addItem(self.topo)
+
+        # White outside the head, head outline, nose and electrodes are drawn once
+        mask = QtGui.QPainterPath()
+        mask.addRect(QtCore.QRectF(-1.2, -1.2, 2.4, 2.4))
+        mask.addEllipse(QtCore.QPointF(0, 0), 1.0, 1.0)
+        mask_item = QtGui.QGraphicsPathItem(mask)
+        mask_item.setBrush(pg.mkBrush('w'))
+        mask_item.setPen(pg.mkPen(None))
+        self.plot.addItem(mask_item)
+        head = np.linspace(0, 2 * np.pi, 100)
+        self.plot.plot(np.cos(head), np.sin(head), pen=pg.mkPen('k', width=2))
+        self.plot.plot([-0.1, 0.0, 0.1], [0.99, 1.12, 0.99], pen=pg.mkPen('k', width=2))
+        x, y = np.array([POSITIONS[name] for name in self.electrodes]).T
+        self.plot.plot(x, y, pen=None, symbol='o', symbolSize=5, symbolBrush='k')
+        for name in self.electrodes:
+            label = pg.TextItem(name, color='k', anchor=(0.5, 1.2))
+            label.setPos(*POSITIONS[name])
+            self.plot.addItem(label)
+        self.plot.setRange(xRange=[-1.2, 1.2], yRange=[-1.2, 1.2], padding=0)
+
+    def update(self):
+        data = self.channels.fetch(self.board_shim, self.num_points)
+        if data.shape[1] < self.sampling_rate:
+            return
+        powers = band_powers(data, self.sampling_rate, [self.band])[:, 0]
+        # Inverse distance interpolation stays within the electrode values
+        np.dot(self.weights, powers, out=self.image.reshape(-1))
+        self.topo.setImage(self.image, autoLevels=False, levels=(powers.min(), powers.max()))
+
+        self.app.processEvents()
+
+
+def main():
+    BoardShim.enable_dev_board_logger()
+    logging.basicConfig(level=logging.DEBUG)
+
+    parser = argparse.ArgumentParser()
+    # use docs to check which parameters are required for specific board, e.g. for Cyton - set serial port
+    parser.add_argument('--timeout', type=int, help='timeout for device discovery or connection', required=False,
+                        default=0)
+    parser.add_argument('--ip-port', type=int, help='ip port', required=False, default=0)
+    parser.add_argument('--ip-protocol', type=int, help='ip protocol, check IpProtocolType enum', required=False,
+                        default=0)
+    parser.add_argument('--ip-address', type=str, help='ip address', required=False, default='')
+    parser.add_argument('--serial-port', type=str, help='serial port', required=False, default='')
+    parser.add_argument('--mac-address', type=str, help='mac address', required=False, default='')
+    parser.add_argument('--other-info', type=str, help='other info', required=False, default='')
+    parser.add_argument('--streamer-params', type=str, help='streamer params', required=False, default='')
+    parser.add_argument('--serial-number', type=str, help='serial number', required=False, default='')
+    parser.add_argument('--board-id', type=int, help='board id, check docs to get a list of supported boards',
+                        required=False, default=BoardIds.SYNTHETIC_BOARD)
+    parser.add_argument('--file', type=str, help='file', required=False, default='')
+    parser.add_argument('--bus', type=str, help='attach to the stream of OpenSampleBus.py instead of the board',
+                        required=False, default='')
+    parser.add_argument('--band', type=str, help='band shown', choices=sorted(TOPO_BANDS), required=False,
+                        default='mu')
+    parser.add_argument('--size', type=int, help='map resolution in pixels', required=False, default=64)
+    args = parser.parse_args()
+
+    params = BrainFlowInputParams()
+    params.ip_port = args.ip_port
+    params.serial_port = args.serial_port
+    params.mac_address = args.mac_address
+    params.other_info = args.other_info
+    params.serial_number = args.serial_number
+    params.ip_address = args.ip_address
+    params.ip_protocol = args.ip_protocol
+    params.timeout = args.timeout
+    params.file = args.file
+
+    try:
+        if args.bus:
+            # Shared stream published by OpenSampleBus.py, no second board session
+            board_shim = BusBoard(args.bus)
+        else:
+            board_shim = BoardShim(args.board_id, params)
+            board_shim.prepare_session()
+            board_shim.start_stream(450000, args.streamer_params)
+
+        Graph(board_shim, args.band, args.size)
+    except BaseException:
+        logging.warning('Exception', exc_info=True)
+    finally:
+        logging.info('End')
+        if board_shim.is_prepared():
+            logging.info('Releasing session')
+            board_shim.release_session()
+
+
+if __name__ == '__main__':
+    main()
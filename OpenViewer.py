@@ -0,0 +1,90 @@
+import pyqtgraph as pg
+from pyqtgraph.Qt import QtGui, QtCore
+
+# One Qt application and one plot window per process, reused by every stream_window call.
+# Each Graph builds its plots once into its own layout of the viewer; showing a view
+# swaps that layout into the window and runs a local event loop until the window is
+# closed, which only hides it. Plot items, curves and buffers stay alive between views,
+# so reopening is instant, and the window, timer and event loop are never rebuilt.
+#
+#   viewer = Viewer(size=(800, 600))
+#   viewer.open('OpenBCI', Graph, board)    # Graph(board, viewer) on first use, blocks until closed
+#   viewer.open('OpenBCI', Graph, board2)   # same plots, other stream
+
+
+def qt_app():
+    # The QApplication of the process, created on first use
+    app = QtGui.QApplication.instance()
+    if app is None:
+        app = QtGui.QApplication([])
+    return app
+
+
+class ViewerWidget(pg.GraphicsLayoutWidget):
+    # Closing the window ends the view but keeps the widget
+    def __init__(self, viewer, size, title):
+        super().__init__(size=size, title=title)
+        self.viewer = viewer
+
+    def closeEvent(self, event):
+        event.ignore()
+        self.viewer.hide()
+
+    def close(self):
+        # GraphicsView.close() tears down the scene for good
+        self.viewer.hide()
+        return True
+
+
+class Viewer():
+    def __init__(self, title='BrainFlow Plot', size=(800, 600)):
+        self.app = qt_app()
+        self.win = ViewerWidget(self, size, title)
+        self.win.setBackground('w')
+        self.timer = QtCore.QTimer()
+        self.timer.timeout.connect(self._update)
+        self.loop = QtCore.QEventLoop()
+        self.layouts = dict()
+        self.graphs = dict()
+        self.current = None
+
+    def layout(self, name):
+        # Plot layout of one view, kept for the life of the viewer
+        if name not in self.layouts:
+            self.layouts[name] = pg.GraphicsLayout()
+        return self.layouts[name]
+
+    def graph(self, name, factory, board_shim):
+        # Graph of that view, built once and pointed at board_shim. Another board id means
+        # another channel layout and sampling rate, the view is built again.
+        graph = self.graphs.get(name)
+        if graph is not None and graph.board_id != board_shim.get_board_id():
+            self.layouts[name].clear()
+            graph = None
+        if graph is None:
+            graph = factory(board_shim, self)
+            self.graphs[name] = graph
+        graph.board_shim = board_shim
+        return graph
+
+    def open(self, name, factory, board_shim):
+        # Shows the view and blocks until its window is closed
+        graph = self.graph(name, factory, board_shim)
+        self.show(name)
+        self.loop.exec_()
+        return graph
+
+    def show(self, name):
+        if self.win.centralWidget is not self.layouts[name]:
+            self.win.setCentralItem(self.layouts[name])
+        self.current = self.graphs[name]
+        self.timer.start(self.current.update_speed_ms)
+        self.win.show()
+
+    def hide(self):
+        self.timer.stop()
+        self.win.hide()
+        self.loop.quit()
+
+    def _update(self):
+        self.current.update()
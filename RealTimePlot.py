@@ -1,38 +1,43 @@
 import argparse
 import logging
-import numpy as np
-import pyqtgraph as pg
-from pyqtgraph.Qt import QtGui, QtCore 
+from functools import partial
 
 from brainflow.board_shim import BoardShim, BrainFlowInputParams, BoardIds
-from brainflow.data_filter import DataFilter, FilterTypes, DetrendOperations
+
+from OpenSampleBus import BusBoard
+from OpenViewer import Viewer
+from OpenMontage import board_montage
+from OpenParallel import ChannelPool, filter_fft
 
 # Usage:
 #   TESTING          python RealTimePlot.py
 #   OPENBCI DATA     python RealTimePlot.py --board-id 2 --serial-port COM5
 #                       NOTE: COM5 depends on port available in your Device Manage
 
+VIEW = 'RealTimePlot'
+
 class Graph:
-    def __init__(self, board_shim):
+    def __init__(self, board_shim, viewer=None, pool=None):
         self.board_id = board_shim.get_board_id()
         self.board_shim = board_shim
-        self.eeg_channels = BoardShim.get_eeg_channels(self.board_id)
+        # Every EEG row, fetched as one slice, labelled from the montage of the board
+        self.montage = board_montage(self.board_id)
+        self.eeg_channels = self.montage.eeg_channels
+        self.channels = self.montage.subset()
         self.sampling_rate = BoardShim.get_sampling_rate(self.board_id)
         self.update_speed_ms = 50
         self.window_size = 4
         self.num_points = self.window_size * self.sampling_rate
+        # Filter and FFT per channel, on the GUI thread unless a pool with threads is given
+        self.pool = pool if pool is not None else ChannelPool(1)
 
-        self.app = QtGui.QApplication([])
-        self.win = pg.GraphicsWindow(title='BrainFlow Plot',size=(1920, 1080))
-        self.win.setBackground('w')
+        # Plots are built once into this view of the viewer, Viewer.open shows them
+        self.viewer = viewer if viewer is not None else Viewer(size=(1920, 1080))
+        self.app = self.viewer.app
+        self.win = self.viewer.layout(VIEW)
 
         self._init_timeseries()
 
-        timer = QtCore.QTimer()
-        timer.timeout.connect(self.update)
-        timer.start(self.update_speed_ms)
-        QtGui.QApplication.instance().exec_()
-
 
     def _init_timeseries(self):
         self.plots = list()
@@ -46,37 +51,7 @@ class Graph:
             p.setMenuEnabled('bottom', False)
             if i == 0:
                 p.setTitle('TimeSeries Plot')
-                p.setLabel("left", "FP1")
-            if i == 1:
-                p.setLabel("left", "FP2")
-            if i == 2:
-                p.setLabel("left", "F7")
-            if i == 3:
-                p.setLabel("left", "F3")
-            if i == 4:
-                p.setLabel("left", "Fz")
-            if i == 5:
-                p.setLabel("left", "F4")
-            if i == 6:
-                p.setLabel("left", "F8")
-            if i == 7:
-                p.setLabel("left", "T3")
-            if i == 8:
-                p.setLabel("left", "C3")
-            if i == 9:
-                p.setLabel("left", "Cz")
-            if i == 10:
-                p.setLabel("left", "C4")
-            if i == 11:
-                p.setLabel("left", "T4")
-            if i == 12:
-                p.setLabel("left", "T5")
-            if i == 13:
-                p.setLabel("left", "P3")
-            if i == 14:
-                p.setLabel("left", "Pz")
-            if i == 15:
-                p.setLabel("left", "P4")
+            p.setLabel("left", self.montage.names[i])
             self.plots.append(p)
             curve = p.plot()
             self.curves.append(curve)
@@ -97,24 +72,16 @@ class Graph:
             self.curves.append(curve)
 
     def update(self):
-        data = self.board_shim.get_current_board_data(self.num_points)
-        for count, channel in enumerate(self.eeg_channels):
+        data = self.channels.fetch(self.board_shim, self.num_points)
+        # Detrend, band pass 0.5 Hz to 90 Hz, 50 Hz & 60 Hz notch and |FFT| of every channel
+        # (OpenParallel.filter_fft), rows filtered in place
+        ffts = self.pool.map(filter_fft, data, self.sampling_rate)
+        for channel in range(len(self.channels)):
             # plot timeseries
-            DataFilter.detrend(data[channel], DetrendOperations.CONSTANT.value)
-            # Butterworth.Remove Direct Current: Band pass filter from 0.5 Hz to 90 Hz
-            DataFilter.perform_bandpass(data[channel], self.sampling_rate, 0.5, 90.0, 2,
-                                        FilterTypes.BUTTERWORTH.value, 0)
-            # Noise Reduction: Notch filter 50 Hz & 60 Hz
-            DataFilter.perform_bandstop(data[channel], self.sampling_rate, 50.0, 4.0, 2,
-                                        FilterTypes.BUTTERWORTH.value, 0)
-            DataFilter.perform_bandstop(data[channel], self.sampling_rate, 60.0, 4.0, 2,
-                                        FilterTypes.BUTTERWORTH.value, 0)
-        
-            self.curves[count].setData(data[channel].tolist())
+            self.curves[channel].setData(data[channel].tolist())
 
             # FFT Plot per channel
-            YY = np.fft.fft(data[channel]) 
-            self.curves[count + 16].setData(abs(YY))
+            self.curves[channel + len(self.channels)].setData(ffts[channel])
 
         self.app.processEvents()
 
@@ -139,6 +106,10 @@ def main():
     parser.add_argument('--board-id', type=int, help='board id, check docs to get a list of supported boards',
                         required=False, default=BoardIds.SYNTHETIC_BOARD)
     parser.add_argument('--file', type=str, help='file', required=False, default='')
+    parser.add_argument('--bus', type=str, help='attach to the stream of OpenSampleBus.py instead of the board',
+                        required=False, default='')
+    parser.add_argument('--threads', type=int, help='filter threads, 0 for one per core (see OpenParallel.py)',
+                        required=False, default=1)
     args = parser.parse_args()
 
     params = BrainFlowInputParams()
@@ -153,11 +124,17 @@ def main():
     params.file = args.file
 
     try:
-        board_shim = BoardShim(args.board_id, params)
-        board_shim.prepare_session()
-        board_shim.start_stream(450000, args.streamer_params)
+        if args.bus:
+            # Shared stream published by OpenSampleBus.py, no second board session
+            board_shim = BusBoard(args.bus)
+        else:
+            board_shim = BoardShim(args.board_id, params)
+            board_shim.prepare_session()
+            board_shim.start_stream(450000, args.streamer_params)
         
-        Graph(board_shim)
+        pool = ChannelPool(args.threads)
+        logging.info('Channel filters: %s', pool.describe())
+        Viewer(size=(1920, 1080)).open(VIEW, partial(Graph, pool=pool), board_shim)
     except BaseException:
         logging.warning('Exception', exc_info=True)
     finally: